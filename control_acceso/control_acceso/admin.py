@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from django.utils.html import format_html
-from .models import Sede, Person, Visit, UserProfile, Estructura
+from .models import Sede, Person, Visit, UserProfile, Estructura, ExportJob
 
 # Define un filtro personalizado para visitas activas/inactivas
 class ActiveVisitFilter(admin.SimpleListFilter):
@@ -31,6 +31,7 @@ class UserProfileInline(admin.StackedInline):
 class UserAdmin(BaseUserAdmin):
     inlines = (UserProfileInline,)
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'get_sede')
+    list_select_related = ('profile__sede',)
     
     def get_sede(self, obj):
         if hasattr(obj, 'profile') and obj.profile.sede:
@@ -64,8 +65,8 @@ class PersonAdmin(admin.ModelAdmin):
 
 @admin.register(Visit)
 class VisitAdmin(admin.ModelAdmin):
-    list_display = ('person', 'fecha', 'hora_entrada', 'hora_salida', 'sede', 'area')
-    search_fields = ('person__dni', 'person__nombre', 'person__apellido', 'area__unidad_organica')
+    list_display = ('person', 'fecha', 'hora_entrada', 'hora_salida', 'sede', 'area', 'tarjeta')
+    search_fields = ('person__dni', 'person__nombre', 'person__apellido', 'area__unidad_organica', 'tarjeta')
     list_filter = ('fecha', 'sede', 'area', 'hora_salida')
     date_hierarchy = 'fecha'
     ordering = ('-fecha', '-hora_entrada')
@@ -76,3 +77,11 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'sede', 'is_admin')
     search_fields = ('user__username', 'sede__nombre')
     list_filter = ('is_admin', 'sede')
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'formato', 'status', 'progress', 'total_rows', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'formato')
+    readonly_fields = ('filtros', 'progress', 'total_rows', 'file_path', 'error', 'started_at', 'heartbeat_at',
+                       'attempts', 'finished_at')
@@ -1,135 +1,190 @@
 from django.db.models import Q
 from django.contrib.auth.decorators import login_required
-from .models import Visit, Person, Sede
-import datetime
-import base64
-
-from django.http import HttpResponse
-from django.template.loader import get_template
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from .models import ExportJob, Sede
+from .export_cache import cache_get
+from .pagination import KeysetPaginator
+from .scope import admin_required
 try:
-    from xhtml2pdf import pisa
-    XHTML2PDF_AVAILABLE = True
+    from .analytics import EXPORT_TABLES, PERCENTILES, analyze, export_table, overstay_rows
+    ANALYTICS_AVAILABLE = True
 except ImportError:
-    XHTML2PDF_AVAILABLE = False
-from django.templatetags.static import static
+    ANALYTICS_AVAILABLE = False
+from .reports import (
+    XHTML2PDF_AVAILABLE, get_export_cache_key, get_filtros, get_visitas_informe, iter_csv, iter_visitas_csv,
+    iter_visitas_xlsx,
+)
+from .xlsx import XLSX_CONTENT_TYPE, iter_xlsx
+import datetime
 import os
 
 @login_required
 def informe_visitas(request):
     sedes = Sede.objects.all()
     areas = Estructura.objects.filter(activo=True).order_by('unidad_organica')
-    visitas = Visit.objects.select_related('person', 'sede', 'area', 'created_by').all()
 
     # Filtros avanzados
-    fecha_inicio = request.GET.get('fecha_inicio', '').strip()
-    fecha_fin = request.GET.get('fecha_fin', '').strip()
-    nombre = request.GET.get('nombre', '').strip()
-    apellido = request.GET.get('apellido', '').strip()
-    dni = request.GET.get('dni', '').strip()
-    tarjetavisita = request.GET.get('tarjetavisita', '').strip()
-    sede_id = request.GET.get('sede', '').strip()
-    area_id = request.GET.get('area', '').strip()
-    usuario_id = request.GET.get('usuario', '').strip()
-
-    if fecha_inicio:
-        visitas = visitas.filter(fecha__gte=fecha_inicio)
-    if fecha_fin:
-        visitas = visitas.filter(fecha__lte=fecha_fin)
-    if nombre:
-        visitas = visitas.filter(person__nombre__icontains=nombre)
-    if apellido:
-        visitas = visitas.filter(person__apellido__icontains=apellido)
-    if dni:
-        visitas = visitas.filter(person__dni__icontains=dni)
-    if tarjetavisita:
-        visitas = visitas.filter(person__tarjetavisita__icontains=tarjetavisita)
-    if sede_id:
-        visitas = visitas.filter(sede_id=sede_id)
-    if area_id:
-        visitas = visitas.filter(area_id=area_id)
-    if usuario_id:
-        visitas = visitas.filter(created_by_id=usuario_id)
+    filtros = get_filtros(request.GET)
+
+    # Exportaciones tabulares sin fotos: se generan en streaming, con memoria constante
+    export = request.GET.get('export')
+    if export in ('csv', 'xlsx'):
+        if export == 'csv':
+            response = StreamingHttpResponse(iter_visitas_csv(filtros), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(iter_visitas_xlsx(filtros), content_type=XLSX_CONTENT_TYPE)
+        response['Content-Disposition'] = f'attachment; filename="informe_visitas.{export}"'
+        return response
 
     # Primero obtenemos los usuarios antes de hacer el slice
-    from django.core.paginator import Paginator
-    visitas_ordenadas = visitas.order_by('-fecha', '-hora_entrada')
+    visitas_ordenadas = get_visitas_informe(filtros)
     usuarios = visitas_ordenadas.values_list('created_by__id', 'created_by__first_name', 'created_by__last_name', 'created_by__username').distinct()
-    page_number = request.GET.get('page', 1)
-    paginator = Paginator(visitas_ordenadas, 20)
-    page_obj = paginator.get_page(page_number)
+    # Paginación por cursor (ver pagination.py)
+    page_obj = KeysetPaginator(visitas_ordenadas, 20).get_page(request.GET.get('cursor'))
     visitas_paginadas = page_obj.object_list
 
-    # Exportar a PDF con xhtml2pdf
+    # Exportar a PDF: se encola y lo genera el worker de exportaciones (manage.py export_worker)
     if request.GET.get('export') == 'pdf':
         if not XHTML2PDF_AVAILABLE:
             messages.error(request, 'xhtml2pdf no está instalado. No se puede exportar a PDF.')
         else:
-            # Para PDF, usar todos los registros filtrados (no paginados)
-            visitas_para_pdf = list(visitas_ordenadas)
-            visitas_pdf = []
-            for v in visitas_para_pdf:
-                foto_base64 = None
-                if v.person.photo:
-                    foto_base64 = 'data:image/jpeg;base64,' + base64.b64encode(v.person.photo).decode('utf-8')
-                if v.created_by:
-                    usuario_registro = v.created_by.get_full_name() or v.created_by.username
-                else:
-                    usuario_registro = "-"
-                visitas_pdf.append({
-                    'fecha': v.fecha,
-                    'dni': v.person.dni,
-                    'nombre': v.person.get_full_name(),
-                    'sede': v.sede.nombre,
-                    'area': v.area.unidad_organica,
-                    'hora_entrada': v.hora_entrada,
-                    'hora_salida': v.hora_salida if v.hora_salida else '-',
-                    'foto_base64': foto_base64,
-                    'usuario_registro': usuario_registro
-                })
-            # Obtener logo como base64
-            logo_base64 = None
-            try:
-                logo_path = os.path.join(
-                    os.path.dirname(__file__),
-                    'static', 'logo.png'
-                )
-                with open(logo_path, 'rb') as f:
-                    logo_base64 = 'data:image/png;base64,' + base64.b64encode(f.read()).decode('utf-8')
-            except Exception as e:
-                # Intentar ruta alternativa
+            # Si el mismo informe ya se generó y los datos no cambiaron, se entrega al instante
+            cache_key, _total = get_export_cache_key('pdf', filtros, request.user)
+            cached_path = cache_get(cache_key, 'pdf')
+            if cached_path:
                 try:
-                    logo_path = os.path.join(
-                        os.path.dirname(__file__),
-                        '..', 'static', 'logo.png'
-                    )
-                    with open(logo_path, 'rb') as f:
-                        logo_base64 = 'data:image/png;base64,' + base64.b64encode(f.read()).decode('utf-8')
-                except Exception:
-                    logo_base64 = None
-            template = get_template('admin/informe_visitas.html')
-            html = template.render({
-                'visitas': visitas_para_pdf,
-                'visitas_pdf': visitas_pdf,
-                'sedes': sedes,
-                'request': request,
-                'pdf_export': True,
-                'logo_base64': logo_base64,
-            })
-            response = HttpResponse(content_type='application/pdf')
-            response['Content-Disposition'] = 'attachment; filename="informe_visitas.pdf"'
-            pisa_status = pisa.CreatePDF(html, dest=response)
-            if pisa_status.err:
-                return HttpResponse('Error al generar el PDF', status=500)
-            return response
+                    return FileResponse(open(cached_path, 'rb'), as_attachment=True,
+                                        filename='informe_visitas.pdf', content_type='application/pdf')
+                except OSError:
+                    # Lo desalojó otro proceso (export_cache.evict) entre la consulta y la apertura:
+                    # se genera de nuevo
+                    pass
+
+            # Si ya hay una exportación igual en curso para este usuario, se reutiliza
+            job = ExportJob.objects.filter(
+                created_by=request.user, formato='pdf', filtros=filtros,
+                status__in=[ExportJob.STATUS_PENDING, ExportJob.STATUS_RUNNING]
+            ).first()
+            if job is None:
+                job = ExportJob.objects.create(created_by=request.user, formato='pdf', filtros=filtros)
+            return redirect('export_job_detail', job_id=job.id)
 
     return render(request, 'admin/informe_visitas.html', {
         'visitas': visitas_paginadas,
         'page_obj': page_obj,
-        'paginator': paginator,
         'sedes': sedes,
         'areas': areas,
         'usuarios': usuarios,
     })
+
+def _get_export_job(request, job_id):
+    """Obtiene una exportación, verificando que sea del usuario (o que sea superusuario)"""
+    job = get_object_or_404(ExportJob, id=job_id)
+    if job.created_by_id != request.user.id and not request.user.is_superuser:
+        raise Http404('Exportación no encontrada')
+    return job
+
+@login_required
+def export_job_detail(request, job_id):
+    """Vista con el estado de una exportación; la página consulta el progreso periódicamente"""
+    job = _get_export_job(request, job_id)
+    return render(request, 'admin/export_job.html', {'job': job})
+
+@login_required
+def export_job_status(request, job_id):
+    """Vista AJAX con el estado y el progreso de una exportación"""
+    job = _get_export_job(request, job_id)
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'total_rows': job.total_rows,
+        'error': job.error,
+        'download_url': reverse('export_job_download', args=[job.id]) if job.status == ExportJob.STATUS_DONE else None,
+    })
+
+@login_required
+def export_job_download(request, job_id):
+    """Descarga el archivo generado por una exportación terminada"""
+    job = _get_export_job(request, job_id)
+    if job.status != ExportJob.STATUS_DONE or not os.path.exists(job.file_path):
+        raise Http404('La exportación no está disponible')
+    return FileResponse(open(job.file_path, 'rb'), as_attachment=True,
+                        filename=f'informe_visitas.{job.formato}', content_type='application/pdf')
+# Días que se analizan cuando no se indica el rango
+ANALISIS_DIAS_POR_DEFECTO = 30
+# Visitas excedidas que se muestran en la página; la exportación trae todas
+ANALISIS_EXCEDIDAS_EN_PAGINA = 50
+
+@login_required
+@admin_required
+def analisis_visitas(request):
+    """Ocupación por hora, picos de concurrencia, duraciones por área y visitas excedidas (ver analytics.py)"""
+    if not ANALYTICS_AVAILABLE:
+        messages.error(request, 'numpy y pandas no están instalados. No se puede mostrar el análisis.')
+        return redirect('informe_visitas')
+    filtros = get_filtros(request.GET)
+    try:
+        hasta = datetime.date.fromisoformat(filtros['fecha_fin']) if 'fecha_fin' in filtros else timezone.localdate()
+        desde = (datetime.date.fromisoformat(filtros['fecha_inicio']) if 'fecha_inicio' in filtros
+                 else hasta - datetime.timedelta(days=ANALISIS_DIAS_POR_DEFECTO - 1))
+    except ValueError:
+        messages.error(request, 'Fecha inválida; se muestran los últimos días.')
+        hasta = timezone.localdate()
+        desde = hasta - datetime.timedelta(days=ANALISIS_DIAS_POR_DEFECTO - 1)
+    if desde > hasta:
+        desde, hasta = hasta, desde
+
+    resultado = analyze(filtros, desde, hasta)
+    sede_names = dict(Sede.objects.values_list('id', 'nombre'))
+    area_names = dict(Estructura.objects.values_list('id', 'unidad_organica'))
+
+    export = request.GET.get('export')
+    tabla = request.GET.get('tabla')
+    if export in ('csv', 'xlsx') and tabla in EXPORT_TABLES:
+        header, rows = export_table(resultado, tabla, sede_names, area_names)
+        if export == 'csv':
+            response = StreamingHttpResponse(iter_csv(header, rows), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(iter_xlsx(header, rows, sheet_name='Análisis'), content_type=XLSX_CONTENT_TYPE)
+        response['Content-Disposition'] = f'attachment; filename="analisis_visitas_{tabla}.{export}"'
+        return response
+
+    perfil = resultado['perfil']
+    chart = {
+        'labels': [f'{hour:02d}:00' for hour in perfil.index],
+        'series': [{'sede': sede_names.get(sede_id, sede_id), 'data': [round(float(v), 1) for v in perfil[sede_id]]}
+                   for sede_id in perfil.columns],
+    }
+    picos = [
+        {'sede': sede_names.get(sede_id), 'pico': int(row.pico), 'momento': row.momento.to_pydatetime()}
+        for sede_id, row in resultado['picos'].iterrows()
+    ]
+    duraciones = [
+        {'area': area_names.get(area_id), 'visitas': int(row['visitas']),
+         'valores': [round(float(row[column]), 1) for column in resultado['duraciones'].columns[1:]]}
+        for area_id, row in resultado['duraciones'].iterrows()
+    ]
+    return render(request, 'admin/analisis_visitas.html', {
+        'desde': desde,
+        'hasta': hasta,
+        'visitas_count': resultado['visitas'],
+        'chart': chart,
+        'picos': picos,
+        'duraciones': duraciones,
+        'percentiles': [f'P{int(p * 100)}' for p in PERCENTILES],
+        'excedidas': list(overstay_rows(resultado['excedidas'], sede_names, area_names,
+                                        limit=ANALISIS_EXCEDIDAS_EN_PAGINA)),
+        'excedidas_count': len(resultado['excedidas']),
+        'excedida_horas': settings.VISITA_EXCEDIDA_HORAS,
+        'sedes': Sede.objects.all(),
+        'areas': Estructura.objects.filter(activo=True).order_by('unidad_organica'),
+    })
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -0,0 +1,229 @@
+"""
+Análisis de ocupación y duración de visitas con numpy y pandas.
+
+Las visitas del rango se leen en una sola consulta como columnas (sin instanciar modelos
+ni convertir fila por fila en Python) y cada cálculo es vectorizado:
+
+- ocupación por hora y sede: visitas presentes en cada hora, con un arreglo de
+  diferencias (+1 en la hora de entrada, -1 después de la de salida) y una suma acumulada;
+- concurrencia máxima por sede: entradas y salidas ordenadas, suma acumulada y máximo;
+- percentiles de duración por área, de las visitas con salida;
+- visitas excedidas: las que duran (o llevan) más de settings.VISITA_EXCEDIDA_HORAS.
+
+Las horas son las locales con que se registran las visitas. Las visitas sin salida se
+cuentan presentes hasta ahora.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, CharField, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.utils import timezone
+from .models import Visit
+from .reports import filter_visitas
+
+PERCENTILES = (0.5, 0.75, 0.9, 0.95)
+
+_HOUR = pd.Timedelta(hours=1)
+
+
+def _timestamp_text(fecha, hora):
+    """'AAAA-MM-DD HH:MM:SS' armado en la base: un solo texto por momento, sin convertir en Python"""
+    return Concat(Cast(fecha, CharField()), Value(' '), Cast(hora, CharField()), output_field=CharField())
+
+
+def load_intervals(filtros):
+    """
+    Visitas de los filtros del informe como DataFrame: id, sede_id, area_id, entrada y
+    salida (NaT si la visita sigue activa).
+    """
+    visitas = (
+        filter_visitas(Visit.objects.all(), filtros).order_by()
+        .annotate(
+            entrada=_timestamp_text('fecha', 'hora_entrada'),
+            salida=Case(When(hora_salida__isnull=True, then=Value(None)),
+                        default=_timestamp_text(Coalesce('fecha_salida', 'fecha'), 'hora_salida'),
+                        output_field=CharField()),
+        )
+        .values_list('id', 'sede_id', 'area_id', 'entrada', 'salida')
+    )
+    # Se lee el cursor directamente: los textos pasan a pandas tal cual, que los convierte
+    # por columna
+    sql, params = visitas.query.sql_with_params()
+    with connections[visitas.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = list(zip(*cursor.fetchall())) or [()] * 5
+    ids, sedes, areas, entradas, salidas = columns
+    return pd.DataFrame({
+        'id': np.array(ids, dtype=np.int64),
+        'sede_id': np.array(sedes, dtype=np.int32),
+        'area_id': np.array(areas, dtype=np.int32),
+        'entrada': pd.to_datetime(pd.Series(entradas, dtype=object), format='ISO8601'),
+        'salida': pd.to_datetime(pd.Series(salidas, dtype=object), format='ISO8601'),
+    })
+
+
+def _effective_exit(intervals, now):
+    """Salida de cada visita; las activas, ahora (nunca antes de su entrada)"""
+    return intervals['salida'].fillna(now).where(lambda salida: salida >= intervals['entrada'],
+                                                 intervals['entrada'])
+
+
+def hourly_occupancy(intervals, desde, hasta, now):
+    """
+    Visitas presentes en cada hora entre `desde` y `hasta` (fechas, inclusive): DataFrame con
+    una fila por hora y una columna por sede.
+    """
+    start = pd.Timestamp(desde)
+    hours = pd.date_range(start, pd.Timestamp(hasta) + pd.Timedelta(days=1), freq='h', inclusive='left')
+    sedes, codes = np.unique(intervals['sede_id'].to_numpy(), return_inverse=True)
+    if not len(intervals):
+        return pd.DataFrame(index=hours, columns=sedes, dtype=np.int64)
+
+    n = len(hours)
+    first = ((intervals['entrada'] - start) // _HOUR).to_numpy()
+    # La hora en que sale no cuenta si sale justo al empezarla
+    last = ((_effective_exit(intervals, now) - start - pd.Timedelta(microseconds=1)) // _HOUR).to_numpy()
+    last = np.maximum(last, first)
+    visible = (last >= 0) & (first < n)
+    first, last, codes = np.clip(first[visible], 0, n - 1), np.clip(last[visible], 0, n - 1), codes[visible]
+
+    # Arreglo de diferencias por sede: +1 al entrar, -1 la hora siguiente a la salida
+    width = n + 1
+    size = len(sedes) * width
+    diff = (np.bincount(codes * width + first, minlength=size)
+            - np.bincount(codes * width + last + 1, minlength=size))
+    occupancy = np.cumsum(diff.reshape(len(sedes), width), axis=1)[:, :n]
+    return pd.DataFrame(occupancy.T, index=hours, columns=sedes)
+
+
+def hour_of_day_profile(occupancy):
+    """Ocupación promedio por hora del día (0-23) y sede"""
+    return occupancy.groupby(occupancy.index.hour).mean().reindex(range(24), fill_value=0)
+
+
+def peak_concurrency(intervals, now):
+    """
+    Máximo de visitas simultáneas por sede y el momento en que se alcanza por primera vez:
+    DataFrame indexado por sede con `pico` y `momento`.
+    """
+    if not len(intervals):
+        return pd.DataFrame(columns=['pico', 'momento'])
+    sede = intervals['sede_id'].to_numpy()
+    entrada = intervals['entrada'].to_numpy()
+    salida = _effective_exit(intervals, now).to_numpy()
+
+    times = np.concatenate([entrada, salida])
+    sedes = np.concatenate([sede, sede])
+    deltas = np.concatenate([np.ones(len(sede), dtype=np.int64), -np.ones(len(sede), dtype=np.int64)])
+    # Por sede y momento; a igual momento, la salida antes que la entrada
+    order = np.lexsort((deltas, times, sedes))
+    # Cada sede suma cero (toda visita tiene salida efectiva): la suma acumulada vuelve a
+    # cero al pasar de una sede a la siguiente
+    running = pd.Series(np.cumsum(deltas[order]))
+    sorted_sedes = sedes[order]
+    peaks = running.groupby(sorted_sedes).idxmax()
+    return pd.DataFrame({
+        'pico': running.to_numpy()[peaks.to_numpy()],
+        'momento': times[order][peaks.to_numpy()],
+    }, index=peaks.index)
+
+
+def duration_percentiles(intervals):
+    """Cantidad, promedio y percentiles (PERCENTILES) de la duración en minutos, por área"""
+    closed = intervals[intervals['salida'].notna()]
+    minutes = (closed['salida'] - closed['entrada']).dt.total_seconds() / 60
+    grouped = minutes.groupby(closed['area_id'])
+    result = pd.DataFrame({'visitas': grouped.size(), 'promedio': grouped.mean()})
+    if len(closed):
+        quantiles = grouped.quantile(list(PERCENTILES)).unstack()
+        quantiles.columns = [f'p{int(p * 100)}' for p in PERCENTILES]
+        result = result.join(quantiles)
+    return result.sort_values('visitas', ascending=False)
+
+
+def overstays(intervals, now, hours=None):
+    """
+    Visitas que duraron más de `hours` (settings.VISITA_EXCEDIDA_HORAS), o que siguen activas y
+    ya las superaron: id, sede_id, area_id, entrada, salida, activa y horas, de mayor a menor.
+    """
+    hours = settings.VISITA_EXCEDIDA_HORAS if hours is None else hours
+    duration = (_effective_exit(intervals, now) - intervals['entrada']).dt.total_seconds() / 3600
+    exceeded_mask = duration > hours
+    # Las horas también filtradas: con el índice completo, assign agregaría filas vacías
+    exceeded = intervals[exceeded_mask].assign(activa=lambda df: df['salida'].isna(),
+                                               horas=duration[exceeded_mask])
+    return exceeded.sort_values('horas', ascending=False)
+
+
+def analyze(filtros, desde, hasta, now=None):
+    """Todos los análisis de las visitas de los filtros del informe entre `desde` y `hasta`"""
+    now = pd.Timestamp(timezone.localtime(now or timezone.now()).replace(tzinfo=None))
+    intervals = load_intervals(dict(filtros, fecha_inicio=str(desde), fecha_fin=str(hasta)))
+    occupancy = hourly_occupancy(intervals, desde, hasta, now)
+    return {
+        'visitas': len(intervals),
+        'ocupacion': occupancy,
+        'perfil': hour_of_day_profile(occupancy),
+        'picos': peak_concurrency(intervals, now),
+        'duraciones': duration_percentiles(intervals),
+        'excedidas': overstays(intervals, now),
+    }
+
+
+# Tablas del análisis que se pueden exportar
+EXPORT_TABLES = ('ocupacion', 'picos', 'duraciones', 'excedidas')
+
+# Visitas excedidas por consulta al buscar los datos de las personas
+_OVERSTAY_CHUNK = 500
+
+
+def overstay_rows(excedidas, sede_names, area_names, limit=None):
+    """Filas de las visitas excedidas con los datos de la persona, consultados por tandas"""
+    if limit is not None:
+        excedidas = excedidas.head(limit)
+    for start in range(0, len(excedidas), _OVERSTAY_CHUNK):
+        chunk = excedidas.iloc[start:start + _OVERSTAY_CHUNK]
+        persons = {
+            visit_id: rest for visit_id, *rest in
+            Visit.objects.filter(id__in=chunk['id'].tolist())
+            .values_list('id', 'person__dni', 'person__apellido', 'person__nombre')
+        }
+        for row in chunk.itertuples(index=False):
+            dni, apellido, nombre = persons.get(row.id, (None, None, None))
+            yield (
+                row.id, dni, apellido, nombre, sede_names.get(row.sede_id), area_names.get(row.area_id),
+                row.entrada.to_pydatetime(), None if row.activa else row.salida.to_pydatetime(),
+                round(row.horas, 1),
+            )
+
+
+def export_table(result, tabla, sede_names, area_names):
+    """(encabezado, filas) de una tabla del análisis para exportar a CSV o XLSX"""
+    if tabla == 'ocupacion':
+        occupancy = result['ocupacion']
+
+        def rows():
+            for sede_id in occupancy.columns:
+                for hour, value in zip(occupancy.index, occupancy[sede_id].to_numpy()):
+                    yield sede_names.get(sede_id), hour.date(), hour.time(), int(value)
+
+        return ['Sede', 'Fecha', 'Hora', 'Visitas presentes'], rows()
+    if tabla == 'picos':
+        return ['Sede', 'Pico', 'Fecha', 'Hora'], (
+            (sede_names.get(sede_id), int(row.pico), row.momento.date(), row.momento.time())
+            for sede_id, row in result['picos'].iterrows()
+        )
+    if tabla == 'duraciones':
+        duraciones = result['duraciones']
+        header = ['Área', 'Visitas', 'Promedio (min)'] + [f'P{int(p * 100)} (min)' for p in PERCENTILES]
+        return header, (
+            (area_names.get(area_id), int(row['visitas']),
+             *[round(float(row.get(column, 0)), 1) for column in duraciones.columns[1:]])
+            for area_id, row in duraciones.iterrows()
+        )
+    if tabla == 'excedidas':
+        header = ['Visita', 'DNI', 'Apellido', 'Nombre', 'Sede', 'Área', 'Entrada', 'Salida', 'Horas']
+        return header, overstay_rows(result['excedidas'], sede_names, area_names)
+    raise ValueError(f'Tabla desconocida: {tabla}')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class ControlAccesoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'control_acceso'
+
+    def ready(self):
+        # Receptores de señales (perfil de usuario)
+        from . import signals  # noqa: F401
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class ProfileModelBackend(ModelBackend):
+    """
+    ModelBackend que carga el perfil (UserProfile) junto con el usuario de la sesión, en la
+    misma consulta. Así request.access_scope (ver scope.py) se arma en cada request con los
+    datos vigentes de la base, sin consultas aparte ni copias en la sesión o en el caché.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,117 @@
+"""
+Eventos de visitas en vivo (ingresos, salidas y tarjetas liberadas) para las pantallas de guardia.
+
+Visit.save() publica los eventos en VISIT_EVENTS cuando la transacción se confirma; la vista
+visit_events los envía a los navegadores como Server-Sent Events. Cada conexión abierta es
+una cola de asyncio esperando: no consulta la base ni ocupa un hilo mientras no hay eventos.
+
+El broker vive en memoria del proceso: sólo reciben los eventos las conexiones atendidas por
+el mismo proceso que guardó la visita. Hay que servir la aplicación ASGI con un único worker
+(p. ej. `uvicorn control_acceso.asgi:application`); con varios, los listados siguen
+actualizándose con la consulta periódica de active_visits_api.
+"""
+import asyncio
+import threading
+
+# Eventos pendientes por conexión; si un cliente no los consume se le pide recargar
+QUEUE_SIZE = 100
+# Segundos entre comentarios de keep-alive, para que proxies y navegadores no corten la conexión
+HEARTBEAT_SECONDS = 25
+
+CHECKIN = 'ingreso'
+CHECKOUT = 'salida'
+CARD_RELEASED = 'tarjeta_liberada'
+RELOAD = 'recargar'
+
+
+class Subscription:
+    """Cola de eventos de una conexión, de una sede o de todas (sede_id None)"""
+
+    def __init__(self, broker, sede_id):
+        self.broker = broker
+        self.sede_id = sede_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, event):
+        # Corre en el loop de la conexión
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Se perdieron eventos: el cliente tiene que volver a pedir el listado
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """Próximo evento, o None si pasa `timeout` sin eventos"""
+        if self.overflowed and self.queue.empty():
+            self.overflowed = False
+            return {'event': RELOAD, 'data': {}}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VisitEventBroker:
+    """
+    Distribuye los eventos a las conexiones suscriptas. publish() puede llamarse desde
+    cualquier hilo (las vistas síncronas corren en hilos aparte del loop de ASGI).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, sede_id=None):
+        """Debe llamarse dentro del loop de asyncio que va a leer los eventos"""
+        subscription = Subscription(self, sede_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def publish(self, event, sede_id, data):
+        message = {'event': event, 'data': dict(data, sede=sede_id)}
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if s.sede_id in (None, sede_id)]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, message)
+            except RuntimeError:
+                # El loop de esa conexión ya se cerró
+                self.unsubscribe(subscription)
+
+
+VISIT_EVENTS = VisitEventBroker()
+
+
+def visit_events_for(visit, created, closed):
+    """Eventos que corresponden a guardar `visit`: ingreso, o salida y liberación de la tarjeta"""
+    data = {'id': visit.pk, 'tarjeta': visit.tarjeta}
+    events = []
+    if created and visit.hora_salida is None:
+        events.append((CHECKIN, data))
+    if closed:
+        events.append((CHECKOUT, data))
+        if visit.tarjeta:
+            events.append((CARD_RELEASED, {'tarjeta': visit.tarjeta}))
+    return events
@@ -0,0 +1,91 @@
+"""
+Caché en disco de las exportaciones ya generadas.
+
+Cada archivo se guarda con el nombre de su clave (ver reports.get_export_cache_key).
+Cuando el directorio supera settings.EXPORT_CACHE_MAX_SIZE se borran los archivos
+usados hace más tiempo (LRU): cada acierto actualiza la fecha de modificación.
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+
+def _cache_path(key, ext):
+    return os.path.join(settings.EXPORT_CACHE_ROOT, f'{key}.{ext}')
+
+
+def _link_or_copy(src, dest):
+    """Enlace duro si el sistema de archivos lo permite (no ocupa espacio extra); si no, copia"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def cache_get(key, ext):
+    """Devuelve la ruta del archivo cacheado, o None si no está"""
+    path = _cache_path(key, ext)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def cache_get_copy(key, ext, dest):
+    """Deja en `dest` una copia del archivo cacheado; devuelve False si no está"""
+    path = cache_get(key, ext)
+    if path is None:
+        return False
+    try:
+        _link_or_copy(path, dest)
+    except FileNotFoundError:
+        # Lo desalojó otro proceso entre la consulta y la copia
+        return False
+    return True
+
+
+def cache_put(key, ext, src):
+    """Guarda en la caché una copia de `src` y aplica el límite de tamaño"""
+    os.makedirs(settings.EXPORT_CACHE_ROOT, exist_ok=True)
+    # Se escribe con otro nombre y se renombra, para que nadie lea un archivo a medio copiar
+    fd, tmp_path = tempfile.mkstemp(dir=settings.EXPORT_CACHE_ROOT, suffix='.tmp')
+    os.close(fd)
+    os.remove(tmp_path)
+    _link_or_copy(src, tmp_path)
+    os.replace(tmp_path, _cache_path(key, ext))
+    evict()
+
+
+def evict(max_size=None):
+    """Borra los archivos menos usados hasta que la caché entre en `max_size` bytes"""
+    if max_size is None:
+        max_size = settings.EXPORT_CACHE_MAX_SIZE
+    try:
+        entries = [entry for entry in os.scandir(settings.EXPORT_CACHE_ROOT)
+                   if entry.is_file() and not entry.name.endswith('.tmp')]
+    except FileNotFoundError:
+        return 0
+
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _mtime, size, _path in files)
+    removed = 0
+    for _mtime, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
@@ -1,13 +1,15 @@
 from django import forms
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from .models import Person, Visit, Sede, Estructura
+from .models import Person, PersonPhoto, Visit, Sede, Estructura
 import base64
 import re
 from datetime import datetime
 
 class PersonForm(forms.ModelForm):
     photo_data_url = forms.CharField(widget=forms.HiddenInput(), required=False)
+    # Hash de una foto ya guardada, para reutilizarla sin volver a enviar la imagen
+    photo_hash = forms.CharField(widget=forms.HiddenInput(), required=False, max_length=64)
     
     class Meta:
         model = Person
@@ -34,10 +36,17 @@ class PersonForm(forms.ModelForm):
         cleaned_data = super().clean()
         # Solo exigir foto si es nuevo
         photo_data_url = cleaned_data.get('photo_data_url')
-        if not self.instance.pk and not photo_data_url:
+        photo_hash = cleaned_data.get('photo_hash')
+        if photo_hash and not PersonPhoto.objects.filter(sha256=photo_hash).exists():
+            self.add_error('photo_hash', 'La foto seleccionada no existe')
+            photo_hash = None
+        if not self.instance.pk and not photo_data_url and not photo_hash:
             self.add_error('photo_data_url', 'La foto es obligatoria')
         return cleaned_data
 
+    def clean_photo_hash(self):
+        return self.cleaned_data.get('photo_hash') or None
+
 class VisitForm(forms.ModelForm):
     class Meta:
         model = Visit
@@ -67,6 +76,20 @@ class VisitForm(forms.ModelForm):
         self.fields['receptor_nombre'].required = True
         self.fields['receptor_apellido'].required = True
 
+# Formularios de la API de ingreso (checkin_api): los mismos campos y validaciones, en JSON
+class CheckinPersonForm(PersonForm):
+    def validate_unique(self):
+        # La persona ya se buscó por DNI; si otra terminal la crea a la vez, la restricción
+        # única de la base rechaza el INSERT. Se evita así una consulta más por ingreso.
+        pass
+
+
+class CheckinVisitForm(VisitForm):
+    class Meta(VisitForm.Meta):
+        # Fecha y hora de entrada las pone el servidor
+        fields = ['sede', 'area', 'receptor_nombre', 'receptor_apellido', 'observaciones']
+
+
 # Formularios para administración
 class SedeForm(forms.ModelForm):
     class Meta:
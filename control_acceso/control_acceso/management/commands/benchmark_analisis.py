@@ -0,0 +1,53 @@
+import datetime
+import time
+
+import pandas as pd
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from control_acceso import analytics
+from control_acceso.reports import get_filtros
+
+
+class Command(BaseCommand):
+    help = ('Medir el análisis de visitas (ocupación por hora, picos, duraciones y excedidas) por etapa '
+            'sobre un rango de fechas; por defecto, el último año.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha-inicio', help='AAAA-MM-DD (por defecto, un año antes de --fecha-fin)')
+        parser.add_argument('--fecha-fin', help='AAAA-MM-DD (por defecto, hoy)')
+        parser.add_argument('--sede', help='ID de sede')
+        parser.add_argument('--repeat', type=int, default=1, help='Veces que se repite; se informa la mejor')
+
+    def handle(self, *args, **options):
+        try:
+            hasta = datetime.date.fromisoformat(options['fecha_fin']) if options['fecha_fin'] else timezone.localdate()
+            desde = (datetime.date.fromisoformat(options['fecha_inicio']) if options['fecha_inicio']
+                     else hasta - datetime.timedelta(days=365))
+        except ValueError as e:
+            raise CommandError(f'Fecha inválida: {e}')
+        filtros = get_filtros({'sede': options['sede'] or ''})
+        filtros.update(fecha_inicio=str(desde), fecha_fin=str(hasta))
+        now = pd.Timestamp(timezone.localtime().replace(tzinfo=None))
+
+        stages = [
+            ('lectura', lambda data: analytics.load_intervals(filtros)),
+            ('ocupacion', lambda data: analytics.hourly_occupancy(data['lectura'], desde, hasta, now)),
+            ('perfil', lambda data: analytics.hour_of_day_profile(data['ocupacion'])),
+            ('picos', lambda data: analytics.peak_concurrency(data['lectura'], now)),
+            ('duraciones', lambda data: analytics.duration_percentiles(data['lectura'])),
+            ('excedidas', lambda data: analytics.overstays(data['lectura'], now)),
+        ]
+        best = {}
+        for _ in range(max(1, options['repeat'])):
+            data = {}
+            for name, stage in stages:
+                start = time.perf_counter()
+                data[name] = stage(data)
+                elapsed = time.perf_counter() - start
+                best[name] = min(best.get(name, elapsed), elapsed)
+
+        self.stdout.write(f'{len(data["lectura"])} visitas del {desde} al {hasta}')
+        for name, _stage in stages:
+            self.stdout.write(f'  {name:<12} {best[name]:>8.3f} s')
+        self.stdout.write(self.style.SUCCESS(f'  {"total":<12} {sum(best.values()):>8.3f} s'))
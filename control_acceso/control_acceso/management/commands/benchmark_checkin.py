@@ -0,0 +1,109 @@
+import io
+import json
+import time
+
+from PIL import Image
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from control_acceso.models import Estructura, Person, PersonPhoto, Sede, UserProfile, Visit
+
+
+class Command(BaseCommand):
+    help = ('Comparar los requests y consultas por visitante al registrar ingresos con el formulario '
+            'anterior (búsqueda por DNI, foto, chequeo de tarjeta y POST del formulario) y con la API '
+            'de ingreso (checkin_api), para visitantes ya cargados. '
+            'Los datos de prueba se descartan al terminar.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visitantes', type=int, default=50, help='Ingresos por flujo')
+
+    def handle(self, *args, **options):
+        total = options['visitantes']
+        with transaction.atomic():
+            user, sede, area, persons = self._setup(total)
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            # El alcance del usuario queda en la sesión, como después del primer request
+            client.get(reverse('home'))
+            for label, flow in (
+                ('formulario anterior', self._form_flow),
+                # La página de registro todavía busca por DNI para completar los datos
+                ('formulario con API', lambda *args: self._search(*args) + self._checkin(*args)),
+                ('sólo API', self._checkin),
+            ):
+                requests, statements, elapsed = self._run(client, flow, persons, sede, area)
+                self.stdout.write(
+                    f'{label:<20} {requests / total:>4.1f} requests  {statements / total:>5.1f} consultas  '
+                    f'{elapsed / total * 1000:>6.1f} ms por visitante'
+                )
+                # Los mismos visitantes vuelven a ingresar con el flujo siguiente
+                now = timezone.localtime(timezone.now())
+                Visit.objects.filter(sede=sede, hora_salida__isnull=True).update(
+                    fecha_salida=now.date(), hora_salida=now.time())
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS(f'{total} ingresos por flujo de visitantes ya cargados'))
+
+    def _setup(self, total):
+        sede = Sede.objects.create(nombre='Sede benchmark de ingresos')
+        user = User.objects.create_user(username='__benchmark_checkin__')
+        UserProfile.objects.create(user=user, sede=sede, is_admin=False)
+        area = Estructura.objects.filter(activo=True).first()
+        if area is None:
+            raise CommandError('Se necesita al menos un área (Estructura) activa cargada')
+        image = io.BytesIO()
+        Image.new('RGB', (64, 64), 'gray').save(image, 'JPEG')
+        photo = PersonPhoto.objects.store(image.getvalue())
+        dni = (Person.objects.aggregate(max_dni=Max('dni'))['max_dni'] or 0) + 1
+        persons = Person.objects.bulk_create(
+            Person(dni=dni + i, nombre='Benchmark', apellido=f'Ingreso {i}',
+                   tarjetavisita=str(90000 + i), stored_photo=photo)
+            for i in range(total)
+        )
+        return user, sede, area, persons
+
+    def _run(self, client, flow, persons, sede, area):
+        """(requests, consultas sin savepoints, segundos) de registrar el ingreso de cada persona"""
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            requests = sum(flow(client, person, sede, area) for person in persons)
+        elapsed = time.perf_counter() - start
+        statements = sum(1 for query in queries.captured_queries
+                         if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT')))
+        return requests, statements, elapsed
+
+    def _search(self, client, person, sede, area):
+        """Búsqueda por DNI y foto existente, como al completar el DNI en la página de registro"""
+        data = client.get(reverse('search_person'), {'dni': person.dni}).json()
+        client.get(data['photo_url'])
+        return 2
+
+    def _form_flow(self, client, person, sede, area):
+        requests = self._search(client, person, sede, area)
+        client.get(reverse('check_tarjeta_disponible'), {'tarjeta': person.tarjetavisita, 'sede_id': sede.id})
+        now = timezone.localtime(timezone.now())
+        response = client.post(reverse('register_visit'), {
+            'person_id': person.id, 'dni': person.dni, 'nombre': person.nombre, 'apellido': person.apellido,
+            'telefono': '', 'email': '', 'tarjetavisita': person.tarjetavisita, 'observaciones': '',
+            'photo_data_url': '', 'photo_hash': person.photo_hash,
+            'fecha': now.date().isoformat(), 'hora_entrada': now.strftime('%H:%M'),
+            'sede': sede.id, 'area': area.id, 'receptor_nombre': 'BENCHMARK', 'receptor_apellido': 'INGRESO',
+        })
+        if response.status_code != 302:
+            raise CommandError(f'El formulario de registro respondió {response.status_code}')
+        return requests + 2
+
+    def _checkin(self, client, person, sede, area):
+        response = client.post(reverse('checkin_api'), json.dumps({
+            'persona': {'dni': person.dni},
+            'visita': {'area': area.id, 'receptor_nombre': 'BENCHMARK', 'receptor_apellido': 'INGRESO'},
+        }), content_type='application/json')
+        if response.status_code != 201:
+            raise CommandError(f'La API de ingreso respondió {response.status_code}: {response.content[:200]}')
+        return 1
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from pypdf import PdfReader
+from control_acceso.reports import PDF_ENGINES, ReportError, get_filtros, render_informe_pdf
+
+
+class Command(BaseCommand):
+    help = ('Comparar los motores del PDF del informe de visitas (filas por segundo) '
+            'sobre las visitas de la base. Para volúmenes grandes, poblar antes la base (populate_db).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', choices=PDF_ENGINES, action='append',
+                            help='Motor a medir (se puede repetir). Por defecto, todos')
+        parser.add_argument('--repeat', type=int, default=1,
+                            help='Veces que se genera cada PDF; se informa la mejor')
+        parser.add_argument('--fecha-inicio', help='Filtro del informe (AAAA-MM-DD)')
+        parser.add_argument('--fecha-fin', help='Filtro del informe (AAAA-MM-DD)')
+        parser.add_argument('--sede', help='Filtro del informe (ID de sede)')
+
+    def handle(self, *args, **options):
+        filtros = get_filtros({
+            'fecha_inicio': options['fecha_inicio'] or '',
+            'fecha_fin': options['fecha_fin'] or '',
+            'sede': options['sede'] or '',
+        })
+
+        self.stdout.write(f'{"Motor":<10} {"Filas":>8} {"Páginas":>8} {"Segundos":>9} {"Filas/s":>9} {"KB":>8}')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for engine in options['engine'] or PDF_ENGINES:
+                path = os.path.join(tmpdir, f'{engine}.pdf')
+                best = None
+                for _ in range(max(1, options['repeat'])):
+                    start = time.perf_counter()
+                    try:
+                        with open(path, 'wb') as dest:
+                            rows = render_informe_pdf(filtros, None, dest, engine=engine)
+                    except ReportError as e:
+                        raise CommandError(f'{engine}: {e}')
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+
+                pages = len(PdfReader(path).pages)
+                self.stdout.write(
+                    f'{engine:<10} {rows:>8} {pages:>8} {best:>9.2f} {rows / best:>9.1f} {os.path.getsize(path) // 1024:>8}'
+                )
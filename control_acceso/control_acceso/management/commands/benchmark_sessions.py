@@ -0,0 +1,92 @@
+import logging
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from control_acceso.models import Person, Sede, UserProfile
+
+# Configuración anterior: sesiones en la base, guardadas en cada request
+EVERY_REQUEST_SETTINGS = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'SESSION_SAVE_EVERY_REQUEST': True,
+    'MIDDLEWARE': [
+        'django.contrib.sessions.middleware.SessionMiddleware'
+        if name == 'control_acceso.middleware.SlidingSessionMiddleware' else name
+        for name in settings.MIDDLEWARE
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = ('Contar las lecturas y escrituras de django_session por request en una jornada simulada '
+            '(home, listado, búsqueda de personas, tarjetas, fotos y consulta de visitas activas), '
+            'con la sesión guardada en cada request y con la configuración actual. '
+            'Los datos de prueba se descartan al terminar.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=600, help='Requests por configuración')
+        parser.add_argument('--intervalo', type=float, default=10,
+                            help='Segundos simulados entre un request y el siguiente')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, person, sede = self._setup()
+            urls = [
+                (reverse('home'), {}),
+                (reverse('visit_list'), {}),
+                (reverse('search_person'), {'dni': person.dni}),
+                (reverse('check_tarjeta_disponible'), {'tarjeta': person.tarjetavisita, 'sede_id': sede.id}),
+                (reverse('get_person_photo_sized', args=[person.id, 'thumb']), {}),
+                (reverse('active_visits_api'), {}),
+            ]
+            for label, overrides in (('cada request', EVERY_REQUEST_SETTINGS), ('actual', {})):
+                with override_settings(**overrides):
+                    reads, writes, elapsed = self._run(user, urls, options['requests'], options['intervalo'])
+                total = options['requests']
+                self.stdout.write(
+                    f'{label:<14} {writes:>5} escrituras ({writes / total:.3f}/request)  '
+                    f'{reads:>5} lecturas ({reads / total:.3f}/request)  {elapsed:.2f} s'
+                )
+            transaction.set_rollback(True)
+        minutes = options['requests'] * options['intervalo'] / 60
+        self.stdout.write(self.style.SUCCESS(
+            f'{options["requests"]} requests en {minutes:.0f} minutos simulados '
+            f'(SESSION_REFRESH_THRESHOLD={settings.SESSION_REFRESH_THRESHOLD} s)'
+        ))
+
+    def _setup(self):
+        sede = Sede.objects.create(nombre='Sede benchmark de sesiones')
+        user = User.objects.create_user(username='__benchmark_sessions__')
+        UserProfile.objects.create(user=user, sede=sede, is_admin=False)
+        dni = (Person.objects.aggregate(max_dni=Max('dni'))['max_dni'] or 0) + 1
+        person = Person.objects.create(dni=dni, nombre='Benchmark', apellido='Sesiones', tarjetavisita='9999')
+        return user, person, sede
+
+    def _run(self, user, urls, total, interval):
+        """(lecturas, escrituras, segundos) de django_session en `total` requests, sin contar el login"""
+        clock = [time.time()]
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        start = time.perf_counter()
+        # La persona de prueba no tiene foto: no registrar cada 404
+        request_logger = logging.getLogger('django.request')
+        with mock.patch('control_acceso.middleware.time') as fake_time, \
+                mock.patch.object(request_logger, 'disabled', True), \
+                CaptureQueriesContext(connection) as queries:
+            fake_time.time.side_effect = lambda: clock[0]
+            for i in range(total):
+                url, params = urls[i % len(urls)]
+                client.get(url, params)
+                clock[0] += interval
+        elapsed = time.perf_counter() - start
+        session_queries = [q['sql'].lstrip().split(None, 1)[0].upper()
+                           for q in queries.captured_queries if 'django_session' in q['sql']]
+        reads = sum(1 for verb in session_queries if verb == 'SELECT')
+        return reads, len(session_queries) - reads, elapsed
@@ -0,0 +1,77 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from control_acceso.analytics import analyze, overstay_rows
+from control_acceso.models import Estructura, Person, Sede, Visit
+
+# (nombre, visitas como (horas desde la entrada hasta ahora, duración en horas o None si
+# sigue activa), visitas excedidas esperadas) con VISITA_EXCEDIDA_HORAS=8
+CASES = [
+    ('sin visitas', [], 0),
+    ('sin excedidas', [(30, 1), (28, 1)], 0),
+    ('con excedidas', [(30, 1), (28, 10), (10, None)], 2),
+]
+
+
+class Command(BaseCommand):
+    help = ('Verificar el análisis de visitas (analytics.py) y su página y exportación de excedidas con '
+            'rangos sin visitas, sin visitas excedidas y con excedidas. '
+            'Los datos de prueba se descartan al terminar.')
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            area = Estructura.objects.first()
+            if area is None:
+                raise CommandError('Se necesita al menos un área (Estructura) cargada')
+            user = User.objects.create_superuser(username='__check_analisis__')
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            dni = (Person.objects.aggregate(max_dni=Max('dni'))['max_dni'] or 0) + 1
+            now = timezone.localtime(timezone.now()).replace(microsecond=0)
+
+            for name, visits, expected in CASES:
+                sede = Sede.objects.create(nombre=f'Sede chequeo de análisis ({name})')
+                for hours_ago, duration in visits:
+                    person = Person.objects.create(dni=dni, nombre='Chequeo', apellido='Análisis')
+                    dni += 1
+                    entrada = now - datetime.timedelta(hours=hours_ago)
+                    salida = entrada + datetime.timedelta(hours=duration) if duration is not None else None
+                    Visit.objects.create(
+                        person=person, sede=sede, area=area, created_by=user,
+                        fecha=entrada.date(), hora_entrada=entrada.time(),
+                        fecha_salida=salida.date() if salida else None, hora_salida=salida.time() if salida else None,
+                    )
+                desde, hasta = (now - datetime.timedelta(days=2)).date(), now.date()
+                filtros = {'sede': str(sede.id), 'fecha_inicio': str(desde), 'fecha_fin': str(hasta)}
+                failures += self._check_case(client, name, filtros, desde, hasta, expected)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('Errores en el análisis de visitas:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Análisis de visitas correcto'))
+
+    def _check_case(self, client, name, filtros, desde, hasta, expected):
+        failures = []
+        excedidas = analyze(filtros, desde, hasta)['excedidas']
+        rows = list(overstay_rows(excedidas, {}, {}))
+        if len(excedidas) != expected or len(rows) != expected or excedidas['id'].isna().any():
+            failures.append(f'  {name}: {len(excedidas)} excedidas ({len(rows)} filas); se esperaban {expected}')
+
+        url = reverse('analisis_visitas')
+        for label, params in (('página', {}), ('exportación', {'export': 'csv', 'tabla': 'excedidas'})):
+            response = client.get(url, {**filtros, **params})
+            if response.status_code == 200 and response.streaming:
+                # La exportación se genera al recorrerla
+                b''.join(response.streaming_content)
+            if response.status_code != 200:
+                failures.append(f'  {name}: la {label} respondió {response.status_code}')
+        if not failures:
+            self.stdout.write(f'  {name}: ok ({expected} excedidas)')
+        return failures
@@ -0,0 +1,198 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from control_acceso.models import DailyCounter, Estructura, Person, Sede, UserProfile, Visit, VisitRollup
+from control_acceso.pagination import KeysetPaginator
+
+VISIT_TABLE = Visit._meta.db_table
+PERSON_TABLE = Person._meta.db_table
+COUNTER_TABLE = DailyCounter._meta.db_table
+ROLLUP_TABLE = VisitRollup._meta.db_table
+
+# Volumen simulado: los planes se calculan con estadísticas de SQLite (sqlite_stat1) de una
+# base con millones de visitas, aunque la base actual tenga pocas
+SIMULATED_ROWS = {VISIT_TABLE: 5_000_000, PERSON_TABLE: 1_000_000, COUNTER_TABLE: 73_000, ROLLUP_TABLE: 2_000_000}
+# Los contadores diarios (una fila por sede y día) se suman completos para los administradores
+FULL_SCAN_ALLOWED = {COUNTER_TABLE}
+SIMULATED_ACTIVE_VISITS = 4_000
+SIMULATED_DISTINCT = {
+    'sede_id': 20, 'fecha': 3_650, 'hora_entrada': 1_440,
+    'person_id': 500_000, 'created_by_id': 200, 'area_id': 1_000,
+}
+
+# Índices de Visit, Person y DailyCounter que debe usar cada vista, según el perfil del usuario. Los índices de
+# las claves foráneas (nombre generado por Django) y de las restricciones únicas sin condición
+# (sqlite_autoindex_...) se indican por sus columnas: '(person_id)'.
+# Las restricciones únicas de visitas activas también son índices parciales: SQLite las
+# prefiere para contar visitas activas y para buscar la visita activa de una persona o tarjeta
+EXPECTED_INDEXES = {
+    'sede': {
+        'home': {'(sede_id, fecha)', 'visit_sede_fecha_idx'},
+        'visit_list': {'visit_activa_sede_idx'},
+        'visit_history': {'visit_sede_fecha_idx', 'visit_sede_usuario_idx'},
+        'search_person': {'visit_persona_activa_unica'},
+        'check_tarjeta_disponible': {'visit_tarjeta_activa_unica'},
+        'visit_history_dni': {'(dni_texto)', '(person_id)'},
+        'visit_history_cursor': {'visit_sede_fecha_idx'},
+        'active_visits_since': {'visit_sede_updated_idx'},
+        'visit_stats': {'(sede_id, fecha, area_id, created_by_id)'},
+    },
+    'admin': {
+        'home': {'visit_fecha_idx'},
+        'visit_list': {'visit_persona_activa_unica'},
+        'visit_history': {'visit_fecha_idx'},
+        'search_person': {'visit_persona_activa_unica'},
+        'check_tarjeta_disponible': {'visit_tarjeta_activa_unica'},
+        'visit_history_dni': {'(dni_texto)', '(person_id)'},
+        'person_list_dni': {'(dni_texto)'},
+        'informe_visitas_dni': {'(dni_texto)', '(person_id)'},
+        'visit_history_cursor': {'visit_fecha_idx'},
+        'informe_visitas_cursor': {'visit_fecha_idx'},
+        'active_visits_since': {'visit_updated_idx'},
+        'visit_stats': {'visit_rollup_fecha_idx'},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ('Verificar con EXPLAIN que las consultas de visitas de las vistas más usadas '
+            '(home, visit_list, visit_history, search_person, check_tarjeta_disponible, las búsquedas '
+            'por DNI, las páginas siguientes por cursor, los cambios de visitas activas y las estadísticas) '
+            'usan los índices de Visit, Person, los contadores y los resúmenes, y no recorren las tablas completas. '
+            'Los datos de prueba se descartan al terminar.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Mostrar el plan de cada consulta')
+        parser.add_argument('--real-stats', action='store_true',
+                            help='Usar las estadísticas de la base en lugar de simular millones de visitas')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'El chequeo interpreta planes de SQLite; la base actual es {connection.vendor}')
+
+        failures = []
+        with transaction.atomic():
+            sede, person, users = self._setup()
+            cursor = KeysetPaginator(Visit.objects.filter(sede=sede), 1, count=False).get_page().next_cursor
+            if not options['real_stats']:
+                self._simulate_volume()
+            for profile, user in users.items():
+                self.stdout.write(f'Usuario {profile}:')
+                client = Client(HTTP_HOST='localhost')
+                client.force_login(user)
+                for name, url, params in [
+                    ('home', reverse('home'), {}),
+                    ('visit_list', reverse('visit_list'), {}),
+                    ('visit_history', reverse('visit_history'), {}),
+                    ('search_person', reverse('search_person'), {'dni': person.dni}),
+                    ('check_tarjeta_disponible', reverse('check_tarjeta_disponible'),
+                     {'tarjeta': person.tarjetavisita, 'sede_id': sede.id}),
+                    # Búsqueda por los primeros dígitos del DNI
+                    ('visit_history_dni', reverse('visit_history'), {'dni': str(person.dni)[:4]}),
+                    ('person_list_dni', reverse('person_list'), {'dni': str(person.dni)[:4]}),
+                    ('informe_visitas_dni', reverse('informe_visitas'), {'dni': str(person.dni)[:4]}),
+                    # Páginas siguientes de la paginación por cursor
+                    ('visit_history_cursor', reverse('visit_history'), {'cursor': cursor}),
+                    ('informe_visitas_cursor', reverse('informe_visitas'), {'cursor': cursor}),
+                    # Actualización incremental del listado de visitas activas
+                    ('active_visits_since', reverse('active_visits_api'), {'since': timezone.now().isoformat()}),
+                    # Estadísticas de los resúmenes diarios
+                    ('visit_stats', reverse('visit_stats_api'), {'agrupar': 'area'}),
+                ]:
+                    if name not in EXPECTED_INDEXES[profile]:
+                        # Vista sólo para administradores
+                        continue
+                    expected = EXPECTED_INDEXES[profile][name]
+                    failures += self._check_view(client, f'{profile}/{name}', url, params, expected,
+                                                 options['verbose_plans'])
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('Consultas sin el índice esperado:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Todas las consultas de visitas usan índices'))
+
+    def _setup(self):
+        """Un usuario de sede y un administrador, con una visita terminada y una activa, como en la operación diaria"""
+        sede = Sede.objects.create(nombre='Sede chequeo de planes')
+        users = {}
+        for profile, is_admin in (('sede', False), ('admin', True)):
+            user = User.objects.create_user(username=f'__check_query_plans_{profile}__')
+            UserProfile.objects.create(user=user, sede=sede, is_admin=is_admin)
+            users[profile] = user
+        dni = (Person.objects.aggregate(max_dni=Max('dni'))['max_dni'] or 0) + 1
+        person = Person.objects.create(dni=dni, nombre='Chequeo', apellido='Planes', tarjetavisita='9999')
+        area = Estructura.objects.first()
+        if area is None:
+            raise CommandError('Se necesita al menos un área (Estructura) cargada')
+        now = timezone.localtime(timezone.now())
+        Visit.objects.create(person=person, sede=sede, area=area, created_by=users['sede'],
+                             fecha_salida=now.date(), hora_salida=now.time())
+        Visit.objects.create(person=person, sede=sede, area=area, created_by=users['sede'])
+        return sede, person, users
+
+    def _simulate_volume(self):
+        """Reemplaza las estadísticas de Visit y Person por las de tablas grandes (se descartan con el rollback)"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE sqlite_schema')  # Crea sqlite_stat1 si no existe
+            for table, table_rows in SIMULATED_ROWS.items():
+                cursor.execute('DELETE FROM sqlite_stat1 WHERE tbl = %s', [table])
+                cursor.execute('INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (%s, NULL, %s)',
+                               [table, str(table_rows)])
+                cursor.execute(f'PRAGMA index_list("{table}")')
+                for _seq, index, _unique, _origin, partial in cursor.fetchall():
+                    cursor.execute(f'PRAGMA index_info("{index}")')
+                    columns = [row[2] for row in cursor.fetchall()]
+                    rows = SIMULATED_ACTIVE_VISITS if partial else table_rows
+                    stat, distinct = [rows], 1
+                    for column in columns:
+                        distinct *= SIMULATED_DISTINCT.get(column, rows)
+                        stat.append(max(1, rows // distinct))
+                    cursor.execute('INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (%s, %s, %s)',
+                                   [table, index, ' '.join(map(str, stat))])
+            # Recargar las estadísticas en la conexión
+            cursor.execute('ANALYZE sqlite_schema')
+
+    def _check_view(self, client, name, url, params, expected, verbose):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, params)
+        if response.status_code != 200:
+            return [f'{name}: respuesta {response.status_code}']
+
+        used = set()
+        failures = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or not any(f'"{table}"' in sql for table in SIMULATED_ROWS):
+                    continue
+                # Las tablas pueden aparecer con alias en las subconsultas (p. ej. U0)
+                names = set(SIMULATED_ROWS)
+                for table in SIMULATED_ROWS:
+                    names |= set(re.findall(rf'"{table}" (\w+)', sql))
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+                if verbose:
+                    self.stdout.write(f'  {name}: {sql}\n      ' + '\n      '.join(plan))
+                for step in plan:
+                    words = step.split()
+                    if (words[0] == 'SCAN' and words[1] in names and 'INDEX' not in step
+                            and words[1] not in FULL_SCAN_ALLOWED):
+                        failures.append(f'{name}: recorre una tabla completa ({step})\n    {sql}')
+                    if 'INDEX ' in step:
+                        used.add(step.split('INDEX ')[1].split()[0])
+            for index in list(used):
+                cursor.execute(f'PRAGMA index_info("{index}")')
+                used.add('(' + ', '.join(row[2] for row in cursor.fetchall()) + ')')
+
+        for index in sorted(expected - used):
+            failures.append(f'{name}: no usa {index}')
+        status = self.style.ERROR('FALLA') if failures else self.style.SUCCESS('ok')
+        self.stdout.write(f'  {name}: {status} ({", ".join(sorted(i for i in used if not i.startswith("("))) or "-"})')
+        return failures
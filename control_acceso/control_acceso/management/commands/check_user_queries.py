@@ -0,0 +1,98 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from control_acceso.models import Sede, UserProfile
+
+# Consultas propias del perfil; el JOIN con que llega junto al usuario (ver backends.py) no cuenta
+PROFILE_QUERY = re.compile(r'^(SELECT .*? FROM|INSERT INTO|UPDATE|DELETE FROM) "%s"' % UserProfile._meta.db_table)
+USERNAME = '__check_user_queries__'
+PASSWORD = 'chequeo-de-consultas'
+
+# Consultas esperadas por operación (sin contar savepoints): (total, al perfil); total None
+# si depende de la vista
+EXPECTED_QUERIES = {
+    # INSERT del usuario; el perfil se crea recién cuando se necesita
+    'alta de usuario': (1, 0),
+    # SELECT del usuario, UPDATE de last_login y la sesión nueva (SELECT, INSERT y UPDATE)
+    'login': (5, 0),
+    # Primer request: el usuario llega sin perfil y se crea (SELECT e INSERT)
+    'primer request': (None, 2),
+    # El perfil llega con el usuario de la sesión: ninguna consulta aparte
+    'request siguiente': (None, 0),
+    # Guardar el usuario sin tocar el perfil (esté cargado o no) no lo guarda
+    'guardar usuario': (1, 0),
+    'guardar usuario con perfil cargado': (1, 0),
+    # Con el perfil modificado en memoria, un solo UPDATE de los campos cambiados
+    'guardar usuario con perfil modificado': (2, 1),
+}
+
+
+class Command(BaseCommand):
+    help = ('Verificar cuántas consultas hacen el alta de un usuario, el login y los requests '
+            'siguientes, y que guardar un usuario sólo guarde su perfil si cambió. '
+            'Los datos de prueba se descartan al terminar.')
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            for name, operation in self._operations():
+                with CaptureQueriesContext(connection) as queries:
+                    operation()
+                statements = [query['sql'] for query in queries.captured_queries
+                              if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+                total = len(statements)
+                profile = sum(1 for sql in statements if PROFILE_QUERY.match(sql))
+                expected_total, expected_profile = EXPECTED_QUERIES[name]
+                if profile == expected_profile and expected_total in (None, total):
+                    self.stdout.write(f'  {name}: ok ({total} consultas, {profile} al perfil)')
+                else:
+                    failures.append(f'  {name}: {total} consultas, {profile} al perfil; '
+                                    f'se esperaban {expected_total or "-"} y {expected_profile}')
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('Cantidad de consultas distinta de la esperada:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Consultas de usuarios y perfiles correctas'))
+
+    def _operations(self):
+        """(nombre, función) de cada operación a medir, en orden; cada una prepara la siguiente"""
+        client = Client(HTTP_HOST='localhost')
+        sede = Sede.objects.create(nombre='Sede chequeo de usuarios')
+        state = {}
+
+        def create_user():
+            state['user'] = User.objects.create_user(username=USERNAME, password=PASSWORD)
+
+        def login():
+            response = client.post(reverse('login'), {'username': USERNAME, 'password': PASSWORD})
+            if response.status_code != 302:
+                raise CommandError('El login de prueba falló')
+
+        def save_user():
+            state['user'].first_name = 'Chequeo'
+            state['user'].save()
+
+        def save_user_with_profile():
+            state['user'].save()
+
+        def save_user_with_changed_profile():
+            state['user'].profile.sede = sede
+            state['user'].save()
+
+        def load_user_with_profile():
+            # Como lo carga el admin de usuarios (list_select_related)
+            state['user'] = User.objects.select_related('profile').get(pk=state['user'].pk)
+
+        yield 'alta de usuario', create_user
+        yield 'login', login
+        yield 'primer request', lambda: client.get(reverse('active_visits_api'))
+        yield 'request siguiente', lambda: client.get(reverse('active_visits_api'))
+        yield 'guardar usuario', save_user
+        load_user_with_profile()
+        yield 'guardar usuario con perfil cargado', save_user_with_profile
+        yield 'guardar usuario con perfil modificado', save_user_with_changed_profile
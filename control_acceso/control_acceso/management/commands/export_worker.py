@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from control_acceso.models import ExportJob
+from control_acceso.reports import cleanup_export_files, run_export_job
+
+# Segundos entre limpiezas de archivos vencidos (ver cleanup_export_files)
+CLEANUP_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = ('Procesar la cola de exportaciones del informe de visitas. '
+            'Pueden correr varios workers; como máximo EXPORT_WORKERS exportaciones se generan a la vez.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Procesar los trabajos pendientes y terminar')
+        parser.add_argument('--poll-interval', type=float, default=settings.EXPORT_POLL_INTERVAL,
+                            help='Segundos de espera entre consultas a la cola')
+        parser.add_argument('--requeue', action='store_true',
+                            help='Volver a encolar ya los trabajos que quedaron "Generando" (p. ej. tras un corte); '
+                                 'si no, se reencolan solos tras EXPORT_STALE_TIMEOUT segundos sin progreso')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            requeued = ExportJob.objects.filter(status=ExportJob.STATUS_RUNNING).update(
+                status=ExportJob.STATUS_PENDING, progress=0, started_at=None, heartbeat_at=None
+            )
+            self.stdout.write(f'Trabajos reencolados: {requeued}')
+
+        self.stdout.write('Worker de exportaciones iniciado')
+        last_cleanup = None
+        while True:
+            if last_cleanup is None or time.monotonic() - last_cleanup >= CLEANUP_INTERVAL:
+                removed = cleanup_export_files()
+                if removed:
+                    self.stdout.write(f'Archivos de exportaciones vencidos borrados: {removed}')
+                last_cleanup = time.monotonic()
+
+            job = ExportJob.objects.claim_next(settings.EXPORT_WORKERS)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Generando {job}...')
+            run_export_job(job)
+            if job.status == ExportJob.STATUS_DONE:
+                self.stdout.write(self.style.SUCCESS(f'{job}: {job.total_rows} visitas'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{job}: {job.error}'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from control_acceso.models import PersonPhoto, PersonPhotoThumbnail
+from control_acceso.photos import THUMBNAIL_SIZES
+
+
+class Command(BaseCommand):
+    help = 'Generar las miniaturas faltantes de las fotos de personas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerar todas las miniaturas, aunque ya existan')
+
+    def handle(self, *args, **options):
+        if options['force']:
+            PersonPhotoThumbnail.objects.all().delete()
+
+        generated = 0
+        errors = 0
+        for photo in PersonPhoto.objects.all().iterator(chunk_size=100):
+            # Solo se generan los tamaños que le faltan a cada foto
+            existing = set(photo.thumbnails.values_list('size', flat=True))
+            for size in THUMBNAIL_SIZES:
+                if size in existing:
+                    continue
+                if photo.get_thumbnail(size):
+                    generated += 1
+                else:
+                    errors += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Miniaturas generadas: {generated}, errores: {errors}')
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from control_acceso.models import Person, PersonPhoto
+
+
+class Command(BaseCommand):
+    help = 'Normalizar las fotos guardadas antes de la normalización al ingreso (JPEG acotado, sin metadatos)'
+
+    def handle(self, *args, **options):
+        before = PersonPhoto.objects.aggregate(total=Sum('size'))['total'] or 0
+        normalized = 0
+        for sha256 in list(PersonPhoto.objects.values_list('sha256', flat=True)):
+            photo = PersonPhoto.objects.get(sha256=sha256)
+            with transaction.atomic():
+                new_photo = PersonPhoto.objects.store(bytes(photo.data))
+                if new_photo.sha256 == photo.sha256:
+                    continue
+                # La foto normalizada conserva el tamaño de la original como referencia
+                new_photo.original_size = max(new_photo.original_size, photo.original_size)
+                new_photo.save(update_fields=['original_size'])
+                Person.objects.filter(stored_photo=photo).update(stored_photo=new_photo)
+                photo.delete()
+                normalized += 1
+
+        after = PersonPhoto.objects.aggregate(total=Sum('size'))['total'] or 0
+        self.stdout.write(
+            self.style.SUCCESS(f'Fotos normalizadas: {normalized}. Tamaño total: {before} -> {after} bytes')
+        )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from control_acceso.models import DailyCounter
+
+
+class Command(BaseCommand):
+    help = ('Verificar los contadores diarios de visitas y personas (los de home) contra las tablas de '
+            'visitas y personas, y corregir las diferencias. Con --solo-verificar no se modifica nada '
+            'y el comando falla si hay diferencias.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solo-verificar', action='store_true', help='Informar las diferencias sin corregirlas')
+
+    def handle(self, *args, **options):
+        fix = not options['solo_verificar']
+        start = time.perf_counter()
+        differences = DailyCounter.objects.rebuild(fix=fix)
+        elapsed = time.perf_counter() - start
+
+        for sede_id, fecha, current, wanted in differences:
+            sede = f'sede {sede_id}' if sede_id is not None else 'personas'
+            self.stdout.write(f'  {sede} {fecha}: guardado {current or "-"}, esperado {wanted or "-"}')
+
+        if not differences:
+            self.stdout.write(self.style.SUCCESS(f'Contadores correctos ({elapsed:.2f} s)'))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f'{len(differences)} contadores corregidos ({elapsed:.2f} s)'))
+        else:
+            raise CommandError(f'{len(differences)} contadores con diferencias; corregir con rebuild_daily_counters')
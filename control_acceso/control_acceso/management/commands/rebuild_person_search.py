@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from control_acceso.models import Person
+from control_acceso.search import install_person_search, person_search_q
+
+
+class Command(BaseCommand):
+    help = ('Recrear el índice de búsqueda de personas (FTS5) y sus triggers, y reindexar todas las '
+            'personas. Con --buscar, medir el tiempo de una búsqueda por apellido.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buscar', metavar='TEXTO', help='Apellido a buscar después de reindexar')
+        parser.add_argument('--repeat', type=int, default=20, help='Veces que se repite la búsqueda')
+        parser.add_argument('--solo-buscar', action='store_true', help='No reindexar; sólo medir la búsqueda')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'El índice de búsqueda es de SQLite; la base actual es {connection.vendor}')
+
+        if not options['solo_buscar']:
+            start = time.perf_counter()
+            install_person_search(connection)
+            self.stdout.write(self.style.SUCCESS(
+                f'Índice regenerado: {Person.objects.count()} personas en {time.perf_counter() - start:.2f} s'
+            ))
+
+        if options['buscar']:
+            persons = Person.objects.filter(person_search_q(apellido=options['buscar'])).order_by('apellido', 'nombre')
+            best = None
+            for _ in range(max(1, options['repeat'])):
+                start = time.perf_counter()
+                # Lo que consulta el listado de personas: total y primera página
+                total = persons.count()
+                list(persons[:20])
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f'"{options["buscar"]}": {total} personas, {best * 1000:.1f} ms (mejor de {options["repeat"]})')
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from control_acceso.models import RollupState, VisitRollup
+
+
+class Command(BaseCommand):
+    help = ('Actualizar los resúmenes diarios de visitas (por sede, área y usuario) con las visitas '
+            'nuevas o modificadas desde la última ejecución. Programarlo periódicamente (cron). '
+            'Con --completo se recalculan todos los días, p. ej. después de borrar visitas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true', help='Recalcular todos los días')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        days, rows = VisitRollup.objects.update_from_watermark(full=options['completo'])
+        state = RollupState.objects.get(nombre=VisitRollup.STATE_NAME)
+        self.stdout.write(self.style.SUCCESS(
+            f'{days} días recalculados, {rows} resúmenes en {time.perf_counter() - start:.2f} s '
+            f'(procesado hasta {timezone.localtime(state.procesado_hasta):%Y-%m-%d %H:%M:%S})'
+        ))
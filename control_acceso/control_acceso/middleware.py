@@ -1,28 +1,128 @@
+import re
+import time
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
 from django.shortcuts import redirect
-from django.urls import resolve, reverse
-from django.utils.deprecation import MiddlewareMixin
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from .models import UserProfile
+from .scope import AccessScope
 
-class LoginRequiredMiddleware(MiddlewareMixin):
+class LoginRequiredMiddleware:
     """
-    Middleware para requerir inicio de sesión en todas las páginas excepto login y admin.
+    Middleware para requerir inicio de sesión en todas las páginas excepto el login (propio y del
+    admin) y los archivos estáticos.
+
+    Las rutas exentas se compilan una vez, al cargar el middleware, en una sola expresión
+    regular: rutas exactas de las vistas de EXEMPT_URLS y prefijos de archivos estáticos y
+    media. Así no se resuelve la URL en cada request (ni falla con rutas inexistentes, que
+    redirigen al login) y los estáticos no cargan la sesión ni el usuario.
+    Funciona sin adaptar a síncrono tanto con WSGI como con ASGI.
     """
-    
+
+    sync_capable = True
+    async_capable = True
+
     # Vistas que están exentas de requerir inicio de sesión
     EXEMPT_URLS = [
-        'login', 'admin:', 'static', 'media',
+        'login', 'admin:login',
     ]
-    
-    def process_request(self, request):
-        # Verificar si el usuario ya está autenticado
-        if request.user.is_authenticated:
-            return None
-            
-        # Obtener la URL actual
-        current_url = resolve(request.path_info).url_name
-        
-        # Si la URL está en la lista de exentas, no hacer nada
-        if current_url is None or any(url in str(current_url) for url in self.EXEMPT_URLS):
-            return None
-            
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.exempt_paths = self.compile_exempt_paths()
+        self.login_url = reverse('login')
+
+    @classmethod
+    def compile_exempt_paths(cls):
+        """Expresión regular de las rutas exentas"""
+        paths = [re.escape(reverse(name)) + '$' for name in cls.EXEMPT_URLS]
+        # Archivos estáticos y media, si se sirven desde la aplicación
+        prefixes = [re.escape(prefix) for prefix in (settings.STATIC_URL, settings.MEDIA_URL)
+                    if prefix and prefix != '/']
+        return re.compile('|'.join(paths + prefixes))
+
+    def _login_redirect(self, request):
         # Redirigir a la página de login con next para volver después
-        return redirect(f"{reverse('login')}?next={request.path}")
+        return redirect(f"{self.login_url}?next={request.path}")
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.exempt_paths.match(request.path) and not request.user.is_authenticated:
+            return self._login_redirect(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self.exempt_paths.match(request.path) and not (await request.auser()).is_authenticated:
+            return self._login_redirect(request)
+        return await self.get_response(request)
+
+
+class SlidingSessionMiddleware(SessionMiddleware):
+    """
+    SessionMiddleware con vencimiento deslizante (SESSION_COOKIE_AGE desde la última
+    actividad) sin guardar la sesión en cada request.
+
+    La sesión sólo se vuelve a guardar, extendiendo su vencimiento, cuando le quedan menos de
+    SESSION_REFRESH_THRESHOLD segundos; el resto de los requests la leen del caché
+    (SESSION_ENGINE cached_db) sin escribir la base. Así una sesión vence entre
+    SESSION_REFRESH_THRESHOLD y SESSION_COOKIE_AGE segundos después de la última actividad.
+    """
+
+    # Momento (epoch) en que se guardó la sesión por última vez
+    REFRESHED_KEY = '_session_refreshed_at'
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is not None and session.accessed and not session.is_empty():
+            now = int(time.time())
+            if session.modified:
+                # Se va a guardar igual: anotar que el vencimiento se extiende ahora
+                session[self.REFRESHED_KEY] = now
+            else:
+                refreshed_at = session.get(self.REFRESHED_KEY, 0)
+                remaining = refreshed_at + settings.SESSION_COOKIE_AGE - now
+                if remaining < settings.SESSION_REFRESH_THRESHOLD:
+                    session[self.REFRESHED_KEY] = now
+        return super().process_response(request, response)
+
+
+def get_scope(request):
+    """
+    AccessScope del usuario del request, con su perfil tal como está en la base: llega con el
+    usuario que cargó AuthenticationMiddleware (ver backends.py), igual que is_superuser.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return AccessScope()
+    # Los usuarios sin perfil (creados sin el inline del admin) lo reciben aquí, sin sede
+    profile = UserProfile.objects.for_user(user)
+    return AccessScope(user.pk, profile.sede_id, user.is_superuser or profile.is_admin, has_profile=True)
+
+
+class ScopeMiddleware:
+    """
+    Agrega request.access_scope (ver scope.py): la sede y los permisos del usuario, resueltos la
+    primera vez que se usan en el request. Va después de AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.access_scope = SimpleLazyObject(partial(get_scope, request))
+        # Con ASGI get_response devuelve la corrutina, que espera quien llamó
+        return self.get_response(request)
@@ -0,0 +1,86 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:28
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Firmas de los formatos de imagen: la página de registro anterior guardaba PNG del canvas
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+]
+
+
+def guess_content_type(data):
+    """Tipo de contenido según los primeros bytes de la imagen; JPEG si no se reconoce"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+def move_photos_to_store(apps, schema_editor):
+    """Copia las fotos de Person.photo al almacén de fotos, deduplicando por hash"""
+    Person = apps.get_model('control_acceso', 'Person')
+    PersonPhoto = apps.get_model('control_acceso', 'PersonPhoto')
+    persons = Person.objects.filter(photo__isnull=False).only('id', 'photo')
+    for person in persons.iterator(chunk_size=100):
+        data = bytes(person.photo)
+        if not data:
+            continue
+        sha256 = hashlib.sha256(data).hexdigest()
+        PersonPhoto.objects.get_or_create(
+            sha256=sha256,
+            defaults={'data': data, 'content_type': guess_content_type(data), 'size': len(data)}
+        )
+        Person.objects.filter(pk=person.pk).update(stored_photo_id=sha256)
+
+
+def restore_photos_from_store(apps, schema_editor):
+    """Vuelve a copiar los bytes de cada foto a Person.photo"""
+    Person = apps.get_model('control_acceso', 'Person')
+    PersonPhoto = apps.get_model('control_acceso', 'PersonPhoto')
+    persons = Person.objects.filter(stored_photo__isnull=False).only('id', 'stored_photo_id')
+    for person in persons.iterator(chunk_size=100):
+        data = PersonPhoto.objects.filter(sha256=person.stored_photo_id).values_list('data', flat=True).first()
+        Person.objects.filter(pk=person.pk).update(photo=data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonPhoto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='Hash SHA-256')),
+                ('data', models.BinaryField(verbose_name='Imagen')),
+                ('content_type', models.CharField(default='image/jpeg', max_length=50, verbose_name='Tipo de contenido')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Tamaño (bytes)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Foto de persona',
+                'verbose_name_plural': 'Fotos de personas',
+            },
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='stored_photo',
+            field=models.ForeignKey(blank=True, db_column='photo_hash', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='persons', to='control_acceso.personphoto', to_field='sha256', verbose_name='Foto'),
+        ),
+        migrations.RunPython(move_photos_to_store, restore_photos_from_store),
+        migrations.RemoveField(
+            model_name='person',
+            name='photo',
+        ),
+    ]
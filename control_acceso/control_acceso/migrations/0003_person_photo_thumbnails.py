@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0002_person_photo_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonPhotoThumbnail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(choices=[('thumb', 'Miniatura de listado'), ('pdf', 'Informe PDF'), ('detail', 'Detalle')], max_length=10, verbose_name='Tamaño')),
+                ('data', models.BinaryField(verbose_name='Imagen')),
+                ('width', models.PositiveIntegerField(verbose_name='Ancho')),
+                ('height', models.PositiveIntegerField(verbose_name='Alto')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thumbnails', to='control_acceso.personphoto', to_field='sha256', verbose_name='Foto')),
+            ],
+            options={
+                'verbose_name': 'Miniatura de foto',
+                'verbose_name_plural': 'Miniaturas de fotos',
+                'unique_together': {('photo', 'size')},
+            },
+        ),
+    ]
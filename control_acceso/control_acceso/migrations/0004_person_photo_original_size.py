@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+def copy_size_to_original_size(apps, schema_editor):
+    """Las fotos existentes se guardaron sin normalizar: su tamaño original es el actual"""
+    PersonPhoto = apps.get_model('control_acceso', 'PersonPhoto')
+    PersonPhoto.objects.update(original_size=models.F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0003_person_photo_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personphoto',
+            name='original_size',
+            field=models.PositiveIntegerField(default=0, verbose_name='Tamaño original (bytes)'),
+        ),
+        migrations.RunPython(copy_size_to_original_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0004_person_photo_original_size'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('formato', models.CharField(choices=[('pdf', 'PDF')], default='pdf', max_length=10, verbose_name='Formato')),
+                ('filtros', models.JSONField(blank=True, default=dict, verbose_name='Filtros')),
+                ('status', models.CharField(choices=[('pending', 'En cola'), ('running', 'Generando'), ('done', 'Terminado'), ('error', 'Error')], default='pending', max_length=10, verbose_name='Estado')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='Progreso (%)')),
+                ('total_rows', models.PositiveIntegerField(blank=True, null=True, verbose_name='Cantidad de visitas')),
+                ('file_path', models.CharField(blank=True, max_length=500, verbose_name='Archivo')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Inicio')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Fin')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Solicitado por')),
+            ],
+            options={
+                'verbose_name': 'Exportación de informe',
+                'verbose_name_plural': 'Exportaciones de informes',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
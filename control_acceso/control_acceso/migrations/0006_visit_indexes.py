@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0005_export_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(condition=models.Q(('hora_salida__isnull', True)), fields=['sede', '-fecha', '-hora_entrada'], name='visit_activa_sede_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['sede', '-fecha', '-hora_entrada'], name='visit_sede_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['-fecha', '-hora_entrada'], name='visit_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['sede', 'created_by'], name='visit_sede_usuario_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_tarjeta_from_person(apps, schema_editor):
+    """
+    Las visitas existentes toman la tarjeta actual de la persona (la que mostraba la aplicación).
+    Antes de crear las restricciones se resuelven los duplicados activos heredados:
+    - una persona con varias visitas activas en la misma sede: las anteriores se cierran
+      con la hora de ingreso de la visita siguiente;
+    - una tarjeta repetida entre visitas activas de una sede: solo la más reciente la conserva.
+    """
+    Visit = apps.get_model('control_acceso', 'Visit')
+    Person = apps.get_model('control_acceso', 'Person')
+    Visit.objects.update(
+        tarjeta=models.Subquery(Person.objects.filter(pk=models.OuterRef('person_id')).values('tarjetavisita')[:1])
+    )
+    Visit.objects.filter(tarjeta='').update(tarjeta=None)
+
+    now = timezone.now()
+    active = Visit.objects.filter(hora_salida__isnull=True).order_by('-fecha', '-hora_entrada', '-id')
+    newer_by_person = {}
+    for visit in active.values('id', 'person_id', 'sede_id', 'fecha', 'hora_entrada'):
+        newer = newer_by_person.get((visit['person_id'], visit['sede_id']))
+        if newer:
+            Visit.objects.filter(id=visit['id']).update(
+                fecha_salida=newer['fecha'], hora_salida=newer['hora_entrada'], updated_at=now
+            )
+        newer_by_person[(visit['person_id'], visit['sede_id'])] = visit
+
+    seen_tarjetas = set()
+    for visit in active.exclude(tarjeta__isnull=True).values('id', 'sede_id', 'tarjeta'):
+        key = (visit['sede_id'], visit['tarjeta'])
+        if key in seen_tarjetas:
+            Visit.objects.filter(id=visit['id']).update(tarjeta=None, updated_at=now)
+        seen_tarjetas.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0006_visit_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='tarjeta',
+            field=models.CharField(blank=True, max_length=10, null=True, verbose_name='Tarjeta de visita'),
+        ),
+        migrations.RunPython(copy_tarjeta_from_person, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='visit',
+            constraint=models.UniqueConstraint(condition=models.Q(('hora_salida__isnull', True)), fields=('sede', 'tarjeta'), name='visit_tarjeta_activa_unica', violation_error_message='La tarjeta ya está en uso en esta sede.'),
+        ),
+        migrations.AddConstraint(
+            model_name='visit',
+            constraint=models.UniqueConstraint(condition=models.Q(('hora_salida__isnull', True)), fields=('person', 'sede'), name='visit_persona_activa_unica', violation_error_message='La persona ya tiene una visita activa en esta sede.'),
+        ),
+    ]
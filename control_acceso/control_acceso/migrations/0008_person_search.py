@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from control_acceso.search import install_person_search, uninstall_person_search
+
+
+def create_person_search(apps, schema_editor):
+    """Índice FTS5 de nombre, apellido, DNI y tarjeta de las personas (sólo SQLite)"""
+    install_person_search(schema_editor.connection)
+
+
+def drop_person_search(apps, schema_editor):
+    uninstall_person_search(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0007_visit_tarjeta'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_person_search, drop_person_search),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:53
+
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def copy_dni_to_dni_texto(apps, schema_editor):
+    """Las personas existentes toman su DNI como texto, igual que Person.save()"""
+    Person = apps.get_model('control_acceso', 'Person')
+    Person.objects.update(dni_texto=Cast('dni', models.CharField(max_length=12)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0008_person_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='dni_texto',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True, verbose_name='DNI (texto)'),
+        ),
+        migrations.RunPython(copy_dni_to_dni_texto, migrations.RunPython.noop),
+    ]
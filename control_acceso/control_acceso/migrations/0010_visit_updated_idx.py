@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0009_person_dni_texto'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['updated_at'], name='visit_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['sede', 'updated_at'], name='visit_sede_updated_idx'),
+        ),
+    ]
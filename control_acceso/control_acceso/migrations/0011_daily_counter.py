@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def fill_daily_counters(apps, schema_editor):
+    """Carga los contadores con las visitas y personas existentes (igual que DailyCounter.objects.rebuild)"""
+    Visit = apps.get_model('control_acceso', 'Visit')
+    Person = apps.get_model('control_acceso', 'Person')
+    DailyCounter = apps.get_model('control_acceso', 'DailyCounter')
+    counters = []
+    visits = (Visit.objects.order_by().values_list('sede_id', 'fecha')
+              .annotate(total=models.Count('id'),
+                        cerradas=models.Count('id', filter=models.Q(hora_salida__isnull=False))))
+    for sede_id, fecha, total, cerradas in visits.iterator():
+        counters.append(DailyCounter(sede_id=sede_id, fecha=fecha, visitas=total, visitas_cerradas=cerradas))
+    persons = (Person.objects.order_by().annotate(dia=TruncDate('created_at'))
+               .values_list('dia').annotate(total=models.Count('id')))
+    for fecha, total in persons.iterator():
+        counters.append(DailyCounter(sede_id=None, fecha=fecha, personas=total))
+    DailyCounter.objects.bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0010_visit_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('visitas', models.IntegerField(default=0, verbose_name='Visitas')),
+                ('visitas_cerradas', models.IntegerField(default=0, verbose_name='Visitas con salida')),
+                ('personas', models.IntegerField(default=0, verbose_name='Personas registradas')),
+                ('sede', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='control_acceso.sede', verbose_name='Sede')),
+            ],
+            options={
+                'verbose_name': 'Contador diario',
+                'verbose_name_plural': 'Contadores diarios',
+                'constraints': [models.UniqueConstraint(fields=('sede', 'fecha'), name='daily_counter_sede_fecha_unico'), models.UniqueConstraint(condition=models.Q(('sede__isnull', True)), fields=('fecha',), name='daily_counter_personas_fecha_unico')],
+            },
+        ),
+        migrations.RunPython(fill_daily_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0011_daily_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True, verbose_name='Nombre')),
+                ('procesado_hasta', models.DateTimeField(blank=True, null=True, verbose_name='Procesado hasta')),
+            ],
+            options={
+                'verbose_name': 'Estado de resumen',
+                'verbose_name_plural': 'Estados de resumen',
+            },
+        ),
+        migrations.CreateModel(
+            name='VisitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('visitas', models.IntegerField(default=0, verbose_name='Visitas')),
+                ('visitas_cerradas', models.IntegerField(default=0, verbose_name='Visitas con salida')),
+                ('personas', models.IntegerField(default=0, verbose_name='Personas distintas')),
+                ('duracion_segundos', models.BigIntegerField(default=0, verbose_name='Duración total (segundos)')),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='control_acceso.estructura', verbose_name='Área')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Creado por')),
+                ('sede', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='control_acceso.sede', verbose_name='Sede')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de visitas',
+                'verbose_name_plural': 'Resúmenes diarios de visitas',
+                'indexes': [models.Index(fields=['fecha'], name='visit_rollup_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sede', 'fecha', 'area', 'created_by'), name='visit_rollup_unico')],
+            },
+        ),
+    ]
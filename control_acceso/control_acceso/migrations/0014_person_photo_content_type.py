@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# Firmas de los formatos de imagen (como en 0002_person_photo_store)
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+]
+
+
+def guess_content_type(data):
+    """Tipo de contenido según los primeros bytes de la imagen; None si no se reconoce"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def fix_content_types(apps, schema_editor):
+    """
+    Corrige el tipo de las fotos migradas desde Person.photo, que se copiaron todas como JPEG
+    aunque muchas eran PNG capturados por la página de registro anterior
+    """
+    PersonPhoto = apps.get_model('control_acceso', 'PersonPhoto')
+    photos = PersonPhoto.objects.filter(content_type='image/jpeg').only('id', 'data')
+    for photo in photos.iterator(chunk_size=100):
+        content_type = guess_content_type(bytes(photo.data[:12]))
+        if content_type and content_type != 'image/jpeg':
+            PersonPhoto.objects.filter(pk=photo.pk).update(content_type=content_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0013_export_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(fix_content_types, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0014_person_photo_content_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estructura',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
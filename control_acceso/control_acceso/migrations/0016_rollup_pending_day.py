@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_acceso', '0015_estructura_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupPendingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True, verbose_name='Fecha')),
+                ('marcado_en', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Marcado en')),
+            ],
+            options={
+                'verbose_name': 'Día pendiente de resumen',
+                'verbose_name_plural': 'Días pendientes de resumen',
+            },
+        ),
+    ]
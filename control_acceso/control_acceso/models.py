@@ -1,8 +1,15 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+import hashlib
+from datetime import datetime, timedelta
+from .events import VISIT_EVENTS, visit_events_for
+from .photos import PHOTO_DECODE_ERRORS, THUMBNAIL_SIZES, make_thumbnail, normalize_photo
 
 class Sede(models.Model):
     nombre = models.CharField(_('Nombre'), max_length=255)
@@ -28,6 +35,8 @@ class Estructura(models.Model):
                            help_text=_('Siglas del área padre. Dejar en blanco si es un área principal.'))
     activo = models.BooleanField(_('Activo'), default=True)
     nombre_anterior = models.CharField(_('Nombre anterior'), max_length=255, blank=True, null=True)
+    # Para la marca de agua de las exportaciones cacheadas (reports.get_data_watermark)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     class Meta:
         db_table = 'CONTROL_ACCESO_ESTRUCTURA'
@@ -52,7 +61,7 @@ class Estructura(models.Model):
             original = Estructura.objects.get(pk=self.pk)
             if original.siglas != self.siglas and not original.padre:
                 # Es un área que cambió sus siglas, actualizar las subáreas
-                Estructura.objects.filter(padre=original.siglas).update(padre=self.siglas)
+                Estructura.objects.filter(padre=original.siglas).update(padre=self.siglas, updated_at=timezone.now())
     
     def is_institucion(self):
         """Devuelve True si es una institución (no tiene padre)"""
@@ -84,17 +93,108 @@ class Estructura(models.Model):
             return Estructura.objects.filter(padre=self.siglas, activo=True)
         return Estructura.objects.none()
 
+class PersonPhotoManager(models.Manager):
+    def store(self, data, content_type='image/jpeg'):
+        """
+        Normaliza y guarda los bytes de una foto, y devuelve su registro (deduplicado por hash).
+        Si la imagen no se puede decodificar se guarda tal como llegó.
+        """
+        original_size = len(data)
+        try:
+            data, content_type = normalize_photo(data)
+        except PHOTO_DECODE_ERRORS:
+            pass
+        sha256 = hashlib.sha256(data).hexdigest()
+        photo, created = self.get_or_create(
+            sha256=sha256,
+            defaults={'data': data, 'content_type': content_type, 'size': len(data),
+                      'original_size': original_size}
+        )
+        if created:
+            photo.generate_thumbnails()
+        return photo
+
+class PersonPhoto(models.Model):
+    """Almacén de fotos direccionado por contenido, separado de la tabla de personas"""
+    sha256 = models.CharField(_('Hash SHA-256'), max_length=64, unique=True)
+    data = models.BinaryField(_('Imagen'))
+    content_type = models.CharField(_('Tipo de contenido'), max_length=50, default='image/jpeg')
+    size = models.PositiveIntegerField(_('Tamaño (bytes)'), default=0)
+    original_size = models.PositiveIntegerField(_('Tamaño original (bytes)'), default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PersonPhotoManager()
+
+    class Meta:
+        verbose_name = _('Foto de persona')
+        verbose_name_plural = _('Fotos de personas')
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+    def generate_thumbnails(self):
+        """Genera y guarda todas las miniaturas de tamaño fijo de esta foto"""
+        for size in THUMBNAIL_SIZES:
+            self.get_thumbnail(size)
+
+    def get_thumbnail(self, size):
+        """
+        Devuelve la miniatura del tamaño indicado, generándola si todavía no existe.
+        Devuelve None si la imagen no se puede procesar.
+        """
+        thumbnail = self.thumbnails.filter(size=size).first()
+        if thumbnail:
+            return thumbnail
+        try:
+            data, width, height = make_thumbnail(bytes(self.data), size)
+        except PHOTO_DECODE_ERRORS:
+            # Imagen corrupta o en un formato que Pillow no reconoce
+            return None
+        thumbnail, _created = PersonPhotoThumbnail.objects.get_or_create(
+            photo=self, size=size,
+            defaults={'data': data, 'width': width, 'height': height}
+        )
+        return thumbnail
+
+class PersonPhotoThumbnail(models.Model):
+    """Miniaturas precalculadas de una foto, en los tamaños de THUMBNAIL_SIZES"""
+    SIZE_CHOICES = [
+        ('thumb', _('Miniatura de listado')),
+        ('pdf', _('Informe PDF')),
+        ('detail', _('Detalle')),
+    ]
+    photo = models.ForeignKey(PersonPhoto, to_field='sha256', on_delete=models.CASCADE,
+                              related_name='thumbnails', verbose_name=_('Foto'))
+    size = models.CharField(_('Tamaño'), max_length=10, choices=SIZE_CHOICES)
+    data = models.BinaryField(_('Imagen'))
+    width = models.PositiveIntegerField(_('Ancho'))
+    height = models.PositiveIntegerField(_('Alto'))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Miniatura de foto')
+        verbose_name_plural = _('Miniaturas de fotos')
+        unique_together = [('photo', 'size')]
+
+    def __str__(self):
+        return f"{self.photo_id[:12]} - {self.size} ({self.width}x{self.height})"
+
 class Person(models.Model):
     nombre = models.CharField(_('Nombre'), max_length=255, null=True, blank=True)
     apellido = models.CharField(_('Apellido'), max_length=255, null=True, blank=True)
     dni = models.IntegerField(_('DNI'), unique=True)
+    # Copia del DNI como texto, indexada: la búsqueda por los primeros dígitos es un rango del índice
+    dni_texto = models.CharField(_('DNI (texto)'), max_length=12, null=True, blank=True, editable=False, db_index=True)
     telefono = models.CharField(_('Teléfono'), max_length=20, null=True, blank=True)
     email = models.EmailField(_('Email'), max_length=255, null=True, blank=True)
     tarjetavisita = models.CharField(_('Tarjeta de visita'), max_length=10, null=True, blank=True)
     observaciones = models.TextField(_('Observaciones'), null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    photo = models.BinaryField(null=True, blank=True, editable=True)
+    # Referencia a la foto por su hash: las consultas de listados nunca cargan los bytes
+    stored_photo = models.ForeignKey(PersonPhoto, to_field='sha256', db_column='photo_hash',
+                                     on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='persons', verbose_name=_('Foto'))
 
     class Meta:
         verbose_name = _('Persona')
@@ -104,6 +204,63 @@ class Person(models.Model):
     def __str__(self):
         return f"{self.apellido}, {self.nombre} - DNI: {self.dni}"
 
+    @property
+    def photo_hash(self):
+        """Hash de la foto actual, sin consultar el almacén de fotos"""
+        return self.stored_photo_id
+
+    @property
+    def has_photo(self):
+        if hasattr(self, '_pending_photo'):
+            return bool(self._pending_photo)
+        return bool(self.stored_photo_id)
+
+    @property
+    def photo(self):
+        """Bytes de la foto, cargados bajo demanda desde el almacén de fotos"""
+        if hasattr(self, '_pending_photo'):
+            return self._pending_photo or None
+        if not self.stored_photo_id:
+            return None
+        return PersonPhoto.objects.filter(sha256=self.stored_photo_id).values_list('data', flat=True).first()
+
+    @photo.setter
+    def photo(self, value):
+        # La foto se persiste en el almacén recién al guardar la persona
+        self._pending_photo = bytes(value) if value else None
+
+    def save(self, *args, **kwargs):
+        if hasattr(self, '_pending_photo'):
+            data = self._pending_photo
+            del self._pending_photo
+            self.stored_photo = PersonPhoto.objects.store(data) if data else None
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                # updated_at también: cambia la marca de agua de las exportaciones con la foto
+                kwargs['update_fields'] = ['stored_photo' if f == 'photo' else f for f in update_fields]
+                if 'updated_at' not in kwargs['update_fields']:
+                    kwargs['update_fields'].append('updated_at')
+        self.dni_texto = str(self.dni) if self.dni is not None else None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'dni' in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'dni_texto']
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        using = kwargs.get('using') or router.db_for_write(Person, instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            DailyCounter.objects.db_manager(using).add(None, timezone.localdate(self.created_at), personas=1)
+
+    def delete(self, *args, **kwargs):
+        created_at = self.__dict__.get('created_at')
+        using = kwargs.get('using') or router.db_for_write(Person, instance=self)
+        with transaction.atomic(using=using):
+            result = super().delete(*args, **kwargs)
+            if created_at is not None:
+                DailyCounter.objects.db_manager(using).add(None, timezone.localdate(created_at), personas=-1)
+        return result
+
     def get_full_name(self):
         return f"{self.nombre} {self.apellido}".strip()
     
@@ -114,8 +271,24 @@ class Person(models.Model):
             query['sede'] = sede
         return Visit.objects.filter(**query).exists()
 
+class UserProfileManager(models.Manager):
+    def for_user(self, user):
+        """
+        Perfil del usuario (sin consultar si ya se cargó con él, ver backends.py); se crea
+        (sin sede ni permisos) si todavía no tiene uno
+        """
+        try:
+            return user.profile
+        except UserProfile.DoesNotExist:
+            profile, _created = self.get_or_create(user_id=user.pk)
+            return profile
+
+
 class UserProfile(models.Model):
     """Perfil de usuario extendido para manejar el acceso a sedes"""
+    # Campos editables del perfil: sólo se guarda si cambia alguno (ver signals.py)
+    TRACKED_FIELDS = ('sede', 'is_admin')
+
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     sede = models.ForeignKey(Sede, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('Sede asignada'))
     is_admin = models.BooleanField(_('Es administrador'), default=False, 
@@ -123,6 +296,8 @@ class UserProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = UserProfileManager()
+
     def __str__(self):
         return f"{self.user.username} - {self.sede.nombre if self.sede else 'Sin sede asignada'}"
 
@@ -130,14 +305,61 @@ class UserProfile(models.Model):
         verbose_name = _('Perfil de usuario')
         verbose_name_plural = _('Perfiles de usuario')
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        profile = super().from_db(db, field_names, values)
+        profile._loaded_values = profile._tracked_values()
+        return profile
+
+    def _tracked_values(self):
+        deferred = self.get_deferred_fields()
+        attnames = (self._meta.get_field(name).attname for name in self.TRACKED_FIELDS)
+        return {name: getattr(self, attname) for name, attname in zip(self.TRACKED_FIELDS, attnames)
+                if attname not in deferred}
+
+    def changed_fields(self):
+        """Campos de TRACKED_FIELDS modificados desde que se leyó o guardó el perfil"""
+        loaded = getattr(self, '_loaded_values', {})
+        return [name for name, value in self._tracked_values().items()
+                if name not in loaded or loaded[name] != value]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = self._tracked_values()
+
     def can_access_sede(self, sede_id):
         """Determina si el usuario puede acceder a una sede específica"""
         # Administradores y superusuarios pueden acceder a todas las sedes
-        if self.is_admin or self.user.is_superuser:
+        if self.is_admin:
             return True
-        
-        # Usuario normal solo puede acceder a su sede asignada
-        return self.sede and str(self.sede.id) == str(sede_id)
+        # Usuario normal solo puede acceder a su sede asignada (sin cargar la sede)
+        if self.sede_id is not None and str(self.sede_id) == str(sede_id):
+            return True
+        return self.user.is_superuser
+
+class VisitQuerySet(models.QuerySet):
+    def for_scope(self, scope):
+        """Visitas que puede ver el usuario de `scope` (request.access_scope): las de su sede si no es admin"""
+        if not scope.is_authenticated:
+            return self.none()
+        if scope.sede_filter is not None:
+            return self.filter(sede_id=scope.sede_filter)
+        return self
+
+
+class VisitManager(models.Manager.from_queryset(VisitQuerySet)):
+    def active_with_tarjeta(self, tarjeta, sede_id, exclude_pk=None):
+        """
+        Visita activa que tiene entregada la tarjeta en la sede, o None.
+        Es una sola búsqueda en el índice de la restricción visit_tarjeta_activa_unica.
+        """
+        if not tarjeta or not sede_id:
+            return None
+        visits = self.filter(sede_id=sede_id, tarjeta=tarjeta, hora_salida__isnull=True).select_related('person')
+        if exclude_pk:
+            visits = visits.exclude(pk=exclude_pk)
+        return visits.first()
+
 
 class Visit(models.Model):
     person = models.ForeignKey(Person, on_delete=models.CASCADE, verbose_name=_('Persona'))
@@ -150,19 +372,98 @@ class Visit(models.Model):
     receptor_nombre = models.CharField(_('Nombre del receptor'), max_length=255, null=True, blank=True)
     receptor_apellido = models.CharField(_('Apellido del receptor'), max_length=255, null=True, blank=True)
     observaciones = models.TextField(_('Observaciones'), null=True, blank=True)
+    # Tarjeta entregada en el ingreso (la de la persona puede cambiar después)
+    tarjeta = models.CharField(_('Tarjeta de visita'), max_length=10, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, 
                                    related_name='created_visits', verbose_name=_('Creado por'))
 
+    objects = VisitManager()
+
     class Meta:
         verbose_name = _('Visita')
         verbose_name_plural = _('Visitas')
         ordering = ['-fecha', '-hora_entrada']
+        indexes = [
+            # Visitas activas (sin salida) por sede, en el orden de los listados
+            models.Index(fields=['sede', '-fecha', '-hora_entrada'], name='visit_activa_sede_idx',
+                         condition=models.Q(hora_salida__isnull=True)),
+            # Histórico por sede ordenado por fecha
+            models.Index(fields=['sede', '-fecha', '-hora_entrada'], name='visit_sede_fecha_idx'),
+            # Histórico de todas las sedes y visitas del día
+            models.Index(fields=['-fecha', '-hora_entrada'], name='visit_fecha_idx'),
+            # Desplegables de usuarios que registraron visitas en una sede (se resuelven solo con el índice)
+            models.Index(fields=['sede', 'created_by'], name='visit_sede_usuario_idx'),
+            # Cambios recientes: consultas incrementales del listado de visitas activas
+            # (por sede para los usuarios de sede, de todas las sedes para los administradores)
+            models.Index(fields=['updated_at'], name='visit_updated_idx'),
+            models.Index(fields=['sede', 'updated_at'], name='visit_sede_updated_idx'),
+        ]
+        constraints = [
+            # Mientras la visita está activa, la tarjeta no puede entregarse a otra persona en la sede
+            models.UniqueConstraint(fields=['sede', 'tarjeta'], condition=models.Q(hora_salida__isnull=True),
+                                    name='visit_tarjeta_activa_unica',
+                                    violation_error_message=_('La tarjeta ya está en uso en esta sede.')),
+            # Una persona no puede tener dos visitas activas en la misma sede
+            models.UniqueConstraint(fields=['person', 'sede'], condition=models.Q(hora_salida__isnull=True),
+                                    name='visit_persona_activa_unica',
+                                    violation_error_message=_('La persona ya tiene una visita activa en esta sede.')),
+        ]
 
     def __str__(self):
         return f"{self.person} - {self.fecha} {self.hora_entrada}"
-        
+
+    def _counter_key(self):
+        """(sede, fecha, cerrada) con que la visita cuenta en DailyCounter; None si hay campos diferidos"""
+        if not all(name in self.__dict__ for name in ('sede_id', 'fecha', 'hora_salida')):
+            return None
+        fecha = self._meta.get_field('fecha').to_python(self.fecha)
+        return self.sede_id, fecha, self.hora_salida is not None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        visit = super().from_db(db, field_names, values)
+        # Estado guardado, para saber en save() qué cambió (cierre de la visita, contadores)
+        visit._loaded_key = visit._counter_key()
+        return visit
+
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        old_key = None if created else getattr(self, '_loaded_key', None)
+        using = kwargs.get('using') or router.db_for_write(Visit, instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            new_key = self._counter_key()
+            if created or old_key is not None:
+                DailyCounter.objects.db_manager(using).move_visit(old_key, new_key)
+            if old_key is not None and new_key is not None and old_key[1] != new_key[1]:
+                # El resumen del día anterior no se entera por updated_at
+                RollupPendingDay.objects.db_manager(using).mark(old_key[1])
+        self._loaded_key = new_key
+        closed = old_key is not None and not old_key[2] and new_key is not None and new_key[2]
+
+        # Avisar a las pantallas en vivo cuando se confirme la transacción
+        events = visit_events_for(self, created, closed)
+        if events:
+            sede_id = self.sede_id
+
+            def publish():
+                for event, data in events:
+                    VISIT_EVENTS.publish(event, sede_id, data)
+
+            transaction.on_commit(publish, using=using)
+
+    def delete(self, *args, **kwargs):
+        key = getattr(self, '_loaded_key', None)
+        using = kwargs.get('using') or router.db_for_write(Visit, instance=self)
+        with transaction.atomic(using=using):
+            result = super().delete(*args, **kwargs)
+            DailyCounter.objects.db_manager(using).move_visit(key, None)
+            if key is not None:
+                RollupPendingDay.objects.db_manager(using).mark(key[1])
+        return result
+
     def get_receptor_full_name(self):
         if self.receptor_nombre or self.receptor_apellido:
             return f"{self.receptor_nombre} {self.receptor_apellido}".strip()
@@ -179,29 +480,20 @@ class Visit(models.Model):
                 })
         
         # Validar que la tarjeta no esté en uso en esta sede
-        # Solo validar si tenemos tanto la persona como la sede asignadas
-        if hasattr(self, 'person') and self.person and self.sede and not self.hora_salida:
-            if self.person.tarjetavisita:
-                # Buscar visitas activas con esta tarjeta en esta sede (excluyendo esta misma visita)
-                active_visits = Visit.objects.filter(
-                    person__tarjetavisita=self.person.tarjetavisita,
-                    sede=self.sede,
-                    hora_salida__isnull=True
-                )
-                
-                if self.pk:  # Si es una actualización, excluir esta misma visita
-                    active_visits = active_visits.exclude(pk=self.pk)
-                
-                if active_visits.exists():
-                    other_visit = active_visits.first()
-                    raise ValidationError({
-                        'person': _('La tarjeta #%(tarjeta)s ya está en uso por %(persona)s desde %(fecha)s a las %(hora)s.'),
-                    }, params={
-                        'tarjeta': self.person.tarjetavisita,
-                        'persona': other_visit.person.get_full_name(),
-                        'fecha': other_visit.fecha,
-                        'hora': other_visit.hora_entrada.strftime('%H:%M')
-                    })
+        if self.tarjeta and self.sede_id and not self.hora_salida:
+            other_visit = Visit.objects.active_with_tarjeta(self.tarjeta, self.sede_id, exclude_pk=self.pk)
+            if other_visit:
+                raise ValidationError({
+                    'tarjeta': ValidationError(
+                        _('La tarjeta #%(tarjeta)s ya está en uso por %(persona)s desde %(fecha)s a las %(hora)s.'),
+                        params={
+                            'tarjeta': self.tarjeta,
+                            'persona': other_visit.person.get_full_name(),
+                            'fecha': other_visit.fecha,
+                            'hora': other_visit.hora_entrada.strftime('%H:%M')
+                        },
+                    ),
+                })
         
     @staticmethod
     def get_argentina_datetime():
@@ -227,3 +519,380 @@ class Visit(models.Model):
         self.fecha_salida = now.date()
         self.hora_salida = now.time()
         self.save()
+
+class DailyCounterManager(models.Manager):
+    def add(self, sede_id, fecha, **deltas):
+        """
+        Suma `deltas` ({campo: cantidad}) a los contadores de la sede y el día, creando la
+        fila si hace falta. Se llama dentro de la transacción que registra el cambio.
+        """
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        updates = {field: F(field) + delta for field, delta in deltas.items()}
+        rows = self.filter(sede_id=sede_id, fecha=fecha)
+        if rows.update(**updates):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(sede_id=sede_id, fecha=fecha, **deltas)
+        except IntegrityError:
+            # Otra transacción creó la fila primero
+            rows.update(**updates)
+
+    def move_visit(self, old_key, new_key):
+        """Pasa una visita de `old_key` a `new_key` (ver Visit._counter_key; None: no cuenta)"""
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            sede_id, fecha, closed = old_key
+            self.add(sede_id, fecha, visitas=-1, visitas_cerradas=-int(closed))
+        if new_key is not None:
+            sede_id, fecha, closed = new_key
+            self.add(sede_id, fecha, visitas=1, visitas_cerradas=int(closed))
+
+    def stats(self, sede=None, today=None):
+        """
+        Estadísticas de home en una sola consulta: visitas activas, del día y totales (de la
+        sede, o de todas) y personas registradas.
+        """
+        today = today or timezone.localdate()
+        rows = self.all() if sede is None else self.filter(Q(sede=sede) | Q(sede__isnull=True))
+        return rows.aggregate(
+            active_visits_count=Coalesce(Sum(F('visitas') - F('visitas_cerradas')), 0),
+            today_visits_count=Coalesce(Sum('visitas', filter=Q(fecha=today)), 0),
+            total_visits_count=Coalesce(Sum('visitas'), 0),
+            people_count=Coalesce(Sum('personas'), 0),
+        )
+
+    def expected(self):
+        """Contadores calculados desde Visit y Person: {(sede_id, fecha): {campo: valor}}"""
+        counts = {}
+        visits = (Visit.objects.using(self.db).order_by().values_list('sede_id', 'fecha')
+                  .annotate(total=models.Count('id'),
+                            cerradas=models.Count('id', filter=Q(hora_salida__isnull=False))))
+        for sede_id, fecha, total, cerradas in visits.iterator():
+            counts[sede_id, fecha] = {'visitas': total, 'visitas_cerradas': cerradas, 'personas': 0}
+        persons = (Person.objects.using(self.db).order_by()
+                   .annotate(dia=TruncDate('created_at'))
+                   .values_list('dia').annotate(total=models.Count('id')))
+        for fecha, total in persons.iterator():
+            counts[None, fecha] = {'visitas': 0, 'visitas_cerradas': 0, 'personas': total}
+        return counts
+
+    def rebuild(self, fix=True):
+        """
+        Compara los contadores con Visit y Person y, si `fix`, corrige las filas que difieren.
+        Devuelve las diferencias: [(sede_id, fecha, guardado, esperado)].
+        """
+        with transaction.atomic(using=self.db):
+            expected = self.expected()
+            stored = {
+                (row.sede_id, row.fecha): row for row in self.select_for_update().iterator()
+            }
+            differences = []
+            for key in sorted(set(expected) | set(stored), key=lambda k: (k[0] or 0, k[1])):
+                row = stored.get(key)
+                current = {field: getattr(row, field) for field in self.model.COUNTER_FIELDS} if row else None
+                wanted = expected.get(key)
+                if current == wanted or (wanted is None and not any(current.values())):
+                    continue
+                differences.append((*key, current, wanted))
+                if not fix:
+                    continue
+                if wanted is None:
+                    row.delete()
+                elif row is None:
+                    self.create(sede_id=key[0], fecha=key[1], **wanted)
+                else:
+                    self.filter(pk=row.pk).update(**wanted)
+        return differences
+
+class DailyCounter(models.Model):
+    """
+    Contadores de visitas por sede y día de entrada, mantenidos al registrar ingresos y
+    salidas (Visit.save) y personas (filas sin sede, por día de alta). Con `manage.py
+    rebuild_daily_counters` se verifican y corrigen las diferencias de cambios que no pasan
+    por save() o delete() del modelo (update(), bulk_create, borrados masivos).
+    """
+    COUNTER_FIELDS = ('visitas', 'visitas_cerradas', 'personas')
+
+    # Sin índice propio: las consultas por sede usan el de la restricción única (sede, fecha)
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE, null=True, blank=True, db_index=False,
+                             verbose_name=_('Sede'))
+    fecha = models.DateField(_('Fecha'))
+    visitas = models.IntegerField(_('Visitas'), default=0)
+    visitas_cerradas = models.IntegerField(_('Visitas con salida'), default=0)
+    personas = models.IntegerField(_('Personas registradas'), default=0)
+
+    objects = DailyCounterManager()
+
+    class Meta:
+        verbose_name = _('Contador diario')
+        verbose_name_plural = _('Contadores diarios')
+        constraints = [
+            models.UniqueConstraint(fields=['sede', 'fecha'], name='daily_counter_sede_fecha_unico'),
+            models.UniqueConstraint(fields=['fecha'], condition=models.Q(sede__isnull=True),
+                                    name='daily_counter_personas_fecha_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.sede or _('Personas')} - {self.fecha}"
+
+class VisitRollupManager(models.Manager):
+    # Margen al leer los cambios desde la marca de agua: cubre transacciones que se confirmaron
+    # después de tomarla. Recalcular un día dos veces no cambia el resultado
+    WATERMARK_OVERLAP = timedelta(minutes=5)
+    # Días que se recalculan por consulta
+    DAYS_PER_BATCH = 31
+
+    def refresh_days(self, fechas):
+        """Recalcula desde Visit los resúmenes de los días `fechas`; devuelve las filas escritas"""
+        fechas = sorted(set(fechas))
+        written = 0
+        for start in range(0, len(fechas), self.DAYS_PER_BATCH):
+            batch = fechas[start:start + self.DAYS_PER_BATCH]
+            groups = {}
+            visits = (Visit.objects.using(self.db).filter(fecha__in=batch).order_by()
+                      .values_list('fecha', 'sede_id', 'area_id', 'created_by_id', 'person_id',
+                                   'hora_entrada', 'fecha_salida', 'hora_salida'))
+            for fecha, sede_id, area_id, user_id, person_id, entrada, fecha_salida, salida in visits.iterator():
+                group = groups.get((fecha, sede_id, area_id, user_id))
+                if group is None:
+                    group = groups[fecha, sede_id, area_id, user_id] = {
+                        'visitas': 0, 'visitas_cerradas': 0, 'duracion_segundos': 0, 'personas': set(),
+                    }
+                group['visitas'] += 1
+                group['personas'].add(person_id)
+                if salida is not None:
+                    duration = (datetime.combine(fecha_salida or fecha, salida)
+                                - datetime.combine(fecha, entrada)).total_seconds()
+                    group['visitas_cerradas'] += 1
+                    group['duracion_segundos'] += max(0, int(duration))
+            rows = [
+                self.model(fecha=fecha, sede_id=sede_id, area_id=area_id, created_by_id=user_id,
+                           **dict(group, personas=len(group['personas'])))
+                for (fecha, sede_id, area_id, user_id), group in groups.items()
+            ]
+            with transaction.atomic(using=self.db):
+                self.filter(fecha__in=batch).delete()
+                self.bulk_create(rows, batch_size=1000)
+            written += len(rows)
+        return written
+
+    def update_from_watermark(self, full=False):
+        """
+        Actualiza los resúmenes con las visitas creadas o modificadas (p. ej. cerradas) desde
+        la última ejecución y los días pendientes de RollupPendingDay (visitas borradas o
+        cambiadas de fecha); con `full`, o en la primera ejecución, recalcula todos los días.
+        Devuelve (días recalculados, filas escritas).
+        """
+        state, _created = RollupState.objects.using(self.db).get_or_create(nombre=self.model.STATE_NAME)
+        # La marca nueva se toma antes de leer: lo que cambie durante la ejecución entra en la próxima
+        watermark = timezone.now()
+        pending = RollupPendingDay.objects.using(self.db)
+        if full or state.procesado_hasta is None:
+            fechas = list(Visit.objects.using(self.db).order_by().values_list('fecha', flat=True).distinct())
+            self.all().delete()
+        else:
+            since = state.procesado_hasta - self.WATERMARK_OVERLAP
+            fechas = list(Visit.objects.using(self.db).filter(updated_at__gte=since)
+                          .order_by().values_list('fecha', flat=True).distinct())
+            fechas = list({*fechas, *pending.values_list('fecha', flat=True)})
+        written = self.refresh_days(fechas)
+        # Los días marcados cerca de la marca de agua se recalculan otra vez en la próxima ejecución,
+        # como las visitas del margen
+        pending.filter(marcado_en__lt=watermark - self.WATERMARK_OVERLAP).delete()
+        state.procesado_hasta = watermark
+        state.save(update_fields=['procesado_hasta'])
+        return len(fechas), written
+
+    def stats(self, desde, hasta, group_by=('fecha',), sede=None):
+        """
+        Totales agrupados por los campos `group_by` (día, sede, área, usuario) entre `desde`
+        y `hasta` (inclusive). `personas`
+        suma las personas distintas de cada día, sede, área y usuario: una persona que vuelve
+        otro día cuenta de nuevo.
+        """
+        rows = self.filter(fecha__gte=desde, fecha__lte=hasta)
+        if sede is not None:
+            rows = rows.filter(sede=sede)
+        return (rows.order_by(*group_by).values(*group_by)
+                .annotate(visitas=Sum('visitas'), visitas_cerradas=Sum('visitas_cerradas'),
+                          personas=Sum('personas'), duracion_segundos=Sum('duracion_segundos')))
+
+class RollupPendingDayManager(models.Manager):
+    def mark(self, fecha):
+        """Marca el día para que la próxima ejecución de rollup_visits lo recalcule"""
+        rows = self.filter(fecha=fecha)
+        if rows.update(marcado_en=timezone.now()):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(fecha=fecha)
+        except IntegrityError:
+            # Otra transacción creó la fila primero
+            rows.update(marcado_en=timezone.now())
+
+class RollupPendingDay(models.Model):
+    """
+    Días que perdieron visitas sin que quede una visita modificada que los delate (borradas o
+    cambiadas de fecha con save() o delete() del modelo), para VisitRollup.
+    """
+    fecha = models.DateField(_('Fecha'), unique=True)
+    marcado_en = models.DateTimeField(_('Marcado en'), default=timezone.now)
+
+    objects = RollupPendingDayManager()
+
+    class Meta:
+        verbose_name = _('Día pendiente de resumen')
+        verbose_name_plural = _('Días pendientes de resumen')
+
+    def __str__(self):
+        return str(self.fecha)
+
+class RollupState(models.Model):
+    """Marca de agua de los procesos que resumen visitas (hasta cuándo se procesaron cambios)"""
+    nombre = models.CharField(_('Nombre'), max_length=50, unique=True)
+    procesado_hasta = models.DateTimeField(_('Procesado hasta'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('Estado de resumen')
+        verbose_name_plural = _('Estados de resumen')
+
+    def __str__(self):
+        return f"{self.nombre}: {self.procesado_hasta or '-'}"
+
+class VisitRollup(models.Model):
+    """
+    Resumen diario de visitas por sede, área y usuario que las registró. Lo completa
+    `manage.py rollup_visits` (programarlo, p. ej. cada 5 minutos) y lo consultan las
+    estadísticas; los días de hoy reflejan la última ejecución. Los cambios que no pasan por
+    save() o delete() del modelo (update(), borrados masivos o en cascada) necesitan
+    `manage.py rollup_visits --completo`.
+    """
+    STATE_NAME = 'visit_rollup'
+
+    fecha = models.DateField(_('Fecha'))
+    # Sin índice propio: las consultas por sede usan el de la restricción única (sede, fecha, ...)
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE, db_index=False, verbose_name=_('Sede'))
+    area = models.ForeignKey(Estructura, on_delete=models.CASCADE, verbose_name=_('Área'))
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='+', verbose_name=_('Creado por'))
+    visitas = models.IntegerField(_('Visitas'), default=0)
+    visitas_cerradas = models.IntegerField(_('Visitas con salida'), default=0)
+    personas = models.IntegerField(_('Personas distintas'), default=0)
+    duracion_segundos = models.BigIntegerField(_('Duración total (segundos)'), default=0)
+
+    objects = VisitRollupManager()
+
+    class Meta:
+        verbose_name = _('Resumen diario de visitas')
+        verbose_name_plural = _('Resúmenes diarios de visitas')
+        indexes = [
+            # Rangos de fechas de todas las sedes
+            models.Index(fields=['fecha'], name='visit_rollup_fecha_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['sede', 'fecha', 'area', 'created_by'], name='visit_rollup_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.sede} - {self.area} - {self.fecha}"
+
+class ExportJobManager(models.Manager):
+    def recover_stale(self, timeout=None):
+        """
+        Recupera los trabajos "Generando" cuyo worker se cortó: los que no avisaron progreso
+        (heartbeat_at) hace más de EXPORT_STALE_TIMEOUT segundos vuelven a la cola, o quedan
+        con error si ya se intentaron EXPORT_MAX_ATTEMPTS veces. Devuelve cuántos recuperó.
+        """
+        if timeout is None:
+            timeout = settings.EXPORT_STALE_TIMEOUT
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=timeout)
+        stale = self.filter(
+            Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+            status=ExportJob.STATUS_RUNNING,
+        )
+        failed = stale.filter(attempts__gte=settings.EXPORT_MAX_ATTEMPTS).update(
+            status=ExportJob.STATUS_ERROR, finished_at=now,
+            error='La exportación se interrumpió varias veces sin terminar',
+        )
+        requeued = stale.update(status=ExportJob.STATUS_PENDING, progress=0, started_at=None, heartbeat_at=None)
+        return failed + requeued
+
+    def claim_next(self, max_running):
+        """
+        Toma el trabajo pendiente más antiguo y lo marca en ejecución, siempre que no
+        haya ya `max_running` exportaciones corriendo. Devuelve None si no hay nada que hacer.
+        Los trabajos de workers caídos no ocupan lugar: se recuperan antes (recover_stale).
+        """
+        with transaction.atomic():
+            self.recover_stale()
+            if self.filter(status=ExportJob.STATUS_RUNNING).count() >= max_running:
+                return None
+            job = self.filter(status=ExportJob.STATUS_PENDING).order_by('created_at', 'id').first()
+            if job is None:
+                return None
+            # Actualización condicional: si otro worker lo tomó primero, no se pisa
+            now = timezone.now()
+            claimed = self.filter(pk=job.pk, status=ExportJob.STATUS_PENDING).update(
+                status=ExportJob.STATUS_RUNNING, started_at=now, heartbeat_at=now, progress=0,
+                attempts=F('attempts') + 1,
+            )
+        if not claimed:
+            return None
+        job.refresh_from_db()
+        return job
+
+class ExportJob(models.Model):
+    """Exportación del informe de visitas, generada en segundo plano por el worker de exportaciones"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_ERROR = 'error'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('En cola')),
+        (STATUS_RUNNING, _('Generando')),
+        (STATUS_DONE, _('Terminado')),
+        (STATUS_ERROR, _('Error')),
+    ]
+    FORMAT_CHOICES = [
+        ('pdf', 'PDF'),
+    ]
+
+    formato = models.CharField(_('Formato'), max_length=10, choices=FORMAT_CHOICES, default='pdf')
+    filtros = models.JSONField(_('Filtros'), default=dict, blank=True)
+    status = models.CharField(_('Estado'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    progress = models.PositiveSmallIntegerField(_('Progreso (%)'), default=0)
+    total_rows = models.PositiveIntegerField(_('Cantidad de visitas'), null=True, blank=True)
+    file_path = models.CharField(_('Archivo'), max_length=500, blank=True)
+    error = models.TextField(_('Error'), blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs',
+                                   verbose_name=_('Solicitado por'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(_('Inicio'), null=True, blank=True)
+    # Último aviso de progreso del worker: sin avisos, el trabajo se da por caído (recover_stale)
+    heartbeat_at = models.DateTimeField(_('Último progreso'), null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(_('Intentos'), default=0)
+    finished_at = models.DateTimeField(_('Fin'), null=True, blank=True)
+
+    objects = ExportJobManager()
+
+    class Meta:
+        verbose_name = _('Exportación de informe')
+        verbose_name_plural = _('Exportaciones de informes')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_formato_display()} #{self.id} - {self.get_status_display()}"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_ERROR)
+
+    def set_progress(self, progress):
+        """Actualiza solo el progreso (y el aviso de que el worker sigue vivo), sin pisar el resto de los campos"""
+        self.progress = progress
+        ExportJob.objects.filter(pk=self.pk).update(progress=progress, heartbeat_at=timezone.now())
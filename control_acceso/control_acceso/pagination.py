@@ -0,0 +1,162 @@
+"""
+Paginación por cursor (keyset) para listados largos.
+
+En lugar de OFFSET, cada página pide las filas que siguen a la última mostrada según el
+orden del listado, por ejemplo (fecha, hora_entrada, id). Con un índice sobre esas columnas
+la página 1000 cuesta lo mismo que la primera.
+
+Los cursores son opacos y firmados (django.core.signing): llevan los valores de orden de la
+fila límite, la dirección, el número de página y el total de filas. El total se cuenta una
+sola vez, en la primera página, y viaja en los cursores; es una referencia, no se recalcula
+si entran visitas nuevas mientras se navega.
+"""
+import math
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'control_acceso.pagination'
+
+
+class KeysetPage:
+    """Página de resultados; se usa en los templates como la Page de Django"""
+
+    def __init__(self, object_list, number, count, per_page, next_cursor, previous_cursor, last_cursor):
+        self.object_list = object_list
+        self.number = number
+        self.count = count
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.last_cursor = last_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def start_index(self):
+        if not self.object_list or self.number is None:
+            return 0
+        return (self.number - 1) * self.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
+
+
+class KeysetPaginator:
+    """
+    Pagina `queryset` según `ordering`, que debe identificar cada fila de forma única
+    (terminar en 'id' o '-id') y tener columnas no nulas.
+
+    Con count=False no se cuenta el total: la página no muestra "de N registros" ni el
+    número de la última página.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-fecha', '-hora_entrada', '-id'), count=True):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+        self.count = count
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _encode(self, obj, direction, number, count):
+        keys = None
+        if obj is not None:
+            keys = [self.queryset.model._meta.get_field(name).value_to_string(obj) for name, _desc in self.fields]
+        return signing.dumps({'k': keys, 'd': direction, 'n': number, 'c': count}, salt=CURSOR_SALT, compress=True)
+
+    def _decode(self, cursor):
+        """Datos del cursor, o None si falta o no es válido (se muestra la primera página)"""
+        if not cursor:
+            return None
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+            if data['k'] is not None:
+                data['k'] = [self.queryset.model._meta.get_field(name).to_python(value)
+                             for (name, _desc), value in zip(self.fields, data['k'], strict=True)]
+            return data
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            return None
+
+    def _after(self, keys, backwards):
+        """
+        Filas que van después de `keys` en el orden del listado (antes, si `backwards`).
+
+        La primera columna se acota también sola (fecha <= x) para que la base recorra un
+        rango del índice; el resto desempata.
+        """
+        condition = None
+        for (name, desc), value in reversed(list(zip(self.fields, keys))):
+            op = 'lt' if desc != backwards else 'gt'
+            strict = Q(**{f'{name}__{op}': value})
+            condition = strict if condition is None else strict | (Q(**{name: value}) & condition)
+        first_name, first_desc = self.fields[0]
+        bound = Q(**{f'{first_name}__{"lte" if first_desc != backwards else "gte"}': keys[0]})
+        return bound & condition
+
+    def get_page(self, cursor=None):
+        data = self._decode(cursor)
+        if data is None:
+            data = {'k': None, 'd': 'next', 'n': 1, 'c': self.queryset.count() if self.count else None}
+        backwards = data['d'] == 'prev'
+        count = data['c']
+
+        number = data['n']
+        limit = self.per_page
+        if data['k'] is None and backwards and count is not None:
+            # Cursor "última página": sus filas son las que quedan después de las páginas
+            # completas, igual que si se hubiera llegado avanzando desde la primera
+            number = max(1, math.ceil(count / self.per_page))
+            limit = max(1, count - (number - 1) * self.per_page)
+
+        queryset = self.queryset
+        if data['k'] is not None:
+            queryset = queryset.filter(self._after(data['k'], backwards))
+        if backwards:
+            queryset = queryset.order_by(*[name if desc else f'-{name}' for name, desc in self.fields])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # Una fila de más indica si hay otra página en esa dirección
+        rows = list(queryset[:limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        if backwards:
+            has_previous, has_next = more, data['k'] is not None
+        else:
+            has_previous, has_next = data['k'] is not None, more
+        if not rows:
+            has_previous = has_next = False
+
+        next_number = number + 1 if number is not None else None
+        previous_number = number - 1 if number is not None else None
+        last_cursor = None
+        if has_next:
+            last_cursor = signing.dumps({'k': None, 'd': 'prev', 'n': None, 'c': count},
+                                        salt=CURSOR_SALT, compress=True)
+        return KeysetPage(
+            rows, number, count, self.per_page,
+            next_cursor=self._encode(rows[-1], 'next', next_number, count) if has_next else None,
+            previous_cursor=self._encode(rows[0], 'prev', previous_number, count) if has_previous else None,
+            last_cursor=last_cursor,
+        )
@@ -0,0 +1,231 @@
+"""
+Motor alternativo del PDF del informe de visitas: dibuja la tabla directamente con
+reportlab platypus, sin pasar por HTML. Reproduce el diseño de MEJORAS_PDF.md
+(encabezado con logo, filtros, tabla y pie con numeración de páginas).
+
+Este módulo sólo dibuja: las filas, las miniaturas y el logo los prepara reports.py.
+"""
+import io
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+from reportlab.platypus import (
+    BaseDocTemplate, Flowable, Frame, Image, NextPageTemplate, PageTemplate, Paragraph, Spacer, Table, TableStyle,
+)
+
+# Colores institucionales (MEJORAS_PDF.md)
+AZUL = colors.HexColor('#1e3c72')
+AZUL_SECUNDARIO = colors.HexColor('#34495e')
+TEXTO = colors.HexColor('#2c3e50')
+BORDE = colors.HexColor('#dee2e6')
+FILA_ALTERNADA = colors.HexColor('#f8f9fa')
+
+MARGEN_LATERAL = 15 * mm
+MARGEN_SUPERIOR = 25 * mm
+MARGEN_INFERIOR = 25 * mm
+
+FUENTE = 'Helvetica'
+FUENTE_NEGRITA = 'Helvetica-Bold'
+TAMANIO_FUENTE = 7.5
+
+COLUMNAS = ['FECHA', 'DNI', 'NOMBRE', 'SEDE', 'ÁREA', 'ENTRADA', 'SALIDA', 'FOTO', 'REGISTRADO POR']
+ANCHOS = [18 * mm, 18 * mm, 30 * mm, 24 * mm, 30 * mm, 13 * mm, 13 * mm, 14 * mm, 20 * mm]
+FOTO_LADO = 12 * mm
+
+# Filas por tabla de platypus: tablas chicas se parten entre páginas mucho más rápido
+FILAS_POR_TABLA = 200
+
+PIE_TITULO = "Control de Acceso - Desarrollado por Sebastian D' Agostino, Lucas Gomez, Armando Ramirez, Daniel Dziektierow"
+
+_ESTILO_ENCABEZADO_COLUMNAS = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), AZUL_SECUNDARIO),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
+    ('FONTNAME', (0, 0), (-1, -1), FUENTE_NEGRITA),
+    ('FONTSIZE', (0, 0), (-1, -1), TAMANIO_FUENTE),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDE),
+])
+
+_ESTILO_FILAS = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), FUENTE),
+    ('FONTSIZE', (0, 0), (-1, -1), TAMANIO_FUENTE),
+    ('LEADING', (0, 0), (-1, -1), TAMANIO_FUENTE + 1.5),
+    ('TEXTCOLOR', (0, 0), (-1, -1), TEXTO),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('ALIGN', (7, 0), (7, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDE),
+    ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, FILA_ALTERNADA]),
+])
+
+
+def _envolver(texto, ancho):
+    """Parte un texto en líneas que entren en la columna (más barato que un Paragraph)"""
+    return '\n'.join(simpleSplit(texto or '-', FUENTE, TAMANIO_FUENTE, ancho - 4))
+
+
+def _encabezado_columnas():
+    return Table([COLUMNAS], colWidths=ANCHOS, style=_ESTILO_ENCABEZADO_COLUMNAS)
+
+
+class _Foto(Flowable):
+    """Miniatura ya decodificada; una misma instancia se reutiliza en todas las visitas de la persona"""
+
+    def __init__(self, data):
+        super().__init__()
+        self.imagen = ImageReader(io.BytesIO(data))
+
+    def wrap(self, available_width, available_height):
+        return FOTO_LADO, FOTO_LADO
+
+    def draw(self):
+        self.canv.drawImage(self.imagen, 0, 0, FOTO_LADO, FOTO_LADO)
+
+
+class _NumberedCanvas(canvas.Canvas):
+    """Canvas que difiere el dibujo del pie para poder escribir "Página X de N" """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._paginas = []
+
+    def showPage(self):
+        self._paginas.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        total = len(self._paginas)
+        for numero, estado in enumerate(self._paginas, start=1):
+            self.__dict__.update(estado)
+            self._dibujar_pie(numero, total)
+            super().showPage()
+        super().save()
+
+    def _dibujar_pie(self, numero, total):
+        ancho = self._pagesize[0]
+        self.saveState()
+        self.setFillColor(AZUL)
+        self.rect(0, 0, ancho, 18 * mm, stroke=0, fill=1)
+        self.setFillColor(colors.white)
+        self.setFont(FUENTE_NEGRITA, 7)
+        self.drawCentredString(ancho / 2, 12 * mm, PIE_TITULO)
+        self.setFont(FUENTE, 6.5)
+        self.drawCentredString(ancho / 2, 8 * mm, f'© {self._anio} Todos los derechos reservados')
+        self.drawRightString(ancho - MARGEN_LATERAL, 3.5 * mm, f'Página {numero} de {total}')
+        self.restoreState()
+
+
+def _encabezado_informe(logo, usuario, generado, filtros):
+    """Flowables de la primera página: encabezado con logo, metadatos y filtros aplicados"""
+    blanco = ParagraphStyle('blanco', fontName=FUENTE, fontSize=9, textColor=colors.white, leading=11)
+    titulo = ParagraphStyle('titulo', parent=blanco, fontName=FUENTE_NEGRITA, fontSize=16, leading=20)
+    meta = ParagraphStyle('meta', parent=blanco, fontSize=8, leading=10, alignment=2)
+
+    logo_flowable = Image(io.BytesIO(logo), width=14 * mm, height=14 * mm) if logo else ''
+    encabezado = Table(
+        [[
+            logo_flowable,
+            [Paragraph('Control de Acceso', titulo), Paragraph('Informe de Actividad de Visitas', blanco)],
+            [Paragraph(f'Fecha: {generado:%d/%m/%Y}', meta), Paragraph(f'Hora: {generado:%H:%M}', meta),
+             Paragraph(f'Usuario: {escape(usuario)}', meta)],
+        ]],
+        colWidths=[20 * mm, 100 * mm, 60 * mm],
+        style=TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), AZUL),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('TOPPADDING', (0, 0), (-1, -1), 6),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ]),
+    )
+    flowables = [encabezado, Spacer(1, 5 * mm)]
+
+    if filtros:
+        seccion = ParagraphStyle('seccion', fontName=FUENTE_NEGRITA, fontSize=9, textColor=colors.white,
+                                 backColor=AZUL_SECUNDARIO, borderPadding=(3, 4, 3, 4), leading=11)
+        flowables += [
+            Paragraph('Filtros Aplicados', seccion),
+            Spacer(1, 2 * mm),
+            Table(filtros, colWidths=[35 * mm, 145 * mm], hAlign='LEFT', style=TableStyle([
+                ('FONTNAME', (0, 0), (0, -1), FUENTE_NEGRITA),
+                ('FONTNAME', (1, 0), (1, -1), FUENTE),
+                ('FONTSIZE', (0, 0), (-1, -1), 8),
+                ('TEXTCOLOR', (0, 0), (-1, -1), TEXTO),
+                ('LINEBELOW', (0, 0), (-1, -1), 0.5, BORDE),
+            ])),
+            Spacer(1, 4 * mm),
+        ]
+    return flowables
+
+
+def build_informe_pdf(dest, filas, usuario, generado, filtros, logo=None):
+    """
+    Escribe el PDF del informe en `dest`.
+
+    `filas` es un iterable de tuplas (fecha, dni, nombre, sede, área, entrada, salida,
+    foto JPEG o None, usuario que registró) con los textos ya formateados.
+    `filtros` es una lista de pares (etiqueta, valor). Devuelve la cantidad de filas.
+    """
+    encabezado_columnas = _encabezado_columnas()
+    alto_encabezado = encabezado_columnas.wrap(sum(ANCHOS), A4[1])[1]
+
+    def pagina_siguiente(c, doc):
+        # Las páginas siguientes repiten el encabezado de la tabla arriba del marco
+        encabezado_columnas.drawOn(c, MARGEN_LATERAL, A4[1] - MARGEN_SUPERIOR - alto_encabezado)
+
+    ancho = A4[0] - 2 * MARGEN_LATERAL
+    alto = A4[1] - MARGEN_SUPERIOR - MARGEN_INFERIOR
+    doc = BaseDocTemplate(dest, pagesize=A4, title='Informe de Actividad de Visitas', author=usuario,
+                          leftMargin=MARGEN_LATERAL, rightMargin=MARGEN_LATERAL,
+                          topMargin=MARGEN_SUPERIOR, bottomMargin=MARGEN_INFERIOR)
+    doc.addPageTemplates([
+        PageTemplate('primera', [Frame(MARGEN_LATERAL, MARGEN_INFERIOR, ancho, alto, 0, 0, 0, 0)]),
+        PageTemplate('siguientes', [Frame(MARGEN_LATERAL, MARGEN_INFERIOR, ancho, alto - alto_encabezado, 0, 0, 0, 0)],
+                     onPage=pagina_siguiente),
+    ])
+
+    seccion = ParagraphStyle('seccion', fontName=FUENTE_NEGRITA, fontSize=9, textColor=colors.white,
+                             backColor=AZUL, borderPadding=(3, 4, 3, 4), leading=11)
+    story = _encabezado_informe(logo, usuario, generado, filtros) + [
+        NextPageTemplate('siguientes'),
+        Paragraph('Registro de Visitas', seccion),
+        Spacer(1, 3 * mm),
+        encabezado_columnas,
+    ]
+
+    # Cada foto se decodifica una sola vez aunque la persona tenga muchas visitas
+    fotos = {}
+    total = 0
+    bloque = []
+    for fecha, dni, nombre, sede, area, entrada, salida, foto, registrado_por in filas:
+        if foto:
+            if foto not in fotos:
+                fotos[foto] = _Foto(foto)
+            celda_foto = fotos[foto]
+        else:
+            celda_foto = 'Sin foto'
+        bloque.append([
+            fecha, dni, _envolver(nombre, ANCHOS[2]), _envolver(sede, ANCHOS[3]), _envolver(area, ANCHOS[4]),
+            entrada, salida, celda_foto, _envolver(registrado_por, ANCHOS[8]),
+        ])
+        total += 1
+        if len(bloque) == FILAS_POR_TABLA:
+            story.append(Table(bloque, colWidths=ANCHOS, style=_ESTILO_FILAS))
+            bloque = []
+    if bloque:
+        story.append(Table(bloque, colWidths=ANCHOS, style=_ESTILO_FILAS))
+    if not total:
+        story.append(Table([['No hay visitas para los filtros seleccionados.']], colWidths=[ancho], style=TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#999999')),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ])))
+
+    class _Canvas(_NumberedCanvas):
+        _anio = generado.year
+
+    doc.build(story, canvasmaker=_Canvas)
+    return total
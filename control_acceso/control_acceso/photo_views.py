@@ -0,0 +1,114 @@
+import io
+from functools import wraps
+
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .models import Person, PersonPhoto, PersonPhotoThumbnail
+from .photos import THUMBNAIL_SIZES
+
+# Un año: las URLs por hash nunca cambian de contenido
+PHOTO_HASH_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def _photo_etag(photo_hash, size):
+    """ETag fuerte derivado del hash del contenido y del tamaño pedido"""
+    return f'{photo_hash}-{size or "original"}'
+
+
+def _person_photo_etag(request, person_id, size=None):
+    """Obtiene el ETag de la foto de una persona consultando solo su hash, sin cargar la imagen"""
+    photo_hash = Person.objects.filter(id=person_id).values_list('stored_photo_id', flat=True).first()
+    if photo_hash:
+        return _photo_etag(photo_hash, size)
+    return None
+
+
+def _hash_photo_etag(request, sha256, size=None):
+    """ETag sólo si la foto existe: un hash que todavía no se guardó no debe responder 304"""
+    if size and size not in THUMBNAIL_SIZES:
+        return None
+    if not PersonPhoto.objects.filter(sha256=sha256).exists():
+        return None
+    return _photo_etag(sha256, size)
+
+
+def _cache_found_photo(view_func):
+    """
+    Cache-Control de un año sólo para las respuestas con foto (200 o 304): un 404 (p. ej. un
+    hash pedido antes de que se confirme su carga) no queda cacheado en el navegador.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, private=True, max_age=PHOTO_HASH_MAX_AGE, immutable=True)
+        return response
+    return _wrapped_view
+
+
+def _image_response(data, content_type):
+    """Respuesta binaria en streaming (con Content-Length) para los bytes de una imagen"""
+    return FileResponse(io.BytesIO(data), content_type=content_type)
+
+
+def _photo_response(size, **photo_lookup):
+    """
+    Devuelve la imagen (o su miniatura) de la foto que cumpla `photo_lookup`.
+    Si se indica `size` ('thumb', 'pdf' o 'detail') devuelve la miniatura precalculada.
+    """
+    if size and size not in THUMBNAIL_SIZES:
+        return HttpResponse(status=404)
+
+    if size:
+        thumbnail_lookup = {f'photo__{key}': value for key, value in photo_lookup.items()}
+        thumbnail = PersonPhotoThumbnail.objects.filter(size=size, **thumbnail_lookup).only('data').first()
+        if thumbnail:
+            return _image_response(thumbnail.data, 'image/jpeg')
+
+    photo = PersonPhoto.objects.filter(**photo_lookup).only('data', 'content_type').first()
+
+    if photo:
+        if size:
+            # Fotos anteriores a las miniaturas: generarla ahora y guardarla
+            thumbnail = photo.get_thumbnail(size)
+            if thumbnail:
+                return _image_response(thumbnail.data, 'image/jpeg')
+        return _image_response(photo.data, photo.content_type)
+    else:
+        # Devolver una imagen por defecto o un error 404
+        return HttpResponse(status=404)
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_person_photo_etag)
+def get_person_photo_direct(request, person_id, size=None):
+    """
+    Vista para obtener la foto de una persona directamente como imagen.
+    La URL depende de la persona y no del contenido, por eso el navegador debe revalidar
+    siempre; si la foto no cambió se responde 304 sin leer la imagen de la base.
+    """
+    # Se consulta directamente el almacén de fotos: un solo SELECT sin cargar la persona
+    return _photo_response(size, persons__id=person_id)
+
+
+@_cache_found_photo
+@condition(etag_func=_hash_photo_etag)
+def person_photo_by_hash(request, sha256, size=None):
+    """
+    Vista para obtener una foto por su hash de contenido.
+    El contenido de estas URLs nunca cambia, así que se cachean por un año.
+    """
+    return _photo_response(size, sha256=sha256)
+
+
+def get_person_photo(request):
+    """
+    API binaria: devuelve la foto de una persona indicada por `person_id`
+    (y opcionalmente `size`) como imagen, sin codificarla en base64.
+    """
+    person_id = request.GET.get('person_id', '')
+    if not person_id.isdigit():
+        return JsonResponse({'error': 'ID de persona no proporcionado'}, status=400)
+    return get_person_photo_direct(request, int(person_id), size=request.GET.get('size') or None)
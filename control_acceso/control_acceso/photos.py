@@ -0,0 +1,79 @@
+"""
+Procesamiento de imágenes de las fotos de personas (Pillow).
+
+Este módulo sólo trabaja con bytes: el almacenamiento lo resuelven los modelos
+PersonPhoto y PersonPhotoThumbnail.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+# Tamaños fijos de miniatura: nombre -> (ancho, alto, recortar al cuadrado)
+THUMBNAIL_SIZES = {
+    'thumb': (96, 96, True),     # Listados (se muestran a 48x48, doble densidad)
+    'pdf': (120, 120, True),     # Tabla del informe PDF
+    'detail': (320, 320, False), # Ficha de persona / visita
+}
+
+THUMBNAIL_QUALITY = 80
+
+# Errores de Pillow ante imágenes corruptas, en formatos desconocidos o demasiado grandes
+PHOTO_DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+# Normalización al guardar: toda foto se almacena como JPEG de tamaño acotado y sin metadatos
+PHOTO_MAX_DIMENSION = 1024
+PHOTO_QUALITY = 85
+PHOTO_CONTENT_TYPE = 'image/jpeg'
+
+# Formatos que se conservan tal como llegan si ya cumplen los límites y pesan menos que
+# recodificados (p. ej. PNG de pocos colores, que crecen al pasarlos a JPEG)
+PHOTO_ORIGINAL_FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+PHOTO_METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp')
+
+
+def _is_within_limits(image):
+    """La imagen ya cumple la normalización salvo el formato: tamaño acotado y sin metadatos"""
+    return (image.format in PHOTO_ORIGINAL_FORMATS
+            and max(image.size) <= PHOTO_MAX_DIMENSION
+            and not any(key in image.info for key in PHOTO_METADATA_KEYS)
+            and not image.getexif())
+
+
+def normalize_photo(data):
+    """
+    Normaliza una foto recibida por cualquier vía (cámara, archivo, importación):
+    aplica la orientación EXIF, limita las dimensiones a PHOTO_MAX_DIMENSION y la
+    recodifica como JPEG sin metadatos. Si la original ya cumplía los límites y pesa menos
+    que la recodificada, se conserva la original. Devuelve (bytes, content_type).
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        original_format = image.format if _is_within_limits(image) else None
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+        image.thumbnail((PHOTO_MAX_DIMENSION, PHOTO_MAX_DIMENSION), Image.LANCZOS)
+        output = io.BytesIO()
+        # Al no pasar exif/icc_profile, Pillow no copia los metadatos originales
+        image.save(output, format='JPEG', quality=PHOTO_QUALITY, optimize=True, progressive=True)
+        normalized = output.getvalue()
+    if original_format and len(data) <= len(normalized):
+        return data, PHOTO_ORIGINAL_FORMATS[original_format]
+    return normalized, PHOTO_CONTENT_TYPE
+
+
+def make_thumbnail(data, size):
+    """
+    Genera una miniatura JPEG a partir de los bytes de una imagen.
+    Devuelve (bytes, ancho, alto).
+    """
+    width, height, crop = THUMBNAIL_SIZES[size]
+    with Image.open(io.BytesIO(data)) as image:
+        # Las fotos aún sin normalizar (p. ej. migradas) pueden venir rotadas por EXIF
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+        if crop:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        return output.getvalue(), image.width, image.height
@@ -0,0 +1,505 @@
+"""
+Generación del informe de visitas fuera del ciclo de la petición.
+
+La vista informe_visitas y el worker de exportaciones comparten aquí el filtrado
+de visitas, la construcción del PDF y las exportaciones tabulares (CSV/XLSX).
+"""
+import base64
+import csv
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.template.loader import get_template
+from django.utils import timezone
+from .export_cache import cache_get_copy, cache_put
+from .models import ExportJob, Visit, Sede, PersonPhoto, PersonPhotoThumbnail
+from .search import dni_search_q, person_search_q
+from .xlsx import iter_xlsx
+
+try:
+    from xhtml2pdf import pisa
+    # pypdf y reportlab son dependencias de xhtml2pdf: se usan para unir las partes y numerar
+    from pypdf import PdfReader, PdfWriter
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+    XHTML2PDF_AVAILABLE = True
+except ImportError:
+    XHTML2PDF_AVAILABLE = False
+
+try:
+    from .pdf_reportlab import build_informe_pdf
+    REPORTLAB_AVAILABLE = True
+except ImportError:
+    REPORTLAB_AVAILABLE = False
+
+# Motores del PDF del informe (settings.INFORME_PDF_ENGINE admite además 'auto')
+PDF_ENGINES = ('xhtml2pdf', 'reportlab')
+
+# Filas por parte del PDF: cada parte se convierte por separado, así la memoria
+# depende del tamaño de la parte y no del informe completo
+PDF_CHUNK_ROWS = 500
+
+# Columnas de las exportaciones CSV/XLSX: (encabezado, campo de values_list). Sin fotos.
+EXPORT_COLUMNS = [
+    ('Fecha', 'fecha'),
+    ('DNI', 'person__dni'),
+    ('Apellido', 'person__apellido'),
+    ('Nombre', 'person__nombre'),
+    ('Tarjeta', 'tarjeta'),
+    ('Sede', 'sede__nombre'),
+    ('Área', 'area__unidad_organica'),
+    ('Hora entrada', 'hora_entrada'),
+    ('Fecha salida', 'fecha_salida'),
+    ('Hora salida', 'hora_salida'),
+    ('Receptor nombre', 'receptor_nombre'),
+    ('Receptor apellido', 'receptor_apellido'),
+    ('Registrado por', 'created_by__username'),
+]
+
+# Filas que se leen de la base por tanda al exportar
+EXPORT_CHUNK_SIZE = 2000
+
+# Parámetros GET del informe que filtran las visitas
+FILTER_PARAMS = ('fecha_inicio', 'fecha_fin', 'nombre', 'apellido', 'dni', 'tarjetavisita', 'sede', 'area', 'usuario')
+
+
+class ReportError(Exception):
+    """Error al generar un informe"""
+
+
+def get_filtros(querydict):
+    """Extrae del GET los filtros del informe que tienen valor"""
+    filtros = {}
+    for param in FILTER_PARAMS:
+        value = querydict.get(param, '').strip()
+        if value:
+            filtros[param] = value
+    return filtros
+
+
+def filter_visitas(visitas, filtros):
+    """Aplica los filtros del informe a un queryset de visitas"""
+    if filtros.get('fecha_inicio'):
+        visitas = visitas.filter(fecha__gte=filtros['fecha_inicio'])
+    if filtros.get('fecha_fin'):
+        visitas = visitas.filter(fecha__lte=filtros['fecha_fin'])
+    if filtros.get('nombre') or filtros.get('apellido'):
+        visitas = visitas.filter(person_search_q('person__', nombre=filtros.get('nombre'), apellido=filtros.get('apellido')))
+    if filtros.get('dni'):
+        visitas = visitas.filter(dni_search_q(filtros['dni'], 'person__'))
+    if filtros.get('tarjetavisita'):
+        visitas = visitas.filter(tarjeta__icontains=filtros['tarjetavisita'])
+    if filtros.get('sede'):
+        visitas = visitas.filter(sede_id=filtros['sede'])
+    if filtros.get('area'):
+        visitas = visitas.filter(area_id=filtros['area'])
+    if filtros.get('usuario'):
+        visitas = visitas.filter(created_by_id=filtros['usuario'])
+    return visitas
+
+
+def get_visitas_informe(filtros):
+    """Queryset ordenado de las visitas del informe"""
+    visitas = Visit.objects.select_related('person', 'sede', 'area', 'created_by')
+    return filter_visitas(visitas, filtros).order_by('-fecha', '-hora_entrada')
+
+
+@lru_cache(maxsize=1)
+def get_logo_bytes():
+    """Obtiene los bytes del logo institucional (leídos una sola vez por proceso), o None si no se encuentra"""
+    for logo_path in (
+        os.path.join(os.path.dirname(__file__), 'static', 'logo.png'),
+        os.path.join(os.path.dirname(__file__), '..', 'static', 'logo.png'),
+    ):
+        try:
+            with open(logo_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            continue
+    return None
+
+
+def get_logo_base64():
+    """Obtiene el logo institucional como data URL, o None si no se encuentra"""
+    logo = get_logo_bytes()
+    if logo is None:
+        return None
+    return 'data:image/png;base64,' + base64.b64encode(logo).decode('utf-8')
+
+
+def get_fotos_pdf_bytes(photo_hashes):
+    """Devuelve {hash: bytes JPEG} con las miniaturas de PDF de las fotos indicadas"""
+    # Una sola consulta (una vez por hash, aunque se repita la persona)
+    fotos = dict(PersonPhotoThumbnail.objects.filter(photo_id__in=photo_hashes, size='pdf').values_list('photo_id', 'data'))
+    for photo in PersonPhoto.objects.filter(sha256__in=set(photo_hashes) - fotos.keys()):
+        thumbnail = photo.get_thumbnail('pdf')
+        if thumbnail:
+            fotos[photo.sha256] = thumbnail.data
+    return fotos
+
+
+def get_fotos_pdf(photo_hashes):
+    """Devuelve {hash: data URL} con las miniaturas de PDF de las fotos indicadas"""
+    return {
+        sha256: 'data:image/jpeg;base64,' + base64.b64encode(data).decode('utf-8')
+        for sha256, data in get_fotos_pdf_bytes(photo_hashes).items()
+    }
+
+
+def build_visitas_pdf(visitas):
+    """Convierte visitas en las filas que usa la tabla del PDF"""
+    fotos_base64 = get_fotos_pdf({v.person.photo_hash for v in visitas if v.person.photo_hash})
+    visitas_pdf = []
+    for v in visitas:
+        if v.created_by:
+            usuario_registro = v.created_by.get_full_name() or v.created_by.username
+        else:
+            usuario_registro = "-"
+        visitas_pdf.append({
+            'fecha': v.fecha,
+            'dni': v.person.dni,
+            'nombre': v.person.get_full_name(),
+            'sede': v.sede.nombre,
+            'area': v.area.unidad_organica,
+            'hora_entrada': v.hora_entrada,
+            'hora_salida': v.hora_salida if v.hora_salida else '-',
+            'foto_base64': fotos_base64.get(v.person.photo_hash),
+            'usuario_registro': usuario_registro
+        })
+    return visitas_pdf
+
+
+def _iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _numerar_paginas(writer):
+    """Agrega "Página X de N" al pie de cada página del PDF ya unido"""
+    total = len(writer.pages)
+    overlay = tempfile.TemporaryFile()
+    c = canvas.Canvas(overlay, pagesize=A4)
+    for numero in range(1, total + 1):
+        c.setFont('Helvetica', 8)
+        c.setFillColorRGB(0.5, 0.55, 0.55)
+        c.drawRightString(A4[0] - 15 * mm, 6 * mm, f'Página {numero} de {total}')
+        c.showPage()
+    c.save()
+    overlay.seek(0)
+    for page, numero_page in zip(writer.pages, PdfReader(overlay).pages):
+        page.merge_page(numero_page)
+    return overlay
+
+
+def _nombre_usuario(usuario):
+    return usuario.get_full_name() or usuario.username if usuario else '-'
+
+
+def get_pdf_engine(total_rows, engine=None):
+    """
+    Elige el motor del PDF: el indicado, o el de settings.INFORME_PDF_ENGINE.
+    Con 'auto', los informes chicos usan la plantilla HTML y los grandes reportlab.
+    """
+    engine = engine or settings.INFORME_PDF_ENGINE
+    if engine == 'auto':
+        if REPORTLAB_AVAILABLE and total_rows >= settings.INFORME_PDF_REPORTLAB_MIN_ROWS:
+            return 'reportlab'
+        return 'xhtml2pdf'
+    if engine not in PDF_ENGINES:
+        raise ReportError(f'Motor de PDF desconocido: {engine}')
+    return engine
+
+
+def render_informe_pdf(filtros, usuario, dest, progress=None, engine=None):
+    """
+    Genera el PDF del informe de visitas y lo escribe en `dest` (archivo binario).
+    `progress(porcentaje)` se llama a medida que avanza la generación.
+    Devuelve la cantidad de visitas incluidas.
+    """
+    total_rows = get_visitas_informe(filtros).count()
+    if get_pdf_engine(total_rows, engine) == 'reportlab':
+        render_informe_pdf_reportlab(filtros, usuario, dest, total_rows, progress)
+    else:
+        render_informe_pdf_xhtml2pdf(filtros, usuario, dest, total_rows, progress)
+    if progress:
+        progress(95)
+    return total_rows
+
+
+def render_informe_pdf_xhtml2pdf(filtros, usuario, dest, total_rows, progress=None):
+    """
+    Motor por plantilla: las visitas se convierten con xhtml2pdf en partes de
+    PDF_CHUNK_ROWS filas que luego se unen con pypdf.
+    """
+    if not XHTML2PDF_AVAILABLE:
+        raise ReportError('xhtml2pdf no está instalado. No se puede exportar a PDF.')
+
+    total_chunks = max(1, -(-total_rows // PDF_CHUNK_ROWS))
+    if total_rows:
+        chunks = _iter_chunks(get_visitas_informe(filtros).iterator(chunk_size=PDF_CHUNK_ROWS), PDF_CHUNK_ROWS)
+    else:
+        chunks = [[]]
+
+    template = get_template('admin/informe_visitas.html')
+    context = {
+        'sedes': list(Sede.objects.all()),
+        'filtros': filtros,
+        'usuario_reporte': _nombre_usuario(usuario),
+        'pdf_export': True,
+        'logo_base64': get_logo_base64(),
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        partes = []
+        for i, visitas in enumerate(chunks):
+            # Solo la primera parte lleva el encabezado del informe y los filtros
+            html = template.render({**context, 'visitas_pdf': build_visitas_pdf(visitas), 'pdf_continuacion': i > 0})
+            parte = os.path.join(tmpdir, f'parte_{i}.pdf')
+            with open(parte, 'wb') as f:
+                pisa_status = pisa.CreatePDF(html, dest=f)
+            if pisa_status.err:
+                raise ReportError('Error al generar el PDF')
+            partes.append(parte)
+            if progress:
+                progress(5 + 85 * (i + 1) // total_chunks)
+
+        writer = PdfWriter()
+        for parte in partes:
+            writer.append(parte)
+        with _numerar_paginas(writer):
+            writer.write(dest)
+
+
+# Campos que lee el motor reportlab: una sola consulta plana, sin instanciar modelos
+_REPORTLAB_FIELDS = (
+    'fecha', 'person__dni', 'person__nombre', 'person__apellido', 'sede__nombre', 'area__unidad_organica',
+    'hora_entrada', 'hora_salida', 'person__stored_photo_id',
+    'created_by__username', 'created_by__first_name', 'created_by__last_name',
+)
+
+
+def _iter_filas_reportlab(filtros, total_rows, progress=None):
+    visitas = get_visitas_informe(filtros).values_list(*_REPORTLAB_FIELDS).iterator(chunk_size=PDF_CHUNK_ROWS)
+    total_chunks = max(1, -(-total_rows // PDF_CHUNK_ROWS))
+    for i, chunk in enumerate(_iter_chunks(visitas, PDF_CHUNK_ROWS)):
+        fotos = get_fotos_pdf_bytes({row[8] for row in chunk if row[8]})
+        for (fecha, dni, nombre, apellido, sede, area, hora_entrada, hora_salida, photo_hash,
+             username, first_name, last_name) in chunk:
+            if username:
+                usuario_registro = f'{first_name} {last_name}'.strip() or username
+            else:
+                usuario_registro = '-'
+            yield (
+                fecha.strftime('%d/%m/%Y'), dni, f'{nombre} {apellido}'.strip(), sede, area,
+                hora_entrada.strftime('%H:%M'), hora_salida.strftime('%H:%M') if hora_salida else '-',
+                fotos.get(photo_hash), usuario_registro,
+            )
+        if progress:
+            progress(5 + 45 * (i + 1) // total_chunks)
+
+
+def _filtros_reportlab(filtros):
+    """Filtros aplicados como pares (etiqueta, valor), igual que en la plantilla del PDF"""
+    etiquetas = [
+        ('fecha_inicio', 'Fecha desde:'), ('fecha_fin', 'Fecha hasta:'), ('nombre', 'Nombre:'),
+        ('apellido', 'Apellido:'), ('dni', 'DNI:'),
+    ]
+    pares = [(etiqueta, filtros[param]) for param, etiqueta in etiquetas if filtros.get(param)]
+    if filtros.get('sede'):
+        sede = Sede.objects.filter(id=filtros['sede']).values_list('nombre', flat=True).first()
+        pares.append(('Sede:', sede or ''))
+    return pares
+
+
+def render_informe_pdf_reportlab(filtros, usuario, dest, total_rows, progress=None):
+    """Motor directo: dibuja la tabla con reportlab platypus usando las miniaturas precalculadas"""
+    if not REPORTLAB_AVAILABLE:
+        raise ReportError('reportlab no está instalado. No se puede exportar a PDF.')
+
+    build_informe_pdf(
+        dest,
+        _iter_filas_reportlab(filtros, total_rows, progress),
+        usuario=_nombre_usuario(usuario),
+        generado=timezone.localtime(),
+        filtros=_filtros_reportlab(filtros),
+        logo=get_logo_bytes(),
+    )
+
+
+def _normalizar_filtros(filtros):
+    """Filtros en forma canónica, para que pedidos equivalentes compartan la clave de caché"""
+    normalizados = {}
+    for param in FILTER_PARAMS:
+        value = str(filtros.get(param) or '').strip()
+        if not value:
+            continue
+        if param in ('sede', 'area', 'usuario') and value.isdigit():
+            value = str(int(value))
+        elif param in ('fecha_inicio', 'fecha_fin'):
+            try:
+                value = datetime.date.fromisoformat(value).isoformat()
+            except ValueError:
+                pass
+        normalizados[param] = value
+    return normalizados
+
+
+def get_data_watermark(filtros):
+    """
+    Marca de agua de los datos del informe: cambia ante cualquier alta, baja o modificación
+    de una visita del rango o de la persona (incluida su foto), sede o área que muestra, y si
+    cambia el nombre de un usuario de la columna "Registrado por".
+    """
+    visitas = filter_visitas(Visit.objects.all(), filtros)
+    watermark = visitas.aggregate(
+        total=Count('id'),
+        visitas=Max('updated_at'),
+        personas=Max('person__updated_at'),
+        sedes=Max('sede__updated_at'),
+        areas=Max('area__updated_at'),
+    )
+    # Los usuarios no tienen fecha de modificación: se usan sus nombres
+    usuarios = sorted(visitas.order_by().values_list(
+        'created_by__username', 'created_by__first_name', 'created_by__last_name').distinct(),
+        key=lambda usuario: tuple(value or '' for value in usuario))
+    watermark['usuarios'] = hashlib.sha256(json.dumps(usuarios).encode('utf-8')).hexdigest()
+    return watermark
+
+
+def get_export_cache_key(formato, filtros, usuario):
+    """
+    Clave de caché de una exportación: hash de los filtros normalizados, de lo que cambia
+    el contenido del archivo (formato, motor, usuario del encabezado) y de la marca de agua.
+    Devuelve (clave, cantidad de visitas).
+    """
+    watermark = get_data_watermark(filtros)
+    data = {
+        'formato': formato,
+        'filtros': _normalizar_filtros(filtros),
+        'usuario': _nombre_usuario(usuario),
+        'motor': get_pdf_engine(watermark['total']) if formato == 'pdf' else None,
+        'datos': watermark,
+    }
+    key = hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+    return key, watermark['total']
+
+
+def run_export_job(job):
+    """Genera el archivo de una exportación ya tomada por un worker y registra el resultado"""
+    os.makedirs(settings.EXPORTS_ROOT, exist_ok=True)
+    file_path = os.path.join(settings.EXPORTS_ROOT, _export_file_name(job))
+    try:
+        # La marca de agua se toma antes de generar: si los datos cambian durante la
+        # generación, la clave ya no coincide y el archivo no se guarda en la caché
+        cache_key, total_rows = get_export_cache_key(job.formato, job.filtros, job.created_by)
+        if not cache_get_copy(cache_key, job.formato, file_path):
+            with open(file_path, 'wb') as dest:
+                total_rows = render_informe_pdf(job.filtros, job.created_by, dest, progress=job.set_progress)
+            if get_export_cache_key(job.formato, job.filtros, job.created_by)[0] == cache_key:
+                cache_put(cache_key, job.formato, file_path)
+    except Exception as e:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        job.status = ExportJob.STATUS_ERROR
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+
+    job.status = ExportJob.STATUS_DONE
+    job.progress = 100
+    job.total_rows = total_rows
+    job.file_path = file_path
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'progress', 'total_rows', 'file_path', 'finished_at'])
+    return job
+
+
+def _export_file_name(job):
+    return f'informe_visitas_{job.id}.{job.formato}'
+
+
+def cleanup_export_files(max_age=None):
+    """
+    Borra los archivos de las exportaciones terminadas hace más de EXPORT_FILE_MAX_AGE segundos
+    (dejan de poder descargarse) y los de EXPORTS_ROOT que ya no son de ningún trabajo, p. ej.
+    de trabajos borrados. La caché de exportaciones tiene su propio límite (export_cache).
+    Devuelve la cantidad de archivos borrados.
+    """
+    if max_age is None:
+        max_age = settings.EXPORT_FILE_MAX_AGE
+    cutoff = timezone.now() - datetime.timedelta(seconds=max_age)
+    ExportJob.objects.filter(finished_at__lt=cutoff).exclude(file_path='').update(file_path='')
+
+    # Archivos en uso: los de descargas vigentes y los que se están generando
+    in_use = {os.path.basename(path) for path in
+              ExportJob.objects.exclude(file_path='').values_list('file_path', flat=True)}
+    in_use.update(_export_file_name(job) for job in
+                  ExportJob.objects.filter(status=ExportJob.STATUS_RUNNING).only('id', 'formato'))
+    try:
+        entries = [entry for entry in os.scandir(settings.EXPORTS_ROOT)
+                   if entry.is_file() and entry.name not in in_use]
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff.timestamp():
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def iter_export_rows(filtros):
+    """Recorre las visitas del informe como tuplas planas, de a EXPORT_CHUNK_SIZE filas por consulta"""
+    fields = [field for _header, field in EXPORT_COLUMNS]
+    visitas = filter_visitas(Visit.objects.all(), filtros).order_by('-fecha', '-hora_entrada')
+    return visitas.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class _Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en lugar de guardarla"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d/%m/%Y %H:%M')
+    if isinstance(value, datetime.date):
+        return value.strftime('%d/%m/%Y')
+    if isinstance(value, datetime.time):
+        return value.strftime('%H:%M')
+    return value
+
+
+def iter_csv(header, rows):
+    """Genera un CSV línea por línea (separado por ';', con BOM para Excel)"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def iter_visitas_csv(filtros):
+    """Genera el CSV del informe línea por línea"""
+    return iter_csv([header for header, _field in EXPORT_COLUMNS], iter_export_rows(filtros))
+
+
+def iter_visitas_xlsx(filtros):
+    """Genera el XLSX del informe en tandas de filas"""
+    header = [header for header, _field in EXPORT_COLUMNS]
+    return iter_xlsx(header, iter_export_rows(filtros), sheet_name='Visitas')
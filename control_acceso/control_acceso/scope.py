@@ -0,0 +1,68 @@
+"""
+Alcance de acceso del usuario: su sede asignada y si es administrador.
+
+ScopeMiddleware lo resuelve una vez por request como `request.access_scope` (no
+`request.scope`, que con ASGI es el diccionario de la conexión); las vistas filtran las visitas
+con Visit.objects.for_scope(request.access_scope) en lugar de consultar el perfil cada vez.
+El perfil llega con el usuario de la sesión (backends.ProfileModelBackend), así que el alcance
+refleja siempre la base: un cambio de sede o de permisos vale desde el request siguiente en
+todos los procesos.
+"""
+from functools import wraps
+
+from django.contrib.auth.views import redirect_to_login
+
+
+class AccessScope:
+    """Sede y permisos del usuario de un request"""
+
+    def __init__(self, user_id=None, sede_id=None, is_admin=False, has_profile=False):
+        self.user_id = user_id
+        self.sede_id = sede_id
+        # Superusuario o perfil de administrador: ve todas las sedes
+        self.is_admin = is_admin
+        self.has_profile = has_profile
+
+    def __repr__(self):
+        return f'<AccessScope user={self.user_id} sede={self.sede_id} admin={self.is_admin}>'
+
+    @property
+    def is_authenticated(self):
+        return self.user_id is not None
+
+    @property
+    def restricted(self):
+        """Usuario de sede (con perfil y sin permisos de administrador)"""
+        return self.has_profile and not self.is_admin
+
+    @property
+    def sede_filter(self):
+        """Sede por la que se filtran las visitas que ve el usuario, o None si las ve todas"""
+        return self.sede_id if self.restricted and self.sede_id else None
+
+    @property
+    def allowed_sede_ids(self):
+        """Sedes a las que puede acceder el usuario; None si son todas"""
+        if not self.restricted:
+            return None
+        return frozenset([self.sede_id]) if self.sede_id else frozenset()
+
+    @property
+    def can_register_visits(self):
+        """Los administradores registran en cualquier sede; el resto necesita una sede asignada"""
+        return self.is_admin or bool(self.has_profile and self.sede_id)
+
+    def can_access_sede(self, sede_id):
+        """Determina si el usuario puede acceder a una sede específica"""
+        allowed = self.allowed_sede_ids
+        return allowed is None or (sede_id is not None and int(sede_id) in allowed)
+
+
+def admin_required(view_func):
+    """Como user_passes_test para superusuarios y administradores, con request.access_scope"""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.access_scope.is_admin:
+            return view_func(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path())
+    return _wrapped_view
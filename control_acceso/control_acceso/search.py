@@ -0,0 +1,122 @@
+"""
+Búsqueda de personas por nombre, apellido, tarjeta y DNI.
+
+En SQLite se usa la tabla FTS5 control_acceso_person_fts, que refleja nombre, apellido,
+DNI y tarjeta de control_acceso_person y se mantiene sincronizada con triggers de la base
+(también con los update() y bulk_create que no disparan señales de Django). El tokenizador
+ignora mayúsculas y acentos ("jose" encuentra "José", "munoz" encuentra "Muñoz") y cada
+palabra buscada se toma como prefijo ("gonz" encuentra "González").
+
+En otras bases se mantiene la búsqueda con icontains.
+
+El DNI se busca por sus primeros dígitos en Person.dni_texto (ver dni_search_q).
+
+Si una migración futura reconstruye la tabla de personas (SQLite lo hace al alterar
+columnas), los triggers se pierden con la tabla vieja: esa migración debe volver a llamar
+a install_person_search, o correr después `manage.py rebuild_person_search`.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+PERSON_TABLE = 'control_acceso_person'
+FTS_TABLE = 'control_acceso_person_fts'
+FTS_COLUMNS = ('nombre', 'apellido', 'dni', 'tarjetavisita')
+
+# Palabras del texto buscado; el resto (comillas, guiones, operadores de FTS5) se descarta
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _fts_statements():
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+    insert_new = f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {new_values});'
+    delete_old = (f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns}) "
+                  f"VALUES ('delete', old.id, {old_values});")
+    return [
+        # Tabla de contenido externo: el índice guarda sólo los términos, no copia los datos
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{columns}, content='{PERSON_TABLE}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PERSON_TABLE} BEGIN {insert_new} END',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PERSON_TABLE} BEGIN {delete_old} END',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {PERSON_TABLE} '
+        f'BEGIN {delete_old} {insert_new} END',
+        # Indexa las personas que ya estaban cargadas
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+def install_person_search(connection):
+    """Crea (o repara) el índice FTS5 y sus triggers, y lo regenera. No hace nada fuera de SQLite"""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        for statement in _fts_statements():
+            cursor.execute(statement)
+    return True
+
+
+def uninstall_person_search(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def build_match(terms):
+    """
+    Expresión MATCH de FTS5 para {columna: texto}: todas las palabras de cada texto deben
+    aparecer en su columna, como prefijo. Devuelve None si no queda ninguna palabra.
+    """
+    parts = []
+    for column, text in terms.items():
+        for token in _TOKEN_RE.findall(text or ''):
+            parts.append(f'{column} : "{token}"*')
+    return ' AND '.join(parts) or None
+
+
+def person_search_q(prefix='', using=None, **terms):
+    """
+    Condición para filtrar por nombre, apellido, dni y/o tarjetavisita de la persona.
+
+    `prefix` es el camino a la persona desde el modelo filtrado ('' para Person,
+    'person__' para Visit). Los términos vacíos se ignoran.
+    """
+    terms = {column: text for column, text in terms.items() if text}
+    if not terms:
+        return Q()
+    unknown = set(terms) - set(FTS_COLUMNS)
+    if unknown:
+        raise ValueError(f'Columnas sin índice de búsqueda: {", ".join(sorted(unknown))}')
+
+    match = build_match(terms)
+    if match is not None and connections[using or DEFAULT_DB_ALIAS].vendor == 'sqlite':
+        return Q(**{f'{prefix}id__in': RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]
+        )})
+
+    q = Q()
+    for column, text in terms.items():
+        q &= Q(**{f'{prefix}{column}__icontains': text})
+    return q
+
+
+def dni_search_q(dni, prefix=''):
+    """
+    Condición para buscar por los primeros dígitos del DNI ("2345" encuentra 23456789).
+
+    Se ignoran puntos y espacios ("23.456"). Es un rango sobre el índice de Person.dni_texto:
+    ':' es el carácter siguiente a '9', así que [dígitos, dígitos + ':') son los textos
+    que empiezan con esos dígitos.
+    """
+    digits = re.sub(r'\D', '', dni or '').lstrip('0')
+    if not digits:
+        # Un texto sin dígitos no coincide con ningún DNI
+        return Q(**{f'{prefix}pk__in': []})
+    return Q(**{f'{prefix}dni_texto__gte': digits, f'{prefix}dni_texto__lt': digits + ':'})
@@ -50,7 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'control_acceso.middleware.SlidingSessionMiddleware',  # Sesiones sin escribir en cada request
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -58,8 +58,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # Middlewares personalizados
     'control_acceso.middleware.LoginRequiredMiddleware',  # Requiere login
+    'control_acceso.middleware.ScopeMiddleware',  # request.access_scope: sede y permisos del usuario
 ]
 
+# El perfil del usuario se carga con él en cada request (ver control_acceso/scope.py)
+AUTHENTICATION_BACKENDS = ['control_acceso.backends.ProfileModelBackend']
+
 ROOT_URLCONF = 'control_acceso.urls'
 
 TEMPLATES = [
@@ -140,5 +144,30 @@ LOGOUT_REDIRECT_URL = 'login'
 
 # Configuración de sesión
 SESSION_COOKIE_AGE = 1200  # 20 minutos en segundos
-SESSION_SAVE_EVERY_REQUEST = True
+# La sesión se lee del caché y se guarda en la base sólo al cambiar o cuando le quedan menos
+# de SESSION_REFRESH_THRESHOLD segundos (ver SlidingSessionMiddleware). Con varios procesos,
+# configurar en CACHES un caché compartido (Redis, Memcached) para que un logout valga en todos.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_THRESHOLD = 900  # 15 minutos: a lo sumo un guardado cada 5 minutos de actividad
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+
+# Exportaciones en segundo plano (worker: python manage.py export_worker)
+EXPORTS_ROOT = BASE_DIR / 'exports'
+EXPORT_WORKERS = 2  # Máximo de exportaciones generándose a la vez
+EXPORT_POLL_INTERVAL = 2  # Segundos entre consultas del worker a la cola
+EXPORT_CACHE_ROOT = EXPORTS_ROOT / 'cache'  # Exportaciones ya generadas, reutilizables mientras no cambien los datos
+EXPORT_CACHE_MAX_SIZE = 500 * 1024 * 1024  # Bytes; al superarlo se borran las menos usadas
+EXPORT_FILE_MAX_AGE = 24 * 60 * 60  # Segundos que se conservan los archivos de las exportaciones terminadas
+# Segundos sin avisos de progreso tras los que una exportación "Generando" se da por caída y se
+# vuelve a encolar, hasta EXPORT_MAX_ATTEMPTS intentos
+EXPORT_STALE_TIMEOUT = 30 * 60
+EXPORT_MAX_ATTEMPTS = 3
+
+# Motor del PDF del informe de visitas: 'xhtml2pdf' (plantilla HTML), 'reportlab' (dibujo directo)
+# o 'auto' (reportlab a partir de INFORME_PDF_REPORTLAB_MIN_ROWS visitas)
+INFORME_PDF_ENGINE = 'auto'
+INFORME_PDF_REPORTLAB_MIN_ROWS = 2000
+
+# Análisis de visitas: horas a partir de las cuales una visita se considera excedida
+VISITA_EXCEDIDA_HORAS = 8
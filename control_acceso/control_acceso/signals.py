@@ -1,23 +1,26 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def save_user_profile(sender, instance, created, update_fields=None, raw=False, **kwargs):
     """
-    Crea un perfil de usuario automáticamente cuando se crea un usuario nuevo
+    Guarda el perfil del usuario si se modificó en memoria junto con el usuario, sin consultar
+    la base. Los guardados parciales (p. ej. update_last_login en cada login) no lo tocan, y
+    el perfil que falta se crea cuando se necesita (UserProfile.objects.for_user), no aquí:
+    así el inline del admin puede crearlo al dar de alta el usuario.
     """
-    if created:
-        UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """
-    Guarda el perfil de usuario automáticamente cuando se guarda un usuario
-    """
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
-    else:
-        # En caso de que el perfil no exista (usuarios antiguos)
-        UserProfile.objects.create(user=instance)
+    if raw or update_fields is not None:
+        return
+    profile_rel = User.profile.related
+    if not profile_rel.is_cached(instance):
+        return
+    profile = profile_rel.get_cached_value(instance)
+    if profile is None:
+        return
+    if profile._state.adding:
+        profile.save()
+        return
+    changed = profile.changed_fields()
+    if changed:
+        profile.save(update_fields=changed + ['updated_at'])
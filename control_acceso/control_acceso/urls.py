@@ -4,9 +4,14 @@ from django.contrib.auth import views as django_auth_views  # Add this import
 from . import views
 from . import admin_views
 from . import auth_views
+from . import photo_views
 
 urlpatterns = [
     path('admin/informe-visitas/', admin_views.informe_visitas, name='informe_visitas'),
+    path('admin/analisis-visitas/', admin_views.analisis_visitas, name='analisis_visitas'),
+    path('admin/informe-visitas/exportaciones/<int:job_id>/', admin_views.export_job_detail, name='export_job_detail'),
+    path('admin/informe-visitas/exportaciones/<int:job_id>/estado/', admin_views.export_job_status, name='export_job_status'),
+    path('admin/informe-visitas/exportaciones/<int:job_id>/descargar/', admin_views.export_job_download, name='export_job_download'),
     path('admin/', admin.site.urls),
     
     # Rutas de autenticación
@@ -25,7 +30,11 @@ urlpatterns = [
     
     # API para búsquedas y carga dinámica
     path('api/buscar-persona/', views.search_person, name='search_person'),
-    path('api/get-person-photo/', views.get_person_photo, name='get_person_photo'),
+    path('api/visitas-activas/', views.active_visits_api, name='active_visits_api'),
+    path('api/visitas/ingreso/', views.checkin_api, name='checkin_api'),
+    path('api/eventos/visitas/', views.visit_events, name='visit_events'),
+    path('api/estadisticas/visitas/', views.visit_stats_api, name='visit_stats_api'),
+    path('api/get-person-photo/', photo_views.get_person_photo, name='get_person_photo'),
     # Listado de personas solo para admin
     path('personas/lista/', views.person_list, name='person_list'),
     path('personas/<int:person_id>/', views.person_detail, name='person_detail'),
@@ -49,7 +58,11 @@ urlpatterns = [
     path('api/check-tarjeta-disponible/', views.check_tarjeta_disponible, name='check_tarjeta_disponible'),
     
     # API para obtener la foto de una persona
-    path('get-person-photo/<int:person_id>/', views.get_person_photo_direct, name='get_person_photo'),
+    path('get-person-photo/<int:person_id>/', photo_views.get_person_photo_direct, name='get_person_photo'),
+    path('get-person-photo/<int:person_id>/<slug:size>/', photo_views.get_person_photo_direct, name='get_person_photo_sized'),
+    # Fotos direccionadas por hash: inmutables, cacheables indefinidamente por el navegador
+    path('fotos/<slug:sha256>/', photo_views.person_photo_by_hash, name='person_photo_by_hash'),
+    path('fotos/<slug:sha256>/<slug:size>/', photo_views.person_photo_by_hash, name='person_photo_by_hash_sized'),
 
     path('buscador-internos/', views.mostrar_buscador_internos, name='internos'),
 
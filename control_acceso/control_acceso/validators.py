@@ -19,11 +19,7 @@ def validate_tarjeta_visita_available(tarjeta, sede_id):
         return True
         
     # Verificar si existe alguna visita activa (sin salida) usando esta tarjeta en esta sede
-    active_visit = Visit.objects.filter(
-        person__tarjetavisita=tarjeta,
-        sede_id=sede_id,
-        hora_salida__isnull=True
-    ).first()
+    active_visit = Visit.objects.active_with_tarjeta(tarjeta, sede_id)
     
     if active_visit:
         person = active_visit.person
@@ -1,17 +1,18 @@
 from django.shortcuts import get_object_or_404
-from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from .scope import admin_required
 
 # Vista de detalle de persona
 @login_required
-@user_passes_test(lambda u: u.is_superuser or (hasattr(u, 'profile') and u.profile.is_admin))
+@admin_required
 def person_detail(request, person_id):
     person = get_object_or_404(Person, id=person_id)
     return render(request, 'person_detail.html', {'person': person})
 
 # Vista de edición de persona
 @login_required
-@user_passes_test(lambda u: u.is_superuser or (hasattr(u, 'profile') and u.profile.is_admin))
+@admin_required
 def person_edit(request, person_id):
     person = get_object_or_404(Person, id=person_id)
     if request.method == 'POST':
@@ -30,26 +31,23 @@ def person_edit(request, person_id):
         form = PersonForm(instance=person)
     return render(request, 'person_edit.html', {'form': form, 'person': person})
 from django.core.paginator import Paginator
-from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.decorators import login_required
+from .pagination import KeysetPaginator
+from .search import dni_search_q, person_search_q
 
 # Vista para listar personas solo para admin
 @login_required
-@user_passes_test(lambda u: u.is_superuser or (hasattr(u, 'profile') and u.profile.is_admin))
+@admin_required
 def person_list(request):
     nombre = request.GET.get('nombre', '').strip()
     apellido = request.GET.get('apellido', '').strip()
     dni = request.GET.get('dni', '').strip()
     tarjetavisita = request.GET.get('tarjetavisita', '').strip()
 
-    persons = Person.objects.all()
-    if nombre:
-        persons = persons.filter(nombre__icontains=nombre)
-    if apellido:
-        persons = persons.filter(apellido__icontains=apellido)
+    # Nombre, apellido y tarjeta se buscan en el índice de texto (ver search.py)
+    persons = Person.objects.filter(person_search_q(nombre=nombre, apellido=apellido, tarjetavisita=tarjetavisita))
     if dni:
-        persons = persons.filter(dni__icontains=dni)
-    if tarjetavisita:
-        persons = persons.filter(tarjetavisita__icontains=tarjetavisita)
+        persons = persons.filter(dni_search_q(dni))
 
     persons = persons.order_by('apellido', 'nombre')
     paginator = Paginator(persons, 20)
@@ -67,46 +65,38 @@ def person_list(request):
     return render(request, 'person_list.html', {'persons': page_obj, 'filtros': filtros})
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
 from django.contrib import messages
 from django.utils import timezone
-from .models import Visit, Person, Sede, Estructura
-from .forms import VisitForm, PersonForm
+from .models import DailyCounter, RollupState, Visit, VisitRollup, Person, Sede, Estructura
+from .forms import CheckinPersonForm, CheckinVisitForm, VisitForm, PersonForm
 import base64
 from django.core.files.base import ContentFile
-from datetime import date
-
+from datetime import date, timedelta
+from django.utils.dateparse import parse_date, parse_datetime
+import json
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from .events import HEARTBEAT_SECONDS, VISIT_EVENTS
+
+from django.db import IntegrityError, transaction
 from django.db.models import Max
+from django.forms.models import model_to_dict
+from django.views.decorators.http import require_POST
 from django.utils import timezone
 
 def home(request):
     """Vista para la página principal"""
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
-    
-    # Filtros base para visitas
-    visits_queryset = Visit.objects.all()
-
-    # Aplicar filtro por sede si el usuario no es superuser y tiene una sede asignada
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-        visits_queryset = visits_queryset.filter(sede=user_sede)
+    # Visitas de la sede del usuario si no es admin
+    visits_queryset = Visit.objects.for_scope(request.access_scope)
 
-    # Estadísticas generales
-    active_visits_count = visits_queryset.filter(hora_salida__isnull=True).count()
-    today_visits_count = visits_queryset.filter(fecha=timezone.localtime(timezone.now()).date()).count()
-    total_visits_count = visits_queryset.count()
-    people_count = Person.objects.count()
+    # Estadísticas generales: activas, del día, totales y personas, desde los contadores diarios
+    context = DailyCounter.objects.stats(sede=request.access_scope.sede_filter)
 
     # Últimas visitas: Filtrar solo las que tienen hora de salida (visitas completadas)
-    recent_visits = visits_queryset.filter(hora_salida__isnull=False).order_by('-fecha', '-hora_entrada')[:10]
-
-    context = {
-        'active_visits_count': active_visits_count,
-        'today_visits_count': today_visits_count,
-        'people_count': people_count,
-        'total_visits_count': total_visits_count,
-        'recent_visits': recent_visits,
-    }
+    context['recent_visits'] = (visits_queryset.filter(hora_salida__isnull=False).select_related('person', 'sede')
+                                .order_by('-fecha', '-hora_entrada')[:10])
     
     return render(request, 'home.html', context)
 
@@ -116,22 +106,11 @@ def search_person(request):
     if dni:
         try:
             person = Person.objects.get(dni=dni)
-            # Verificar si la persona tiene una visita activa
-            user_sede = None
-            if hasattr(request.user, 'profile'):
-                user_sede = request.user.profile.sede
-            
-            if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-                active_visit = Visit.objects.filter(
-                    person=person,
-                    hora_salida__isnull=True,
-                    sede=user_sede
-                ).first()
-            else:
-                active_visit = Visit.objects.filter(
-                    person=person,
-                    hora_salida__isnull=True
-                ).first()
+            # Verificar si la persona tiene una visita activa (en la sede del usuario si no es admin)
+            active_visit = Visit.objects.for_scope(request.access_scope).filter(
+                person=person,
+                hora_salida__isnull=True
+            ).select_related('sede', 'area').first()
             
             # Preparar la respuesta con los datos de la persona
             response_data = {
@@ -145,7 +124,10 @@ def search_person(request):
                 'tarjetavisita': person.tarjetavisita,
                 'observaciones': person.observaciones,
                 'has_active_visit': active_visit is not None,
-                'has_photo': bool(person.photo)
+                'has_photo': person.has_photo,
+                # La foto se descarga aparte, en binario y cacheable por hash
+                'photo_hash': person.photo_hash,
+                'photo_url': reverse('person_photo_by_hash_sized', args=[person.photo_hash, 'detail']) if person.photo_hash else None,
             }
             
             # Si tiene una visita activa, agregar la información detallada
@@ -157,7 +139,7 @@ def search_person(request):
                     'active_visit_subarea': '',  # Si necesitas incluir subárea
                     'active_visit_fecha': active_visit.fecha.strftime('%Y-%m-%d'),
                     'active_visit_hora_entrada': active_visit.hora_entrada.strftime('%H:%M'),
-                    'active_visit_tarjeta': person.tarjetavisita
+                    'active_visit_tarjeta': active_visit.tarjeta
                 })
             
             return JsonResponse(response_data)
@@ -171,14 +153,10 @@ def register_visit(request):
     # Verificar si hay un DNI en la URL para prellenar
     dni_from_url = request.GET.get('dni')
     
-    # Obtener la sede del usuario
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
+    scope = request.access_scope
     
     # Si el usuario no es admin y no tiene sede asignada, mostrar mensaje y redirigir
-    if not request.user.is_superuser and not hasattr(request.user, 'profile') or \
-       not request.user.is_superuser and not request.user.profile.is_admin and not user_sede:
+    if not scope.can_register_visits:
         messages.error(request, "No tienes una sede asignada. Por favor, contacta con un administrador.")
         return redirect('home')
     
@@ -189,12 +167,12 @@ def register_visit(request):
         
         # Si el usuario no es admin, forzar la sede del usuario
         submitted_sede = request.POST.get('sede')
-        if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-            if user_sede:
+        if scope.restricted:
+            if scope.sede_id:
                 # Forzar la sede del usuario en el POST data
                 request.POST = request.POST.copy()
-                request.POST['sede'] = str(user_sede.id)
-                submitted_sede = str(user_sede.id)
+                request.POST['sede'] = str(scope.sede_id)
+                submitted_sede = str(scope.sede_id)
             else:
                 messages.error(request, "No tienes una sede asignada. Por favor, contacta con un administrador.")
                 return redirect('register_visit')
@@ -211,18 +189,10 @@ def register_visit(request):
                 
             if existing_person:
                 # Si el usuario no es admin, verificar solo visitas activas en su sede
-                if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-                    has_active_visit = Visit.objects.filter(
-                        person=existing_person,
-                        hora_salida__isnull=True,
-                        sede=user_sede
-                    ).exists()
-                else:
-                    # Para admins, verificar todas las visitas activas
-                    has_active_visit = Visit.objects.filter(
-                        person=existing_person,
-                        hora_salida__isnull=True
-                    ).exists()
+                has_active_visit = Visit.objects.for_scope(scope).filter(
+                    person=existing_person,
+                    hora_salida__isnull=True
+                ).exists()
                 
                 # Si tiene una visita activa, mostrar advertencia y continuar
                 if has_active_visit:
@@ -259,34 +229,33 @@ def register_visit(request):
             sede_id = visit_form.cleaned_data.get('sede').id
             
             # Validar que la tarjeta no esté en uso en esta sede
-            if tarjeta_visita:
-                # Buscar visitas activas con esta tarjeta en esta sede
-                active_visit_with_card = Visit.objects.filter(
-                    person__tarjetavisita=tarjeta_visita,
-                    sede_id=sede_id,
-                    hora_salida__isnull=True
-                ).first()
-                
-                if active_visit_with_card:
-                    person_with_card = active_visit_with_card.person
-                    error_message = (f'La tarjeta #{tarjeta_visita} ya está en uso por {person_with_card.nombre} {person_with_card.apellido} '
-                                    f'desde {active_visit_with_card.fecha} a las {active_visit_with_card.hora_entrada.strftime("%H:%M")}. '
-                                    f'Debe registrar la salida antes de volver a usar esta tarjeta en esta sede.')
-                    messages.error(request, error_message)
-                    return render(request, 'register_visit.html', {
-                        'person_form': person_form,
-                        'visit_form': visit_form
-                    })
+            available, error_message, _active_visit = validate_tarjeta_visita(tarjeta_visita, sede_id)
+            # Una persona no puede tener dos visitas activas en la misma sede
+            if available and existing_person and Visit.objects.filter(
+                person=existing_person, sede_id=sede_id, hora_salida__isnull=True
+            ).exists():
+                available, error_message = False, 'La persona ya tiene una visita activa en esta sede.'
+            if not available:
+                messages.error(request, error_message)
+                return render(request, 'register_visit.html', {
+                    'person_form': person_form,
+                    'visit_form': visit_form
+                })
             
             # Si todo está bien, guardar la persona
             person = person_form.save(commit=False)
             
             # Procesar la foto si existe
             photo_data = request.POST.get('photo_data_url')
+            photo_hash = person_form.cleaned_data.get('photo_hash')
             if photo_data and ';base64,' in photo_data:
+                # Foto nueva capturada con la cámara
                 format, imgstr = photo_data.split(';base64,')
                 binary_data = base64.b64decode(imgstr)
                 person.photo = binary_data
+            elif photo_hash and photo_hash != person.photo_hash:
+                # Foto ya existente en el almacén: se referencia por hash, sin volver a subirla
+                person.stored_photo_id = photo_hash
             
             person.save()
         else:
@@ -309,8 +278,8 @@ def register_visit(request):
         visit.person = person
         
         # Forzar la sede del usuario si no es admin
-        if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-            visit.sede = user_sede
+        if scope.restricted:
+            visit.sede_id = scope.sede_id
         
         # Usar fecha y hora actual con la configuración de timezone de Django (Argentina)
         current_datetime = timezone.localtime(timezone.now())
@@ -320,7 +289,21 @@ def register_visit(request):
         # Registrar el usuario que creó la visita
         visit.created_by = request.user
         
-        visit.save()
+        # La tarjeta entregada queda en la visita: la de la persona puede cambiar después
+        visit.tarjeta = person.tarjetavisita or None
+        
+        try:
+            with transaction.atomic():
+                visit.save()
+        except IntegrityError:
+            # Las restricciones de la base rechazaron la visita (p. ej. otra terminal entregó
+            # la misma tarjeta al mismo tiempo): se informa el motivo sin guardar
+            available, error_message, _active_visit = validate_tarjeta_visita(visit.tarjeta, visit.sede_id)
+            messages.error(request, error_message or 'La persona ya tiene una visita activa en esta sede.')
+            return render(request, 'register_visit.html', {
+                'person_form': person_form,
+                'visit_form': visit_form
+            })
         
         messages.success(request, 'Visita registrada exitosamente.')
         return redirect('visit_detail', visit_id=visit.id)
@@ -331,12 +314,12 @@ def register_visit(request):
         visit_form = VisitForm()
         
         # Preseleccionar la sede del usuario si no es admin
-        if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-            visit_form.fields['sede'].initial = user_sede.id
+        if scope.sede_filter is not None:
+            visit_form.fields['sede'].initial = scope.sede_id
             # Deshabilitar el campo de sede para usuarios no admin
             visit_form.fields['sede'].widget.attrs['disabled'] = 'disabled'
             # También podemos ocultar las otras sedes del dropdown
-            visit_form.fields['sede'].queryset = Sede.objects.filter(id=user_sede.id)
+            visit_form.fields['sede'].queryset = Sede.objects.filter(id=scope.sede_id)
             
             # Mostrar todas las áreas activas ordenadas por unidad orgánica
             visit_form.fields['area'].queryset = Estructura.objects.filter(activo=True).order_by('unidad_organica')
@@ -348,18 +331,10 @@ def register_visit(request):
                 
                 # Verificar si la persona tiene una visita activa
                 # Si el usuario no es admin, verificar solo visitas en su sede
-                if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-                    has_active_visit = Visit.objects.filter(
-                        person=person,
-                        hora_salida__isnull=True,
-                        sede=user_sede
-                    ).exists()
-                else:
-                    # Para admins, verificar todas las visitas activas
-                    has_active_visit = Visit.objects.filter(
-                        person=person,
-                        hora_salida__isnull=True
-                    ).exists()
+                has_active_visit = Visit.objects.for_scope(scope).filter(
+                    person=person,
+                    hora_salida__isnull=True
+                ).exists()
                 
                 if has_active_visit:
                     messages.warning(request, 'Esta persona tiene una salida pendiente. No se puede registrar una nueva visita.')
@@ -376,46 +351,152 @@ def register_visit(request):
         'visit_form': visit_form
     })
 
+def _checkin_error(status, error, **extra):
+    return JsonResponse({'error': error, **extra}, status=status)
+
+
+@require_POST
+def checkin_api(request):
+    """
+    API JSON de ingreso en un solo request: busca o crea la persona por DNI (actualizando sus
+    datos y su foto), valida la tarjeta y registra la visita, todo en una transacción.
+
+    Cuerpo: {"persona": {dni, nombre, apellido, telefono, email, tarjetavisita, observaciones,
+    photo_data_url (foto nueva como data URL) o photo_hash (foto ya guardada)},
+    "visita": {sede, area, receptor_nombre, receptor_apellido, observaciones}}.
+    De una persona existente sólo hace falta enviar lo que cambia. Los usuarios de sede
+    registran siempre en su sede.
+
+    Respuestas: 201 con la visita (como en active_visits_api) y la persona; 400 con `errors`
+    por formulario; 409 si la tarjeta está en uso o la persona ya tiene una visita activa en
+    la sede (con `visit_id` de la visita que la tiene); 403 sin sede asignada.
+    """
+    scope = request.access_scope
+    if not scope.can_register_visits:
+        return _checkin_error(403, 'No tienes una sede asignada. Por favor, contacta con un administrador.')
+    try:
+        data = json.loads(request.body)
+        persona, visita = dict(data.get('persona') or {}), dict(data.get('visita') or {})
+    except (ValueError, TypeError, AttributeError):
+        return _checkin_error(400, 'JSON inválido')
+    if scope.restricted:
+        visita['sede'] = scope.sede_id
+
+    dni = str(persona.get('dni', '')).strip()
+    person = Person.objects.filter(dni=dni).first() if dni.isdigit() else None
+    if person is not None:
+        # Los campos que no se envían conservan su valor
+        persona = {**model_to_dict(person, fields=CheckinPersonForm._meta.fields), **persona}
+    person_form = CheckinPersonForm(persona, instance=person)
+    visit_form = CheckinVisitForm(visita)
+    person_valid, visit_valid = person_form.is_valid(), visit_form.is_valid()
+
+    photo_bytes = None
+    photo_data = person_form.cleaned_data.get('photo_data_url') if person_valid else None
+    if photo_data and ';base64,' in photo_data:
+        try:
+            photo_bytes = base64.b64decode(photo_data.split(';base64,', 1)[1], validate=True)
+        except ValueError:
+            person_form.add_error('photo_data_url', 'La foto no es una imagen en base64 válida')
+            person_valid = False
+    if not (person_valid and visit_valid):
+        return JsonResponse({'errors': {'persona': person_form.errors.get_json_data(),
+                                        'visita': visit_form.errors.get_json_data()}}, status=400)
+
+    person = person_form.save(commit=False)
+    created = person._state.adding
+    # Sólo se guarda la persona si es nueva o cambió algún dato o la foto
+    changed = [name for name in person_form.changed_data if name in CheckinPersonForm._meta.fields]
+    photo_hash = person_form.cleaned_data.get('photo_hash')
+    if photo_bytes:
+        person.photo = photo_bytes
+        changed.append('photo')
+    elif photo_hash and photo_hash != person.photo_hash:
+        person.stored_photo_id = photo_hash
+        changed.append('stored_photo')
+
+    visit = visit_form.save(commit=False)
+    current_datetime = timezone.localtime(timezone.now())
+    visit.fecha = current_datetime.date()
+    visit.hora_entrada = current_datetime.time()
+    visit.created_by = request.user
+    # La tarjeta entregada queda en la visita: la de la persona puede cambiar después
+    visit.tarjeta = person.tarjetavisita or None
+
+    try:
+        with transaction.atomic():
+            if created or changed:
+                person.save()
+            visit.person = person
+            # Las restricciones de la base validan la tarjeta y la visita activa de la persona
+            visit.save()
+    except IntegrityError:
+        # Se informa el motivo sin guardar nada
+        available, error_message, active_visit = validate_tarjeta_visita(visit.tarjeta, visit.sede_id)
+        if not created and active_visit is not None and active_visit.person_id == person.pk:
+            # La misma persona volvió a ingresar con su tarjeta
+            error_message = 'La persona ya tiene una visita activa en esta sede.'
+        elif available and created:
+            error_message = 'Otra terminal registró a la misma persona al mismo tiempo. Vuelva a buscarla por DNI.'
+        elif available:
+            active_visit = Visit.objects.filter(person_id=person.pk, sede_id=visit.sede_id,
+                                                hora_salida__isnull=True).first()
+            error_message = 'La persona ya tiene una visita activa en esta sede.'
+        return _checkin_error(409, error_message, visit_id=active_visit.id if active_visit else None)
+
+    return JsonResponse({
+        'visita': _active_visit_json(visit),
+        'persona': {
+            'id': person.id,
+            'dni': person.dni,
+            'nombre': person.nombre,
+            'apellido': person.apellido,
+            'photo_hash': person.photo_hash,
+        },
+    }, status=201)
+
 def visit_detail(request, visit_id):
     """Vista para ver los detalles de una visita"""
     visit = get_object_or_404(Visit, id=visit_id)
     
-    # Verificar permisos de sede
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
-    
     # Si el usuario no es admin, solo puede ver detalles de visitas de su sede
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-        if not user_sede or visit.sede.id != user_sede.id:
-            messages.error(request, "No tienes permiso para ver detalles de visitas de otras sedes.")
-            return redirect('visit_list')
+    if not request.access_scope.can_access_sede(visit.sede_id):
+        messages.error(request, "No tienes permiso para ver detalles de visitas de otras sedes.")
+        return redirect('visit_list')
     
     return render(request, 'visit_detail.html', {'visit': visit})
 
 def list_visits(request):
     """Vista para listar las visitas activas (alias de visit_list)"""
-    # Obtener la sede del usuario
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
-    
     # Filtrar por sede si el usuario no es admin
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-        visits = Visit.objects.filter(hora_salida__isnull=True, sede=user_sede).order_by('-fecha', '-hora_entrada')
-    else:
-        visits = Visit.objects.filter(hora_salida__isnull=True).order_by('-fecha', '-hora_entrada')
+    visits = Visit.objects.for_scope(request.access_scope).filter(hora_salida__isnull=True).order_by('-fecha', '-hora_entrada')
     
     return render(request, 'list_visits.html', {'visits': visits})
 
-def visit_list(request):
-    """Vista para listar las visitas activas"""
-    # Obtener la sede del usuario
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
+# Visitas activas por página del listado y de la API
+ACTIVE_VISITS_PAGE_SIZE = 50
+# Las consultas de cambios repiten este margen hacia atrás: cubre visitas guardadas en
+# transacciones que confirmaron después de calcular la marca de agua anterior
+ACTIVE_VISITS_DELTA_OVERLAP = timedelta(seconds=5)
+# Con más cambios que estos, el cliente vuelve a cargar la primera página
+ACTIVE_VISITS_DELTA_MAX = 200
 
-    # Filtros GET
+
+def _sedes_in_scope(scope):
+    """Sedes para los filtros de los listados: la del usuario si no es admin"""
+    if scope.sede_filter is not None:
+        return Sede.objects.filter(id=scope.sede_filter)
+    return Sede.objects.all()
+
+
+def _visit_creators(visits):
+    """(id, nombre, apellido, usuario) de los usuarios que crearon las visitas, para los filtros"""
+    user_ids = visits.exclude(created_by__isnull=True).values_list('created_by', flat=True).distinct()
+    return User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name', 'username').order_by('first_name', 'last_name')
+
+
+def _filter_visit_list(request, visits):
+    """Aplica los filtros GET del listado de visitas activas"""
     nombre = request.GET.get('nombre', '').strip()
     apellido = request.GET.get('apellido', '').strip()
     dni = request.GET.get('dni', '').strip()
@@ -426,23 +507,12 @@ def visit_list(request):
     usuario_id = request.GET.get('usuario', '').strip()
     sede_id = request.GET.get('sede', '').strip()
 
-    # Base queryset: solo visitas activas
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-        visits = Visit.objects.filter(hora_salida__isnull=True, sede=user_sede)
-        sedes = Sede.objects.filter(id=user_sede.id)
-    else:
-        visits = Visit.objects.filter(hora_salida__isnull=True)
-        sedes = Sede.objects.all()
-
-    # Aplicar filtros
-    if nombre:
-        visits = visits.filter(person__nombre__icontains=nombre)
-    if apellido:
-        visits = visits.filter(person__apellido__icontains=apellido)
+    if nombre or apellido:
+        visits = visits.filter(person_search_q('person__', nombre=nombre, apellido=apellido))
     if dni:
-        visits = visits.filter(person__dni__icontains=dni)
+        visits = visits.filter(dni_search_q(dni, 'person__'))
     if tarjetavisita:
-        visits = visits.filter(person__tarjetavisita__icontains=tarjetavisita)
+        visits = visits.filter(tarjeta__icontains=tarjetavisita)
     if fecha_inicio:
         visits = visits.filter(fecha__gte=fecha_inicio)
     if fecha_fin:
@@ -453,44 +523,224 @@ def visit_list(request):
         visits = visits.filter(created_by_id=usuario_id)
     if sede_id:
         visits = visits.filter(sede_id=sede_id)
+    return visits
+
+
+def _active_visit_json(visit):
+    """Fila del listado de visitas activas, con los textos ya formateados como en el template"""
+    person = visit.person
+    return {
+        'id': visit.id,
+        'persona': person.get_full_name(),
+        'dni': person.dni,
+        'entrada': f'{visit.fecha:%d/%m/%Y} {visit.hora_entrada:%H:%M}',
+        # Clave de orden del listado (fecha y hora de entrada descendentes, luego id)
+        'orden': f'{visit.fecha.isoformat()} {visit.hora_entrada.isoformat()} {visit.id:012d}',
+        'sede': str(visit.sede) if visit.sede else '',
+        'area': str(visit.area) if visit.area else '',
+        'tarjeta': visit.tarjeta,
+        'foto_url': reverse('person_photo_by_hash_sized', args=[person.photo_hash, 'thumb']) if person.photo_hash else None,
+        'usuario': (visit.created_by.get_full_name() or visit.created_by.username) if visit.created_by else '-',
+        'detalle_url': reverse('visit_detail', kwargs={'visit_id': visit.id}),
+        'salida_url': reverse('register_exit', kwargs={'visit_id': visit.id}),
+    }
 
-    visits = visits.select_related('person', 'sede', 'area', 'created_by').order_by('-fecha', '-hora_entrada')
+
+def visit_list(request):
+    """Vista para listar las visitas activas"""
+    scope_visits = Visit.objects.for_scope(request.access_scope)
+    visits = _filter_visit_list(request, scope_visits.filter(hora_salida__isnull=True))
+    visits = visits.select_related('person', 'sede', 'area', 'created_by')
+
+    # Primera página; las siguientes y los cambios posteriores los pide la página a active_visits_api
+    watermark = timezone.now()
+    page_obj = KeysetPaginator(visits, ACTIVE_VISITS_PAGE_SIZE).get_page()
 
     # Opciones para selects
     areas = Estructura.objects.filter(activo=True).order_by('unidad_organica')
     
-    # Obtener todos los usuarios que han creado visitas activas (sin importar filtros actuales)
-    # Aplicar restricciones de sede si el usuario no es admin
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-        # Solo usuarios que han creado visitas activas en la sede del usuario actual
-        user_ids = Visit.objects.filter(hora_salida__isnull=True, sede=user_sede).exclude(created_by__isnull=True).values_list('created_by', flat=True).distinct()
-        usuarios = User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name', 'username').order_by('first_name', 'last_name')
-    else:
-        # Todos los usuarios que han creado visitas activas
-        user_ids = Visit.objects.filter(hora_salida__isnull=True).exclude(created_by__isnull=True).values_list('created_by', flat=True).distinct()
-        usuarios = User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name', 'username').order_by('first_name', 'last_name')
+    # Usuarios que han creado visitas activas (sin importar filtros actuales), de la sede del usuario si no es admin
+    usuarios = _visit_creators(scope_visits.filter(hora_salida__isnull=True))
 
     return render(request, 'visit_list.html', {
-        'visits': visits,
-        'sedes': sedes,
+        'visits': page_obj,
+        # La tabla la arma el script de la página con los mismos datos que devuelve la API
+        'visits_data': {
+            'visits': [_active_visit_json(visit) for visit in page_obj],
+            'next_cursor': page_obj.next_cursor,
+            'count': page_obj.count,
+            'watermark': watermark.isoformat(),
+        },
+        'sedes': _sedes_in_scope(request.access_scope),
         'areas': areas,
         'usuarios': usuarios,
     })
 
+
+def active_visits_api(request):
+    """
+    API JSON de visitas activas, con los mismos filtros que el listado.
+
+    - Sin `since`: una página de visitas activas (`cursor` pide la siguiente).
+    - Con `since` (la marca de agua de la respuesta anterior): sólo los cambios desde
+      entonces. `visits` son las visitas activas nuevas o modificadas y `removed` los ids
+      modificados que ya no corresponde mostrar (se registró la salida o dejaron de cumplir
+      los filtros). Una visita borrada o pasada a una sede fuera del alcance no vuelve a
+      aparecer en la consulta: `count` es el total actual y, si no coincide con el del
+      cliente después de aplicar los cambios, el cliente recarga el listado.
+    Toda respuesta trae `watermark` para la consulta siguiente.
+    """
+    scope = Visit.objects.for_scope(request.access_scope)
+    # La marca de agua se toma antes de consultar: lo que cambie durante la consulta vuelve a salir
+    watermark = timezone.now()
+
+    since = request.GET.get('since')
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return JsonResponse({'error': 'Parámetro since inválido'}, status=400)
+        changed = list(
+            scope.filter(updated_at__gte=since - ACTIVE_VISITS_DELTA_OVERLAP)
+            .order_by().values_list('id', 'hora_salida')[:ACTIVE_VISITS_DELTA_MAX + 1]
+        )
+        if len(changed) > ACTIVE_VISITS_DELTA_MAX:
+            return JsonResponse({'reload': True, 'watermark': watermark.isoformat()})
+        changed_ids = [visit_id for visit_id, _hora_salida in changed]
+        visits = list(
+            _filter_visit_list(request, scope.filter(id__in=changed_ids, hora_salida__isnull=True))
+            .select_related('person', 'sede', 'area', 'created_by')
+        )
+        shown = {visit.id for visit in visits}
+        return JsonResponse({
+            'visits': [_active_visit_json(visit) for visit in visits],
+            'removed': [visit_id for visit_id in changed_ids if visit_id not in shown],
+            'count': _filter_visit_list(request, scope.filter(hora_salida__isnull=True)).count(),
+            'watermark': watermark.isoformat(),
+        })
+
+    visits = _filter_visit_list(request, scope.filter(hora_salida__isnull=True))
+    visits = visits.select_related('person', 'sede', 'area', 'created_by')
+    page_obj = KeysetPaginator(visits, ACTIVE_VISITS_PAGE_SIZE).get_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'visits': [_active_visit_json(visit) for visit in page_obj],
+        'next_cursor': page_obj.next_cursor,
+        'count': page_obj.count,
+        'watermark': watermark.isoformat(),
+    })
+
+
+def _requested_sede_id(request):
+    """
+    Sede a la que se limita la consulta: la del alcance del usuario si está restringido, si no
+    la del parámetro `sede` (admin); None para todas, como en Visit.for_scope.
+    """
+    if request.access_scope.sede_filter is not None:
+        return request.access_scope.sede_filter
+    sede_id = request.GET.get('sede', '').strip()
+    return int(sede_id) if sede_id.isdigit() else None
+
+
+async def _visit_event_stream(sede_id):
+    with VISIT_EVENTS.subscribe(sede_id) as subscription:
+        # El navegador reintenta a los 5 s si se corta la conexión
+        yield 'retry: 5000\n\n'
+        while True:
+            message = await subscription.get(timeout=HEARTBEAT_SECONDS)
+            if message is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+async def visit_events(request):
+    """
+    Server-Sent Events de ingresos, salidas y tarjetas liberadas de la sede del usuario
+    (de todas, o de la sede pedida en `sede`, para los administradores).
+
+    Sólo funciona servida por ASGI; con WSGI (runserver) responde 204 y el navegador deja
+    de reintentar: el listado se actualiza con la consulta periódica de active_visits_api.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    sede_id = await sync_to_async(_requested_sede_id)(request)
+    response = StreamingHttpResponse(_visit_event_stream(sede_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Que nginx no acumule los eventos en su buffer
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# Agrupaciones de la API de estadísticas: campos de VisitRollup (el último da la etiqueta)
+VISIT_STATS_GROUPS = {
+    'dia': ('fecha',),
+    'sede': ('sede', 'sede__nombre'),
+    'area': ('area', 'area__siglas'),
+    'usuario': ('created_by', 'created_by__username'),
+}
+VISIT_STATS_DEFAULT_DAYS = 30
+
+
+def visit_stats_api(request):
+    """
+    API JSON de estadísticas de visitas desde los resúmenes diarios (VisitRollup).
+
+    Parámetros: `desde` y `hasta` (AAAA-MM-DD; por defecto los últimos 30 días), `agrupar`
+    (dia, sede, area o usuario) y, para administradores, `sede`. Los usuarios de sede sólo
+    ven su sede. `actualizado` es hasta cuándo se procesaron las visitas.
+    """
+    hoy = timezone.localdate()
+    try:
+        hasta = parse_date(request.GET['hasta']) if request.GET.get('hasta') else hoy
+        desde = (parse_date(request.GET['desde']) if request.GET.get('desde')
+                 else hoy - timedelta(days=VISIT_STATS_DEFAULT_DAYS - 1))
+    except ValueError:
+        # Fecha con formato correcto pero inexistente (2025-02-30)
+        desde = hasta = None
+    if desde is None or hasta is None or desde > hasta:
+        return JsonResponse({'error': 'Rango de fechas inválido'}, status=400)
+    agrupar = request.GET.get('agrupar', 'dia')
+    if agrupar not in VISIT_STATS_GROUPS:
+        return JsonResponse({'error': 'Agrupación inválida'}, status=400)
+    fields = VISIT_STATS_GROUPS[agrupar]
+
+    series = []
+    for row in VisitRollup.objects.stats(desde, hasta, fields, sede=_requested_sede_id(request)):
+        series.append({
+            'clave': str(row[fields[0]]) if row[fields[0]] is not None else None,
+            'etiqueta': str(row[fields[-1]]) if row[fields[-1]] is not None else 'Sin usuario',
+            'visitas': row['visitas'],
+            'visitas_cerradas': row['visitas_cerradas'],
+            'personas': row['personas'],
+            'duracion_promedio_minutos': (round(row['duracion_segundos'] / row['visitas_cerradas'] / 60, 1)
+                                          if row['visitas_cerradas'] else None),
+        })
+    if agrupar == 'dia':
+        # Los días sin visitas también van en la serie, con cero
+        by_day = {item['clave']: item for item in series}
+        series = []
+        for offset in range((hasta - desde).days + 1):
+            day = str(desde + timedelta(days=offset))
+            series.append(by_day.get(day) or {
+                'clave': day, 'etiqueta': day, 'visitas': 0, 'visitas_cerradas': 0,
+                'personas': 0, 'duracion_promedio_minutos': None,
+            })
+
+    state = RollupState.objects.filter(nombre=VisitRollup.STATE_NAME).first()
+    return JsonResponse({
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'agrupar': agrupar,
+        'series': series,
+        'actualizado': state.procesado_hasta.isoformat() if state and state.procesado_hasta else None,
+    })
+
 def checkout_visit(request, visit_id):
     """Vista para registrar la salida de una visita"""
     visit = get_object_or_404(Visit, id=visit_id)
     
-    # Verificar permisos de sede
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
-    
     # Si el usuario no es admin, solo puede registrar salidas de su sede
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-        if not user_sede or visit.sede.id != user_sede.id:
-            messages.error(request, "No tienes permiso para registrar la salida de visitas de otras sedes.")
-            return redirect('visit_list')
+    if not request.access_scope.can_access_sede(visit.sede_id):
+        messages.error(request, "No tienes permiso para registrar la salida de visitas de otras sedes.")
+        return redirect('visit_list')
     
     if request.method == 'POST':
         # Usar timezone de Django para obtener la fecha y hora actual en Argentina
@@ -500,8 +750,8 @@ def checkout_visit(request, visit_id):
         visit.save()
         
         # Mensaje de éxito con información sobre la tarjeta de visita
-        if visit.person.tarjetavisita:
-            messages.success(request, f'Salida registrada exitosamente. La tarjeta #{visit.person.tarjetavisita} está ahora disponible.')
+        if visit.tarjeta:
+            messages.success(request, f'Salida registrada exitosamente. La tarjeta #{visit.tarjeta} está ahora disponible.')
         else:
             messages.success(request, 'Salida registrada exitosamente.')
             
@@ -513,16 +763,10 @@ def register_exit(request, visit_id):
     """Vista para registrar la salida de una visita (alias de checkout_visit)"""
     visit = get_object_or_404(Visit, id=visit_id)
     
-    # Verificar permisos de sede
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
-    
     # Si el usuario no es admin, solo puede registrar salidas de su sede
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin:
-        if not user_sede or visit.sede.id != user_sede.id:
-            messages.error(request, "No tienes permiso para registrar la salida de visitas de otras sedes.")
-            return redirect('visit_list')
+    if not request.access_scope.can_access_sede(visit.sede_id):
+        messages.error(request, "No tienes permiso para registrar la salida de visitas de otras sedes.")
+        return redirect('visit_list')
     
     if request.method == 'POST':
         # Usar timezone de Django para obtener la fecha y hora actual en Argentina
@@ -532,8 +776,8 @@ def register_exit(request, visit_id):
         visit.save()
         
         # Mensaje de éxito con información sobre la tarjeta de visita
-        if visit.person.tarjetavisita:
-            messages.success(request, f'Salida registrada exitosamente. La tarjeta #{visit.person.tarjetavisita} está ahora disponible.')
+        if visit.tarjeta:
+            messages.success(request, f'Salida registrada exitosamente. La tarjeta #{visit.tarjeta} está ahora disponible.')
         else:
             messages.success(request, 'Salida registrada exitosamente.')
             
@@ -541,32 +785,6 @@ def register_exit(request, visit_id):
     
     return render(request, 'register_exit.html', {'visit': visit})
 
-def get_person_photo(request):
-    """Vista para obtener la foto de una persona en formato base64"""
-    person_id = request.GET.get('person_id')
-    if person_id:
-        try:
-            person = Person.objects.get(id=person_id)
-            if person.photo:
-                # Convertir la foto a base64
-                photo_base64 = base64.b64encode(person.photo).decode('utf-8')
-                return JsonResponse({'photo': photo_base64})
-            else:
-                return JsonResponse({'photo': None})
-        except Person.DoesNotExist:
-            return JsonResponse({'error': 'Persona no encontrada'}, status=404)
-    return JsonResponse({'error': 'ID de persona no proporcionado'}, status=400)
-
-def get_person_photo_direct(request, person_id):
-    """Vista para obtener la foto de una persona directamente como imagen"""
-    person = get_object_or_404(Person, id=person_id)
-    
-    if person.photo:
-        return HttpResponse(person.photo, content_type='image/jpeg')
-    else:
-        # Devolver una imagen por defecto o un error 404
-        return HttpResponse(status=404)
-
 def check_tarjeta_disponible(request):
     """
     Vista AJAX para verificar si una tarjeta de visita está disponible en una sede.
@@ -577,12 +795,8 @@ def check_tarjeta_disponible(request):
     if not tarjeta or not sede_id:
         return JsonResponse({'available': True})
     
-    # Buscar visitas activas con esta tarjeta en esta sede
-    active_visit = Visit.objects.filter(
-        person__tarjetavisita=tarjeta,
-        sede_id=sede_id,
-        hora_salida__isnull=True
-    ).first()
+    # Buscar la visita activa con esta tarjeta en esta sede
+    active_visit = Visit.objects.active_with_tarjeta(tarjeta, sede_id)
     
     if active_visit:
         person = active_visit.person
@@ -606,12 +820,8 @@ def validate_tarjeta_visita(tarjeta, sede_id):
     if not tarjeta or not sede_id:
         return True, None, None
     
-    # Buscar visitas activas con esta tarjeta en esta sede
-    active_visit = Visit.objects.filter(
-        person__tarjetavisita=tarjeta,
-        sede_id=sede_id,
-        hora_salida__isnull=True
-    ).first()
+    # Buscar la visita activa con esta tarjeta en esta sede
+    active_visit = Visit.objects.active_with_tarjeta(tarjeta, sede_id)
     
     if active_visit:
         person = active_visit.person
@@ -632,11 +842,6 @@ def mostrar_buscador_internos(request):
 
 def visit_history(request):
     """Vista para listar el histórico completo de visitas (con y sin salida)"""
-    # Obtener la sede del usuario
-    user_sede = None
-    if hasattr(request.user, 'profile'):
-        user_sede = request.user.profile.sede
-
     # Filtros GET
     nombre = request.GET.get('nombre', '').strip()
     apellido = request.GET.get('apellido', '').strip()
@@ -649,23 +854,17 @@ def visit_history(request):
     sede_id = request.GET.get('sede', '').strip()
     estado = request.GET.get('estado', '').strip()  # 'activas', 'completadas', '' para todas
 
-    # Base queryset: todas las visitas
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-        visits = Visit.objects.filter(sede=user_sede)
-        sedes = Sede.objects.filter(id=user_sede.id)
-    else:
-        visits = Visit.objects.all()
-        sedes = Sede.objects.all()
+    # Base queryset: todas las visitas (las de la sede del usuario si no es admin)
+    scope_visits = Visit.objects.for_scope(request.access_scope)
+    visits = scope_visits
 
     # Aplicar filtros
-    if nombre:
-        visits = visits.filter(person__nombre__icontains=nombre)
-    if apellido:
-        visits = visits.filter(person__apellido__icontains=apellido)
+    if nombre or apellido:
+        visits = visits.filter(person_search_q('person__', nombre=nombre, apellido=apellido))
     if dni:
-        visits = visits.filter(person__dni__icontains=dni)
+        visits = visits.filter(dni_search_q(dni, 'person__'))
     if tarjetavisita:
-        visits = visits.filter(person__tarjetavisita__icontains=tarjetavisita)
+        visits = visits.filter(tarjeta__icontains=tarjetavisita)
     if fecha_inicio:
         visits = visits.filter(fecha__gte=fecha_inicio)
     if fecha_fin:
@@ -685,28 +884,18 @@ def visit_history(request):
 
     visits = visits.select_related('person', 'sede', 'area', 'created_by').order_by('-fecha', '-hora_entrada')
 
-    # Paginación
-    paginator = Paginator(visits, 50)  # 50 por página
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Paginación por cursor: cada página sigue a la anterior por (fecha, hora_entrada, id), sin OFFSET
+    page_obj = KeysetPaginator(visits, 50).get_page(request.GET.get('cursor'))
 
     # Opciones para selects
     areas = Estructura.objects.filter(activo=True).order_by('unidad_organica')
     
-    # Obtener todos los usuarios que han creado visitas (sin importar filtros actuales)
-    # Aplicar restricciones de sede si el usuario no es admin
-    if not request.user.is_superuser and hasattr(request.user, 'profile') and not request.user.profile.is_admin and user_sede:
-        # Solo usuarios que han creado visitas en la sede del usuario actual
-        user_ids = Visit.objects.filter(sede=user_sede).exclude(created_by__isnull=True).values_list('created_by', flat=True).distinct()
-        usuarios = User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name', 'username').order_by('first_name', 'last_name')
-    else:
-        # Todos los usuarios que han creado visitas
-        user_ids = Visit.objects.exclude(created_by__isnull=True).values_list('created_by', flat=True).distinct()
-        usuarios = User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name', 'username').order_by('first_name', 'last_name')
+    # Usuarios que han creado visitas (sin importar filtros actuales), de la sede del usuario si no es admin
+    usuarios = _visit_creators(scope_visits)
 
     return render(request, 'visit_history.html', {
         'visits': page_obj,
-        'sedes': sedes,
+        'sedes': _sedes_in_scope(request.access_scope),
         'areas': areas,
         'usuarios': usuarios,
     })
\ No newline at end of file